@@ -3,6 +3,7 @@ import os
 import shutil
 from .base import BaseCommand
 from src.repository import Repository
+from src.fsmonitor import FSMonitor
 
 class CloneCommand(BaseCommand):
     def run(self, print_output=True):
@@ -30,10 +31,14 @@ class CloneCommand(BaseCommand):
             if print_output:
                 print(f"Cloning into '{dest_path}'...")
             
+            # Skip what belongs to a running process: the fsmonitor socket and cookies, locks and temp files
             dest_bit_dir = os.path.join(dest_path, '.bit')
-            shutil.copytree(source_bit_dir, dest_bit_dir)
+            shutil.copytree(source_bit_dir, dest_bit_dir,
+                            ignore=shutil.ignore_patterns(FSMonitor.SOCKET_NAME, FSMonitor.COOKIE_PREFIX + '*', '*.lock', '*.tmp'))
 
+            # The untracked cache and fsmonitor token describe the source worktree; write() drops them
             new_repo = Repository(os.path.abspath(dest_path))
+            new_repo.index.write(*new_repo.index.load())
             current_branch = new_repo.current_branch()
             new_repo.checkout(current_branch, force=True)
             
@@ -41,4 +46,5 @@ class CloneCommand(BaseCommand):
                 print("Done.")
             
         except Exception as e:
+            shutil.rmtree(dest_path, ignore_errors=True)
             sys.stderr.write(f"Error during clone: {e}\n")
\ No newline at end of file
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import subprocess
+from .base import BaseCommand
+from src.fsmonitor import FSMonitor
+
+class FsmonitorCommand(BaseCommand):
+    USAGE = "Usage: bit fsmonitor (start | stop | status | run) [--poll]\n"
+    START_TIMEOUT = 5
+
+    def run(self):
+        args = [arg for arg in self.args if arg != '--poll']
+        force_polling = len(args) != len(self.args)
+        if len(args) != 1 or args[0] not in ("start", "stop", "status", "run"):
+            sys.stderr.write(self.USAGE)
+            return
+
+        if not self._check_repo_exists():
+            return
+
+        try:
+            if args[0] == "run":
+                daemon = self.repo.fsmonitor_daemon(force_polling)
+                print(f"Watching '{self.repo.worktree.path}' with {daemon.backend}.")
+                sys.stdout.flush()
+                daemon.serve()
+            elif args[0] == "start":
+                self._start(force_polling)
+            elif args[0] == "stop":
+                if self.repo.stop_fsmonitor():
+                    print("fsmonitor stopped.")
+                else:
+                    print("fsmonitor is not running.")
+            elif FSMonitor.query(self.repo.fsmonitor_socket, None) is not None:
+                print(f"fsmonitor is watching '{self.repo.worktree.path}'.")
+            else:
+                print("fsmonitor is not running.")
+        except Exception as e:
+            sys.stderr.write(f"Error: {e}\n")
+
+    def _start(self, force_polling):
+        if FSMonitor.query(self.repo.fsmonitor_socket, None) is not None:
+            print("fsmonitor is already running.")
+            return
+
+        command = [sys.executable, os.path.abspath(sys.argv[0]), "fsmonitor", "run"]
+        if force_polling:
+            command.append("--poll")
+        subprocess.Popen(command, cwd=self.repo.worktree.path, start_new_session=True,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + self.START_TIMEOUT
+        while time.monotonic() < deadline:
+            if FSMonitor.query(self.repo.fsmonitor_socket, None) is not None:
+                print("fsmonitor started. Run 'bit config core.fsmonitor true' to use it.")
+                return
+            time.sleep(0.05)
+        sys.stderr.write("Error: fsmonitor did not start\n")
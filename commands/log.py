@@ -1,7 +1,15 @@
+import sys
+import itertools
 from .base import BaseCommand
-from pager import Pager 
+from pager import Pager
+from src.log_graph import LogGraph
+from src.ref import Ref
 
 class LogCommand(BaseCommand):
+    USAGE = ("Usage: bit log [-n <number> | --max-count=<number>] [--skip=<number>]\n"
+             "               [--all] [--topo-order | --date-order] [--graph] [-- <path>...]\n")
+    FLAGS = ('--all', '--topo-order', '--date-order', '--graph')
+
     def __init__(self, repo, args):
         super().__init__(repo, args)
         self.pager = Pager()
@@ -10,13 +18,70 @@ class LogCommand(BaseCommand):
         if not self._check_repo_exists():
             return
 
-        logs = self.repo.log()
-        
-        if not logs:
-            print("No commits yet.")
+        options = self._parse_options()
+        if options is None:
+            sys.stderr.write(self.USAGE)
+            return
+        graph = LogGraph() if options.pop('graph') else None
+
+        logs = self.repo.log(**options)
+        first = next(logs, None)
+
+        if first is None:
+            # -n 0 or a --skip past the end just leave nothing to show
+            if not Ref.from_symbol(self.repo, 'HEAD').read_hash():
+                print("No commits yet.")
             return
 
-        for log_entry in logs:
-            self.pager.append_line(log_entry.format() + '\n')
-            
-        self.pager.display()
+        self.pager.stream(self._lines(first, logs, graph))
+
+    # ----- UTILS -----
+    @staticmethod
+    def _lines(first, logs, graph=None):
+        """Formats each entry only when the pager asks for more output."""
+        for log_entry in itertools.chain([first], logs):
+            text = log_entry.format() + '\n'
+            if graph is not None:
+                text = graph.format(log_entry.hash, log_entry.commit.parent_hashes, text)
+            yield text
+
+    def _parse_options(self):
+        """Returns the options as Repository.log arguments plus 'graph', or None if the arguments are invalid."""
+        max_count = None
+        skip = 0
+        flags = set()
+        paths = None
+        args = list(self.args)
+        while args:
+            arg = args.pop(0)
+            if arg == '--':
+                paths, args = args, []
+                continue
+            if arg in self.FLAGS:
+                flags.add(arg)
+                continue
+            name, has_value, value = arg.partition('=')
+            if arg.startswith('-n') and len(arg) > 2:
+                name, value, has_value = '-n', arg[2:], True
+            if name not in ('-n', '--max-count', '--skip'):
+                return None
+            if not has_value:
+                if not args:
+                    return None
+                value = args.pop(0)
+            if not value.isdigit():
+                return None
+            if name == '--skip':
+                skip = int(value)
+            else:
+                max_count = int(value)
+        if {'--topo-order', '--date-order'} <= flags:
+            return None
+        # Commits left out by the paths would leave the graph's lines dangling
+        if paths is not None and '--graph' in flags:
+            return None
+
+        # The graph can only be drawn when no commit comes before its children
+        topo_order = '--topo-order' in flags or '--graph' in flags
+        return {'max_count': max_count, 'skip': skip, 'all': '--all' in flags,
+                'topo_order': topo_order, 'paths': paths, 'graph': '--graph' in flags}
@@ -0,0 +1,18 @@
+import sys
+from .base import BaseCommand
+
+class MigrateObjectsCommand(BaseCommand):
+    def run(self):
+        if len(self.args) > 0:
+            sys.stderr.write("Usage: bit migrate-objects\n")
+            return
+
+        if not self._check_repo_exists():
+            return
+
+        migrated = self.repo.db.migrate_objects()
+
+        if migrated > 0:
+            print(f"Migrated {migrated} object(s).")
+        else:
+            print("Object store is already up to date.")
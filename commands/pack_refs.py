@@ -0,0 +1,14 @@
+import sys
+from .base import BaseCommand
+
+class PackRefsCommand(BaseCommand):
+    def run(self):
+        if self.args not in ([], ['--no-prune']):
+            sys.stderr.write("Usage: bit pack-refs [--no-prune]\n")
+            return
+
+        if not self._check_repo_exists():
+            return
+
+        ref_count = self.repo.pack_refs(prune=not self.args)
+        print(f"Packed {ref_count} ref(s).")
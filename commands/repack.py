@@ -0,0 +1,18 @@
+import sys
+from .base import BaseCommand
+
+class RepackCommand(BaseCommand):
+    def run(self):
+        if len(self.args) > 0:
+            sys.stderr.write("Usage: bit repack\n")
+            return
+
+        if not self._check_repo_exists():
+            return
+
+        object_count, delta_count = self.repo.repack()
+
+        if object_count > 0:
+            print(f"Packed {object_count} loose object(s), {delta_count} as deltas.")
+        else:
+            print("No loose objects to pack.")
@@ -24,39 +24,55 @@ class Pager:
         self.content.append(line)
 
     def display(self, raw_content=None):
+        """Displays the given content (or the appended lines) using the pager if possible."""
         content = raw_content if raw_content else '\n'.join(self.content)
-        """Displays the given content using the pager if possible."""
+        self.stream(content.split('\n'))
+
+    def stream(self, lines):
+        """
+        Writes lines to the pager (or stdout) as they are produced, so output
+        starts before the producer has finished. If the reader goes away, e.g.
+        the user quits the pager or `head` has seen enough, the producer is
+        simply not asked for more lines.
+        """
         # Only use pager if output is to a real terminal
         if not self.use_pager or not sys.stdout.isatty():
-            print(content)
+            self._write_to_stdout(lines)
             return
 
         try:
             pager_proc = subprocess.Popen(self.pager_command, stdin=subprocess.PIPE, stdout=sys.stdout)
-            try:
-                # Pipe the content to the pager
-                pager_proc.stdin.write(content.encode('utf-8'))
-            except (IOError, BrokenPipeError):
-                # Happens if the user quits the pager early (e.g., 'q')
-                pass
-            
-            pager_proc.stdin.close()
-            pager_proc.wait()
-
         except FileNotFoundError:
             # Pager command not found, fall back to simple printing
-            print("ERROR")
-            print(content)
+            self._write_to_stdout(lines)
+            return
+
+        try:
+            for line in lines:
+                pager_proc.stdin.write(line.encode('utf-8') + b'\n')
+        except (IOError, BrokenPipeError):
+            # Happens if the user quits the pager early (e.g., 'q')
+            pass
         except KeyboardInterrupt:
             # User pressed Ctrl-C
             pass
         finally:
-            # Ensure stdin is properly closed if something went wrong
-            if 'pager_proc' in locals() and pager_proc.stdin:
-                 try:
-                     pager_proc.stdin.close()
-                 except (IOError, BrokenPipeError):
-                     pass # Already closed or broken pipe
-    
+            try:
+                pager_proc.stdin.close()
+            except (IOError, BrokenPipeError):
+                pass # Already closed or broken pipe
+            pager_proc.wait()
+
     def clear(self):
         self.content = []
+
+    # ----- UTILS -----
+    @staticmethod
+    def _write_to_stdout(lines):
+        try:
+            for line in lines:
+                sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader exited; point stdout at /dev/null so the flush at exit doesn't fail too
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
@@ -0,0 +1,57 @@
+import hashlib
+
+class BloomFilter:
+    """
+    A Bloom filter of the paths a commit changed compared to its first parent,
+    plus every directory leading to them. A miss means the commit definitely
+    didn't touch a path; a hit only means it may have.
+
+    An empty filter stands for a commit that changed too many paths to be
+    worth filtering, and matches everything.
+    """
+
+    BITS_PER_ENTRY = 10
+    NUM_HASHES = 7
+    MAX_CHANGED_PATHS = 512
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    @classmethod
+    def from_paths(cls, paths):
+        """Builds the filter of a set of changed file paths."""
+        keys = set()
+        for path in paths:
+            keys.update(cls.keys_of(path))
+        if len(keys) > cls.MAX_CHANGED_PATHS:
+            return cls(b'')
+
+        bloom = cls(bytes(max(1, (len(keys) * cls.BITS_PER_ENTRY + 7) // 8)))
+        for key in keys:
+            for bit in bloom._bits(key):
+                bloom.data[bit // 8] |= 1 << (bit % 8)
+        return bloom
+
+    @staticmethod
+    def keys_of(path):
+        """Returns a path and the directories leading to it, e.g. a/b/c, a/b and a."""
+        parts = path.strip('/').split('/')
+        return ['/'.join(parts[:i]) for i in range(len(parts), 0, -1)]
+
+    def might_contain(self, path):
+        if not self.data:
+            return True
+        key = path.strip('/')
+        return all(self.data[bit // 8] & (1 << (bit % 8)) for bit in self._bits(key))
+
+    def serialize(self):
+        return bytes(self.data)
+
+    # ----- UTILS -----
+    def _bits(self, key):
+        """Derives the filter's bit positions for a key from two 32-bit hashes."""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        first = int.from_bytes(digest[:4], 'big')
+        second = int.from_bytes(digest[4:], 'big')
+        size = len(self.data) * 8
+        return [(first + i * second) % size for i in range(self.NUM_HASHES)]
@@ -0,0 +1,53 @@
+import struct
+
+class CacheTree:
+    """
+    Remembers the tree hash of every directory in the index whose contents
+    haven't changed since its tree object was last written.
+    Directories are keyed by their slash-separated path, "" being the root.
+    """
+
+    SIGNATURE = b'TREE'
+    PATH_LENGTH = struct.Struct('>I')
+
+    def __init__(self, trees=None):
+        self.trees = trees if trees is not None else {}
+        self.dirty = False
+
+    def get(self, directory):
+        return self.trees.get(directory)
+
+    def set(self, directory, tree_hash):
+        if self.trees.get(directory) != tree_hash:
+            self.trees[directory] = tree_hash
+            self.dirty = True
+
+    def invalidate(self, path):
+        """Drops the cached hashes of every directory containing the given file path."""
+        components = path.split('/')[:-1]
+        for i in range(len(components), -1, -1):
+            directory = '/'.join(components[:i])
+            if self.trees.pop(directory, None) is not None:
+                self.dirty = True
+
+    def serialize(self):
+        parts = []
+        for directory in sorted(self.trees):
+            path_bytes = directory.encode('utf-8')
+            parts.append(self.PATH_LENGTH.pack(len(path_bytes)))
+            parts.append(path_bytes)
+            parts.append(bytes.fromhex(self.trees[directory]))
+        return b''.join(parts)
+
+    @classmethod
+    def parse(cls, data):
+        trees = {}
+        offset = 0
+        while offset < len(data):
+            (path_length,) = cls.PATH_LENGTH.unpack_from(data, offset)
+            offset += cls.PATH_LENGTH.size
+            directory = bytes(data[offset:offset + path_length]).decode('utf-8')
+            offset += path_length
+            trees[directory] = bytes(data[offset:offset + 20]).hex()
+            offset += 20
+        return cls(trees)
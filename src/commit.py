@@ -3,6 +3,9 @@ from .formatter import Formatter
 
 class Commit:
     """Represents a commit object."""
+
+    # Generation of commits missing from the commit-graph: none of the graph's commits can have them as ancestors
+    GENERATION_INFINITY = 0xFFFFFFFF
     
     def __init__(self, tree_hash, parent_hashes, message, author="Anonymous", email="unknown@example.com", timestamp=None, timezone=None, committer_name=None, committer_email=None):
         self.tree_hash = tree_hash
@@ -26,6 +29,49 @@ class Commit:
       metadata = "\n".join(lines)
       return f"{metadata}\n\n{self.message}"
 
+    @classmethod
+    def load(cls, database, commit_hash):
+        """
+        Reads and parses a commit. Commits are immutable, so the parsed object
+        is memoized in the database's parsed-object cache.
+        """
+        key = ('commit', commit_hash)
+        commit = database.parsed_cache.get(key)
+        if commit is None:
+            raw_data_bytes = database.read(commit_hash)
+            commit = cls.parse(raw_data_bytes)
+            database.parsed_cache.put(key, commit, len(raw_data_bytes))
+        return commit
+
+    @classmethod
+    def tree_hash_of(cls, database, commit_hash):
+        """Returns the root tree hash of a commit, or None when there is no commit."""
+        if not commit_hash:
+            return None
+        graph = database.commit_graph
+        position = graph.position(commit_hash) if graph is not None else None
+        if position is not None:
+            return graph.tree_hash_at(position)
+        return cls.load(database, commit_hash).tree_hash
+
+    @classmethod
+    def parents_of(cls, database, commit_hash):
+        """Returns the parent hashes of a commit, from the commit-graph when it has the commit."""
+        graph = database.commit_graph
+        parents = graph.parents(commit_hash) if graph is not None else None
+        if parents is None:
+            parents = cls.load(database, commit_hash).parent_hashes
+        return parents
+
+    @classmethod
+    def rank_of(cls, database, commit_hash):
+        """Returns (generation, commit time), from the commit-graph when it has the commit."""
+        graph = database.commit_graph
+        position = graph.position(commit_hash) if graph is not None else None
+        if position is not None:
+            return graph.generation_at(position), graph.commit_time_at(position)
+        return cls.GENERATION_INFINITY, cls.load(database, commit_hash).timestamp
+
     @classmethod
     def parse(cls, raw_data_bytes):
         raw_data = raw_data_bytes.decode('utf-8')
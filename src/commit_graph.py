@@ -0,0 +1,444 @@
+import os
+import mmap
+import bisect
+import hashlib
+import struct
+from .commit import Commit
+from .pack import HashTable
+from .tree import Tree
+from .bloom_filter import BloomFilter
+
+class CommitGraph:
+    """
+    Reads the commit-graph file, which holds what history walks need from
+    every commit (parents, root tree, commit time and generation number) in
+    fixed-width records, so they don't have to inflate and parse commit
+    objects. The file is memory-mapped once and searched like a pack index.
+
+    A root commit has generation 1 and any other commit one more than its
+    highest parent, so a commit can only be an ancestor of commits with a
+    higher generation.
+
+    Commits made since the last full write are kept in layers on top of it:
+    files of the same layout in info/commit-graphs, named after their trailer
+    and listed bottom to top in the commit-graph-chain file. A layer is read
+    with the graph below it as its base, and positions run across the whole
+    stack: the base's commits come first, and a layer's parent fields can
+    point into any layer below. Those positions only hold for the exact file
+    the layer was written on, so each chain line also records that file's
+    trailer, and the chain is cut off where it no longer matches.
+
+    Layout (integers big-endian):
+        header   signature "BCGR", version, commit count, extra edge count
+        fan-out  256 cumulative counts of hashes by first byte
+        hashes   the sorted raw 20-byte commit hashes
+        records  per commit, in hash order: raw 20-byte tree hash, first and
+                 second parent positions, commit time, generation
+        edges    parents of octopus merges: their second-parent field holds
+                 EXTRA_EDGES | the index of their first extra parent here,
+                 and the last one of a commit has LAST_EDGE set
+        blooms   (version 2) per commit, in hash order, the end offset of its
+                 changed-path Bloom filter in the data below
+        data     (version 2) the Bloom filters, back to back
+        trailer  SHA-1 of everything above
+
+    Version 1 graphs, written before Bloom filters, are still read.
+    """
+
+    SIGNATURE = b'BCGR'
+    VERSION = 2
+    VERSIONS = (1, 2)
+    HEADER = struct.Struct('>4sIII')
+    FANOUT = struct.Struct('>256I')
+    RECORD = struct.Struct('>20sIIQI')
+    EDGE = struct.Struct('>I')
+
+    NO_PARENT = 0xFFFFFFFF
+    EXTRA_EDGES = 0x80000000
+    LAST_EDGE = 0x80000000
+
+    LAYERS_DIR = 'commit-graphs'
+    CHAIN_FILE = 'commit-graph-chain'
+
+    def __init__(self, path, base=None):
+        self.path = path
+        self.base = base
+        self.base_count = base.count if base is not None else 0
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, self.layer_count, self.edge_count = self.HEADER.unpack_from(self.data)
+        if signature != self.SIGNATURE or version not in self.VERSIONS:
+            self.data.close()
+            raise Exception(f"Unsupported commit-graph '{path}'")
+        self.version = version
+        self.checksum = self.data[-20:].hex()
+        self.count = self.base_count + self.layer_count
+        self.fanout = self.FANOUT.unpack_from(self.data, self.HEADER.size)
+        self.hashes_start = self.HEADER.size + self.FANOUT.size
+        self.records_start = self.hashes_start + 20 * self.layer_count
+        self.edges_start = self.records_start + self.RECORD.size * self.layer_count
+        self.blooms_start = self.edges_start + self.EDGE.size * self.edge_count
+        self.bloom_data_start = self.blooms_start + self.EDGE.size * self.layer_count
+        self.hash_table = HashTable(self.data, self.hashes_start, self.layer_count)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Opens the commit-graph at path with the layers its chain lists on top,
+        or returns None if there is none. The chain stops at the first layer
+        that has gone missing, whose trailer doesn't match its name, or that
+        was written on top of a different file than the one below it now (say,
+        a gc rewrote the base while a commit was adding a layer): the layers
+        from there up would point at the wrong parents.
+        """
+        if not os.path.exists(path):
+            return None
+        graph = cls(path)
+        layers_dir = os.path.join(os.path.dirname(path), cls.LAYERS_DIR)
+        for name, base_checksum in cls.read_chain(layers_dir):
+            if base_checksum != graph.checksum:
+                break
+            try:
+                layer = cls(os.path.join(layers_dir, name), graph)
+            except FileNotFoundError:
+                break
+            if name != cls.layer_name(layer.checksum):
+                layer.data.close()
+                break
+            graph = layer
+        return graph
+
+    @classmethod
+    def read_chain(cls, layers_dir):
+        """Returns (layer file name, trailer of the file below it) for the chain in layers_dir, bottom first."""
+        try:
+            with open(os.path.join(layers_dir, cls.CHAIN_FILE), 'r') as f:
+                return [tuple(line.split()) for line in f if len(line.split()) == 2]
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def layer_name(checksum):
+        return f"graph-{checksum}.graph"
+
+    def __contains__(self, hash):
+        return self.position(hash) is not None
+
+    def position(self, hash):
+        """Returns the position of a commit in the graph, or None if it isn't in it."""
+        raw = bytes.fromhex(hash)
+        layer = self
+        while layer is not None:
+            lo = layer.fanout[raw[0] - 1] if raw[0] else 0
+            hi = layer.fanout[raw[0]]
+            i = bisect.bisect_left(layer.hash_table, raw, lo, hi)
+            if i < hi and layer.hash_table[i] == raw:
+                return layer.base_count + i
+            layer = layer.base
+        return None
+
+    def layers(self):
+        """Returns the graph files of the stack, the full one first."""
+        layers = []
+        layer = self
+        while layer is not None:
+            layers.append(layer)
+            layer = layer.base
+        return layers[::-1]
+
+    def hash_at(self, position):
+        layer, i = self._layer_of(position)
+        return layer.hash_table[i].hex()
+
+    def parent_positions(self, position):
+        layer, i = self._layer_of(position)
+        _, first, second, _, _ = layer._record(i)
+        if first == self.NO_PARENT:
+            return []
+        if second == self.NO_PARENT:
+            return [first]
+        if not second & self.EXTRA_EDGES:
+            return [first, second]
+
+        parents = [first]
+        edge = second & ~self.EXTRA_EDGES
+        while True:
+            value = self.EDGE.unpack_from(layer.data, layer.edges_start + self.EDGE.size * edge)[0]
+            parents.append(value & ~self.LAST_EDGE)
+            if value & self.LAST_EDGE:
+                return parents
+            edge += 1
+
+    def tree_hash_at(self, position):
+        layer, i = self._layer_of(position)
+        return layer._record(i)[0].hex()
+
+    def commit_time_at(self, position):
+        layer, i = self._layer_of(position)
+        return layer._record(i)[3]
+
+    def generation_at(self, position):
+        layer, i = self._layer_of(position)
+        return layer._record(i)[4]
+
+    def bloom_filter_at(self, position):
+        """Returns the changed-path BloomFilter of a commit, or None if its graph file has none."""
+        data = self.bloom_data_at(position)
+        return BloomFilter(data) if data is not None else None
+
+    def bloom_data_at(self, position):
+        """Returns the serialized Bloom filter of a commit, straight from the file, or None if it has none."""
+        layer, i = self._layer_of(position)
+        if layer.version < 2:
+            return None
+        start = self.EDGE.unpack_from(layer.data, layer.blooms_start + self.EDGE.size * (i - 1))[0] if i else 0
+        end = self.EDGE.unpack_from(layer.data, layer.blooms_start + self.EDGE.size * i)[0]
+        return layer.data[layer.bloom_data_start + start:layer.bloom_data_start + end]
+
+    def parents(self, hash):
+        """Returns the parent hashes of a commit, or None if it isn't in the graph."""
+        position = self.position(hash)
+        if position is None:
+            return None
+        return [self.hash_at(parent) for parent in self.parent_positions(position)]
+
+    def close(self):
+        for layer in self.layers():
+            layer.data.close()
+
+    # ----- UTILS -----
+    def _layer_of(self, position):
+        """Returns the graph file holding a position, and the position within it."""
+        layer = self
+        while position < layer.base_count:
+            layer = layer.base
+        return layer, position - layer.base_count
+
+    def _record(self, i):
+        return self.RECORD.unpack_from(self.data, self.records_start + self.RECORD.size * i)
+
+class CommitGraphWriter:
+    """
+    Writes the commit-graph for every commit reachable from a set of tips.
+
+    A full write (gc) puts every commit in a single file and drops the
+    layers. Otherwise only the commits the graph doesn't have yet are read
+    from the object store, and they go into a new layer on top, so the cost
+    of a commit follows what it added rather than the length of history. To
+    keep the stack short, a new layer absorbs the layers below it for as long
+    as it would hold more than half as many commits as the next one down;
+    layers grow geometrically, and the full file itself is only rewritten
+    when the layers outgrow it.
+
+    Commits copied from the current graph keep their Bloom filters as the
+    bytes already in the file; new ones are diffed against their first
+    parent. Commits from a version 1 graph have no filter, and computing
+    theirs means diffing all of their history, so only a full write does it:
+    a new layer never absorbs a version 1 graph. Files are written to a temp
+    file and renamed into place.
+    """
+
+    MERGE_FACTOR = 2
+
+    def __init__(self, database):
+        self.database = database
+
+    def write(self, tips, keep_existing=True):
+        """
+        Writes the graph of the tips' history, plus every commit of the current
+        graph if keep_existing is set, in which case the new commits are added
+        as a layer. Returns the number of commits in the graph.
+        """
+        graph = self.database.commit_graph
+        if graph is None or not keep_existing:
+            return self._write_full(tips, graph)
+
+        commits = {}
+        generations = {}
+        stack = [tip for tip in tips if tip]
+        while stack:
+            hash = stack.pop()
+            if hash in commits or hash in graph:
+                continue
+            commit = Commit.load(self.database, hash)
+            commits[hash] = (commit.tree_hash, commit.parent_hashes, commit.timestamp, None)
+            stack.extend(commit.parent_hashes)
+        if not commits:
+            return graph.count
+
+        added = len(commits)
+        for _, parents, _, _ in commits.values():
+            for parent in parents:
+                position = graph.position(parent) if parent not in commits else None
+                if position is not None:
+                    generations[parent] = graph.generation_at(position)
+        self._compute_generations(commits, generations)
+        self._compute_bloom_filters(commits, graph)
+
+        layers = graph.layers()
+        while (layers and layers[-1].version == CommitGraph.VERSION
+               and len(commits) * self.MERGE_FACTOR > layers[-1].layer_count):
+            layer = layers.pop()
+            for position in range(layer.base_count, layer.count):
+                self._copy_from_graph(graph, position, commits, generations)
+        if not layers:
+            self._write_base(self._serialize(commits, generations))
+        else:
+            self._write_layer(self._serialize(commits, generations, layers[-1]), layers)
+        return graph.count + added
+
+    # ----- UTILS -----
+    def _write_full(self, tips, graph):
+        commits = {}
+        generations = {}
+        stack = [tip for tip in tips if tip]
+        while stack:
+            hash = stack.pop()
+            if hash in commits:
+                continue
+            position = graph.position(hash) if graph is not None else None
+            if position is not None:
+                self._copy_from_graph(graph, position, commits, generations)
+            else:
+                commit = Commit.load(self.database, hash)
+                commits[hash] = (commit.tree_hash, commit.parent_hashes, commit.timestamp, None)
+            stack.extend(commits[hash][1])
+
+        self._compute_generations(commits, generations)
+        self._compute_bloom_filters(commits, graph)
+        self._write_base(self._serialize(commits, generations))
+        return len(commits)
+
+    @staticmethod
+    def _copy_from_graph(graph, position, commits, generations):
+        hash = graph.hash_at(position)
+        parents = [graph.hash_at(parent) for parent in graph.parent_positions(position)]
+        commits[hash] = (graph.tree_hash_at(position), parents, graph.commit_time_at(position),
+                         graph.bloom_data_at(position))
+        generations[hash] = graph.generation_at(position)
+
+    def _compute_bloom_filters(self, commits, graph):
+        """Fills in the filters the commits don't have yet, from a diff against their first parent."""
+        for hash, (tree_hash, parents, commit_time, bloom) in commits.items():
+            if bloom is not None:
+                continue
+            parent_tree = self._tree_hash_of(parents[0], commits, graph) if parents else None
+            paths = [path for path, _, _ in Tree.diff_trees(self.database, parent_tree, tree_hash)]
+            commits[hash] = (tree_hash, parents, commit_time, BloomFilter.from_paths(paths).serialize())
+
+    def _tree_hash_of(self, hash, commits, graph):
+        if hash in commits:
+            return commits[hash][0]
+        position = graph.position(hash) if graph is not None else None
+        if position is not None:
+            return graph.tree_hash_at(position)
+        return Commit.tree_hash_of(self.database, hash)
+
+    @staticmethod
+    def _compute_generations(commits, generations):
+        """Fills in the generation of every commit, parents first, without recursion."""
+        for hash in commits:
+            stack = [hash]
+            while stack:
+                top = stack[-1]
+                if top in generations:
+                    stack.pop()
+                    continue
+                parents = commits[top][1]
+                pending = [parent for parent in parents if parent not in generations]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                generations[top] = 1 + max((generations[parent] for parent in parents), default=0)
+                stack.pop()
+
+    def _serialize(self, commits, generations, base=None):
+        """Serializes the commits as a graph file; parents outside them are looked up in base."""
+        hashes = sorted(commits)
+        base_count = base.count if base is not None else 0
+        positions = {hash: base_count + i for i, hash in enumerate(hashes)}
+        counts = [0] * 256
+        for hash in hashes:
+            counts[int(hash[:2], 16)] += 1
+        fanout = []
+        total = 0
+        for count in counts:
+            total += count
+            fanout.append(total)
+
+        records = []
+        edges = []
+        blooms = []
+        bloom_data = bytearray()
+        for hash in hashes:
+            tree_hash, parents, commit_time, bloom = commits[hash]
+            bloom_data += bloom
+            blooms.append(len(bloom_data))
+            parent_positions = [positions[parent] if parent in positions else base.position(parent) for parent in parents]
+            first = parent_positions[0] if parent_positions else CommitGraph.NO_PARENT
+            if len(parent_positions) <= 2:
+                second = parent_positions[1] if len(parent_positions) == 2 else CommitGraph.NO_PARENT
+            else:
+                second = CommitGraph.EXTRA_EDGES | len(edges)
+                extra = parent_positions[1:]
+                edges.extend(extra[:-1])
+                edges.append(extra[-1] | CommitGraph.LAST_EDGE)
+            records.append(CommitGraph.RECORD.pack(bytes.fromhex(tree_hash), first, second, commit_time, generations[hash]))
+
+        body = bytearray(CommitGraph.HEADER.pack(CommitGraph.SIGNATURE, CommitGraph.VERSION, len(hashes), len(edges)))
+        body += CommitGraph.FANOUT.pack(*fanout)
+        body += b''.join(bytes.fromhex(hash) for hash in hashes)
+        body += b''.join(records)
+        body += b''.join(CommitGraph.EDGE.pack(edge) for edge in edges)
+        body += b''.join(CommitGraph.EDGE.pack(offset) for offset in blooms)
+        body += bloom_data
+        body += hashlib.sha1(body).digest()
+        return bytes(body)
+
+    def _write_base(self, data):
+        """Replaces the full graph file and drops the layers that were on top of the old one."""
+        path = self.database.commit_graph_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        self.database.close_commit_graph()
+        self._write_chain([])
+        os.replace(temp_path, path)
+
+    def _write_layer(self, data, layers_below):
+        """Adds a layer file on top of layers_below, replacing any layers that were above them."""
+        layers_dir = self._layers_dir()
+        os.makedirs(layers_dir, exist_ok=True)
+        name = CommitGraph.layer_name(data[-20:].hex())
+        temp_path = os.path.join(layers_dir, name + '.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(layers_dir, name))
+        self.database.close_commit_graph()
+        chain = [(os.path.basename(layer.path), below.checksum) for below, layer in zip(layers_below, layers_below[1:])]
+        self._write_chain(chain + [(name, layers_below[-1].checksum)])
+
+    def _write_chain(self, chain):
+        """
+        Points the chain at the (layer file name, trailer of the file below it)
+        pairs and deletes the layer files it no longer lists.
+        """
+        layers_dir = self._layers_dir()
+        if not os.path.isdir(layers_dir):
+            return
+        chain_path = os.path.join(layers_dir, CommitGraph.CHAIN_FILE)
+        names = [name for name, _ in chain]
+        if chain:
+            with open(chain_path + '.tmp', 'w') as f:
+                f.write(''.join(f"{name} {base_checksum}\n" for name, base_checksum in chain))
+            os.replace(chain_path + '.tmp', chain_path)
+        elif os.path.exists(chain_path):
+            os.remove(chain_path)
+        for file_name in os.listdir(layers_dir):
+            if file_name.endswith('.graph') and file_name not in names:
+                os.remove(os.path.join(layers_dir, file_name))
+
+    def _layers_dir(self):
+        return os.path.join(os.path.dirname(self.database.commit_graph_path), CommitGraph.LAYERS_DIR)
@@ -1,23 +1,57 @@
 import os
+import sys
 import configparser
 
 class Config:
+    """
+    The local and global config files. They are parsed once, on the first
+    read, and every later read of the same Config uses that parse, so read
+    all the keys a command needs from one instance.
+    """
+
     def __init__(self, repo=None):
         self.repo = repo
         self.local_path = os.path.join(repo.bit_dir, 'config') if repo else None
         self.global_path = os.path.expanduser('~/.bitconfig')
+        self.parser = None
 
     def get(self, section, key, default=None):
         """Reads config, prioritizing local over global."""
-        parser = configparser.ConfigParser()
-        paths = []
-        if os.path.exists(self.global_path):
-            paths.append(self.global_path)
-        if self.local_path and os.path.exists(self.local_path):
-            paths.append(self.local_path)
-            
-        parser.read(paths)
-        return parser.get(section, key, fallback=default)
+        return self._parse().get(section, key, fallback=default)
+
+    def get_int(self, section, key, default=None):
+        """
+        Reads an integer value, accepting git-style k, m and g suffixes (e.g. "32m").
+        An invalid value is reported on stderr and the default is used instead.
+        """
+        value = self.get(section, key)
+        if value is None:
+            return default
+
+        value = value.strip().lower()
+        multipliers = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+        try:
+            if value and value[-1] in multipliers:
+                return int(value[:-1]) * multipliers[value[-1]]
+            return int(value)
+        except ValueError:
+            return self._invalid(section, key, value, "integer", default)
+
+    def get_bool(self, section, key, default=False):
+        """
+        Reads a boolean value (true/false, yes/no, on/off or 1/0). An invalid
+        value is reported on stderr and the default is used instead.
+        """
+        value = self.get(section, key)
+        if value is None:
+            return default
+
+        value = value.strip().lower()
+        if value in ('true', 'yes', 'on', '1'):
+            return True
+        if value in ('false', 'no', 'off', '0'):
+            return False
+        return self._invalid(section, key, value, "boolean", default)
 
     def set(self, section, key, value, global_flag=False):
         """Writes a specific key to either global or local config."""
@@ -39,4 +73,30 @@ class Config:
         parser.set(section, key, value)
         
         with open(path, 'w') as f:
-            parser.write(f)
\ No newline at end of file
+            parser.write(f)
+        self.parser = None
+
+    # ----- UTILS -----
+    def _parse(self):
+        if self.parser is not None:
+            return self.parser
+
+        paths = []
+        if os.path.exists(self.global_path):
+            paths.append(self.global_path)
+        if self.local_path and os.path.exists(self.local_path):
+            paths.append(self.local_path)
+
+        self.parser = configparser.ConfigParser()
+        try:
+            self.parser.read(paths)
+        except configparser.Error as e:
+            # A broken file must not stop every command, `bit config` included
+            print(f"Warning: Could not parse config: {e}", file=sys.stderr)
+            self.parser = configparser.ConfigParser()
+        return self.parser
+
+    @staticmethod
+    def _invalid(section, key, value, kind, default):
+        print(f"Warning: Invalid {kind} value '{value}' for {section}.{key}, using {default}", file=sys.stderr)
+        return default
@@ -1,36 +1,581 @@
 import os
+import re
+import zlib
 import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from .pack import Pack, PackWriter
+from .commit_graph import CommitGraph, CommitGraphWriter
+from .lru_cache import LRUCache
 
 class Database:
-    """Handles reading and writing to the object store."""
-    
-    def __init__(self, path):
+    """
+    Handles reading and writing to the object store.
+
+    Loose objects are zlib-compressed and start with a "<type> <size>\\0"
+    header. Objects can also live in packfiles under objects/pack, which
+    are searched transparently. Recently read objects are kept in an LRU
+    cache bounded by core.objectCacheSize; parsed commits and trees get a
+    cache of the same size (see Commit.load and Tree). An object's hash is the
+    SHA-1 of its header and content, so the same bytes stored as a blob and as
+    a tree are two objects, and the type in the header is the one the object
+    was hashed as. Legacy objects, stored raw before headers existed, keep the
+    content-only hashes they were stored under, and their type is guessed.
+
+    New objects are written to temp files and renamed into place when their
+    write batch ends (see batch), so a crash never leaves a truncated object
+    under its final name. Unless core.fsyncObjectFiles is turned off, a batch
+    flushes its temp files to disk with one os.sync() before the renames and
+    fsyncs the directories it renamed into once after them. os.sync() also
+    flushes other files on the machine, but it is a single call however many
+    objects the batch holds, where an fsync per object costs a disk flush
+    each.
+
+    objects/info/commit-graph caches the parents, tree, time and generation
+    of commits for history walks (see CommitGraph).
+    """
+
+    TYPES = ('blob', 'tree', 'commit')
+    CHUNK_SIZE = 64 * 1024
+    HEADER_PEEK_SIZE = 64
+    TREE_LINE = re.compile(rb'^(blob|tree) [0-9a-f]{40} .+$')
+    DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+    DEFAULT_BIG_FILE_THRESHOLD = 32 * 1024 * 1024
+
+    def __init__(self, path, cache_size=DEFAULT_CACHE_SIZE, fsync=True):
         self.path = path
-        
+        self.fsync = fsync
+        self._batches = []
+        self.pack_dir = os.path.join(path, 'pack')
+        self.created_dirs = set()
+        self.cache = LRUCache(cache_size)
+        self.parsed_cache = LRUCache(cache_size)
+        self._packs = None
+        self._packs_lock = threading.Lock()
+        self.commit_graph_path = os.path.join(path, 'info', 'commit-graph')
+        self._commit_graph = None
+
+    @property
+    def packs(self):
+        """
+        The packs in objects/pack, loaded on first use. The list is never changed
+        in place, only swapped for a new one, so readers on other threads can
+        keep iterating the one they got.
+        """
+        packs = self._packs
+        if packs is None:
+            with self._packs_lock:
+                if self._packs is None:
+                    self._packs = self._load_packs()
+                packs = self._packs
+        return packs
+
+    @property
+    def commit_graph(self):
+        """The commit-graph and its layers, loaded on first use, or None if it hasn't been written."""
+        if self._commit_graph is None:
+            self._commit_graph = CommitGraph.load(self.commit_graph_path)
+        return self._commit_graph
+
+    def write_commit_graph(self, tips, keep_existing=True):
+        """Adds the history of the tips to the commit-graph (see CommitGraphWriter.write)."""
+        return CommitGraphWriter(self).write(tips, keep_existing)
+
+    def close_commit_graph(self):
+        if self._commit_graph is not None:
+            self._commit_graph.close()
+            self._commit_graph = None
+
     def read(self, hash):
         """Returns the content in the db at the given SHA-1 hash."""
-        path = os.path.join(self.path, hash)
-        with open(path, 'rb') as f:
-          return f.read()
+        _, _, data = self.read_object(hash)
+        return data
+
+    def read_object(self, hash):
+        """Returns (type, size, content) for the object at the given hash."""
+        cached = self.cache.get(hash)
+        if cached is not None:
+            return cached
+
+        obj = self._read_uncached(hash)
+        self.cache.put(hash, obj, obj[1])
+        return obj
+
+    def read_header(self, hash):
+        """
+        Returns (type, size) without inflating the whole object, so callers can
+        decide whether a large object is worth loading.
+        """
+        cached = self.cache.get(hash)
+        if cached is not None:
+            type, size, _ = cached
+            return type, size
+
+        pack = self._find_pack(hash)
+        if pack:
+            return pack.read_header(hash)
+        try:
+            f = self._open_object(hash)
+        except FileNotFoundError:
+            return self._reload_packs_and_find(hash).read_header(hash)
+
+        with f:
+            try:
+                decompressor = zlib.decompressobj()
+                peek = decompressor.decompress(f.read(self.CHUNK_SIZE), self.HEADER_PEEK_SIZE)
+                header = self._parse_header(peek, check_size=False)
+            except zlib.error:
+                header = None
+
+            if header is None:
+                f.seek(0)
+                data = f.read()
+                return self._sniff_type(data), len(data)
+
+        type, size, _ = header
+        return type, size
+
+    def read_chunks(self, hash):
+        """
+        Yields the content of an object in chunks of at most CHUNK_SIZE bytes,
+        inflating it as it goes, for objects too big to hold in memory at once.
+        """
+        pack = self._find_pack(hash)
+        if pack:
+            yield from pack.read_chunks(hash)
+            return
+        try:
+            f = self._open_object(hash)
+        except FileNotFoundError:
+            yield from self._reload_packs_and_find(hash).read_chunks(hash)
+            return
+
+        with f:
+            decompressor = zlib.decompressobj()
+            try:
+                first = decompressor.decompress(f.read(self.CHUNK_SIZE), self.CHUNK_SIZE)
+                header = self._parse_header(first, check_size=False)
+            except zlib.error:
+                header = None
+
+            if header is None:
+                # Objects written before compression are stored raw
+                f.seek(0)
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+
+            yield first[header[2]:]
+            while not decompressor.eof:
+                data = decompressor.unconsumed_tail or f.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                yield decompressor.decompress(data, self.CHUNK_SIZE)
+
+    def store(self, content, type='blob'):
+      """Store content in the db as an object of the given type and return its SHA-1 hash."""
 
-    def store(self, content):
-      """Store content in the db and return its SHA-1 hash."""
-      
       content_bytes = self.encode_content(content)
-      hash = self.hash_content(content)
-      object_path = os.path.join(self.path, hash)
-      if not os.path.exists(object_path):
-            with open(object_path, 'wb') as f:
-                f.write(content_bytes)
+      hash = self.hash_content(content_bytes, type)
+      if not self._is_stored(hash):
+            data = self.compress_object(type, content_bytes)
+            if self._batches:
+                self._batches[-1].add(hash, data)
+            else:
+                with self.batch() as batch:
+                    batch.add(hash, data)
       return hash
-  
+
+    def store_stream(self, fileobj, type='blob', size=None):
+        """
+        Stores the rest of a binary file object without holding it in memory.
+        The content is hashed and compressed chunk by chunk into a temp file,
+        which joins the current write batch once its hash is known. The size
+        for the header defaults to what fstat reports. Returns the SHA-1 hash.
+        """
+        if size is None:
+            size = os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=ObjectWriteBatch.TEMP_PREFIX)
+        try:
+            sha = hashlib.sha1()
+            compressor = zlib.compressobj()
+            read_size = 0
+            with os.fdopen(fd, 'wb') as f:
+                header = self.object_header(type, size)
+                sha.update(header)
+                f.write(compressor.compress(header))
+                while True:
+                    chunk = fileobj.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    read_size += len(chunk)
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+
+            if read_size != size:
+                raise Exception(f"File changed while it was being stored: expected {size} bytes, read {read_size}")
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        hash = sha.hexdigest()
+        if self._is_stored(hash):
+            os.remove(temp_path)
+        elif self._batches:
+            self._batches[-1].add_file(hash, temp_path)
+        else:
+            with self.batch() as batch:
+                batch.add_file(hash, temp_path)
+        return hash
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups object writes. Objects stored inside the block are staged in temp
+        files (and readable right away), then synced and renamed into place when the
+        block exits, and the directories they land in are synced. Write objects
+        in a batch before the index or a ref points at them. An exception
+        discards the staged objects. Batches nest; each one publishes its own
+        objects when it exits.
+        """
+        batch = ObjectWriteBatch(self)
+        self._batches.append(batch)
+        try:
+            yield batch
+        except BaseException:
+            self._batches.remove(batch)
+            batch.discard()
+            raise
+        self._batches.remove(batch)
+        batch.commit()
+
+    def has_object(self, hash):
+        return self._is_stored(hash) or os.path.exists(self.legacy_object_path(hash))
+
+    def loose_objects(self):
+        """Yields the hashes of all loose objects, in both the fan-out and the flat layout."""
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if len(name) == 40 and os.path.isfile(path):
+                yield name
+            elif len(name) == 2 and os.path.isdir(path):
+                for rest in os.listdir(path):
+                    if len(rest) == 38:
+                        yield name + rest
+
+    def repack(self, names=None, all=False, big_object_threshold=DEFAULT_BIG_FILE_THRESHOLD):
+        """
+        Moves the loose objects into a new pack, along with the objects of every
+        existing pack if all is set. Names maps hashes to the path they were
+        seen at, which groups versions of the same file together for deltas.
+        Objects are read one at a time as the pack is written, and those of at
+        least big_object_threshold bytes are streamed (see PackWriter).
+        Returns (number of objects packed, number stored as deltas).
+        """
+        names = names or {}
+        loose = set(self.loose_objects())
+        old_packs = list(self.packs) if all else []
+        hashes = set(loose)
+        for pack in old_packs:
+            hashes.update(pack.hashes())
+        if not hashes:
+            return 0, 0
+
+        objects = [(hash, self.read_header(hash)[0], names.get(hash)) for hash in sorted(hashes)]
+        index_path, delta_count = PackWriter(self.pack_dir, big_object_threshold).write(objects, self)
+
+        for hash in loose:
+            for path in (self.object_path(hash), self.legacy_object_path(hash)):
+                if os.path.exists(path):
+                    os.remove(path)
+        # Old packs stay mapped for readers that still hold them (see _reload_packs_and_find)
+        for pack in old_packs:
+            if pack.index_path != index_path:
+                os.remove(pack.index_path)
+                os.remove(pack.pack_path)
+        self._remove_empty_fanout_dirs()
+        with self._packs_lock:
+            self._packs = None
+        return len(objects), delta_count
+
+    def object_path(self, hash):
+        """Returns the path of an object in the two-level objects/xx/yyyy... layout."""
+        return os.path.join(self.path, hash[:2], hash[2:])
+
+    def legacy_object_path(self, hash):
+        return os.path.join(self.path, hash)
+
+    def migrate_objects(self):
+        """
+        Moves objects stored flat under objects/ into the fan-out layout and
+        rewrites uncompressed objects in the compressed format.
+        Returns the number of objects migrated.
+        """
+        migrated = set()
+        for name in os.listdir(self.path):
+            legacy_path = self.legacy_object_path(name)
+            if len(name) == 40 and os.path.isfile(legacy_path):
+                self._make_fanout_dir(name)
+                os.replace(legacy_path, self.object_path(name))
+                migrated.add(name)
+
+        for fanout in os.listdir(self.path):
+            fanout_dir = os.path.join(self.path, fanout)
+            if len(fanout) != 2 or not os.path.isdir(fanout_dir):
+                continue
+            for rest in os.listdir(fanout_dir):
+                if self._compress_legacy(fanout + rest):
+                    migrated.add(fanout + rest)
+        return len(migrated)
+
     @classmethod
-    def hash_content(cls, content):
+    def compress_object(cls, type, content_bytes):
+        return zlib.compress(cls.object_header(type, len(content_bytes)) + content_bytes)
+
+    @classmethod
+    def hash_content(cls, content, type='blob'):
+        """Returns the hash content gets when stored as an object of the given type."""
         content_bytes = cls.encode_content(content)
-        return hashlib.sha1(content_bytes).hexdigest()
-  
+        return hashlib.sha1(cls.object_header(type, len(content_bytes)) + content_bytes).hexdigest()
+
+    @staticmethod
+    def object_header(type, size):
+        """Returns the "<type> <size>\\0" header an object is stored and hashed with."""
+        return f"{type} {size}\0".encode('utf-8')
+
     @classmethod
     def encode_content(cls, content):
         """Encodes the content only if it's not already encoded."""
         return content.encode('utf-8') if isinstance(content, str) else content
-        
\ No newline at end of file
+
+    # ----- UTILS -----
+    def _read_uncached(self, hash):
+        """Reads an object from the packs or the loose object store."""
+        pack = self._find_pack(hash)
+        if pack:
+            return pack.read_object(hash)
+        try:
+            f = self._open_object(hash)
+        except FileNotFoundError:
+            return self._reload_packs_and_find(hash).read_object(hash)
+
+        with f:
+            decompressor = zlib.decompressobj()
+            chunks = []
+            try:
+                while True:
+                    chunk = f.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    chunks.append(decompressor.decompress(chunk))
+                chunks.append(decompressor.flush())
+                raw = b''.join(chunks)
+                header = self._parse_header(raw)
+            except zlib.error:
+                header = None
+
+            if header is None:
+                # Objects written before compression are stored raw
+                f.seek(0)
+                data = f.read()
+                return self._sniff_type(data), len(data), data
+
+        type, size, data_start = header
+        return type, size, raw[data_start:]
+
+    def _is_stored(self, hash):
+        """Checks the packs, the loose objects and the open write batches."""
+        return self._find_pack(hash) is not None or os.path.exists(self.object_path(hash)) \
+            or self._staged_path(hash) is not None
+
+    def _staged_path(self, hash):
+        for batch in reversed(self._batches):
+            temp_path = batch.get(hash)
+            if temp_path is not None:
+                return temp_path
+        return None
+
+    def _find_pack(self, hash):
+        for pack in self.packs:
+            if hash in pack:
+                return pack
+        return None
+
+    def _reload_packs_and_find(self, hash):
+        """
+        Another process may have packed the object since the packs were loaded.
+        Packs that are gone are dropped from the new list but not closed, since
+        other threads may still be reading from them; their mappings are
+        released once nothing references them.
+        """
+        with self._packs_lock:
+            self._packs = self._load_packs(self._packs or [])
+            packs = self._packs
+        for pack in packs:
+            if hash in pack:
+                return pack
+        raise FileNotFoundError(f"Object {hash} not found")
+
+    def _load_packs(self, previous=()):
+        """Opens the packs in objects/pack, reusing the already opened ones in previous."""
+        opened = {pack.index_path: pack for pack in previous}
+        packs = []
+        if os.path.isdir(self.pack_dir):
+            for name in sorted(os.listdir(self.pack_dir)):
+                if name.endswith('.idx'):
+                    index_path = os.path.join(self.pack_dir, name)
+                    packs.append(opened.get(index_path) or Pack(index_path))
+        return packs
+
+    def _remove_empty_fanout_dirs(self):
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if len(name) == 2 and os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+        self.created_dirs.clear()
+
+    def _open_object(self, hash):
+        staged_path = self._staged_path(hash)
+        if staged_path is not None:
+            return open(staged_path, 'rb')
+        try:
+            return open(self.object_path(hash), 'rb')
+        except FileNotFoundError:
+            pass
+        try:
+            # Objects written before the fan-out layout live directly under objects/
+            return open(self.legacy_object_path(hash), 'rb')
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Object {hash} not found")
+
+    def _make_fanout_dir(self, hash):
+        fanout = hash[:2]
+        if fanout not in self.created_dirs:
+            os.makedirs(os.path.join(self.path, fanout), exist_ok=True)
+            self.created_dirs.add(fanout)
+
+    def _compress_legacy(self, hash):
+        """Rewrites a raw legacy object in the compressed format. Returns True if it was rewritten."""
+        path = self.object_path(hash)
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            if self._parse_header(zlib.decompress(data)) is not None:
+                return False
+        except zlib.error:
+            pass
+
+        with open(path, 'wb') as f:
+            f.write(self.compress_object(self._sniff_type(data), data))
+        return True
+
+    @classmethod
+    def _parse_header(cls, raw, check_size=True):
+        """Returns (type, size, content offset), or None if raw doesn't start with a valid header."""
+        null = raw.find(b'\0', 0, cls.HEADER_PEEK_SIZE)
+        if null == -1:
+            return None
+        try:
+            type, size = raw[:null].decode('ascii').split(' ')
+            size = int(size)
+        except ValueError:
+            return None
+        if type not in cls.TYPES or (check_size and size != len(raw) - null - 1):
+            return None
+        return type, size, null + 1
+
+    @classmethod
+    def _sniff_type(cls, data):
+        """Guesses the type of a legacy object that was stored without a header."""
+        if data.startswith(b'tree ') and b'\nauthor ' in data:
+            return 'commit'
+        lines = data.split(b'\n')
+        if data and all(cls.TREE_LINE.match(line) for line in lines):
+            return 'tree'
+        return 'blob'
+
+class ObjectWriteBatch:
+    """
+    Loose objects staged in temp files under objects/ until the batch is
+    committed. Staging is thread-safe, so a hash pipeline can store into it.
+    """
+
+    TEMP_PREFIX = 'tmp_obj_'
+
+    def __init__(self, database):
+        self.database = database
+        self.staged = {}
+        self.lock = threading.Lock()
+
+    def get(self, hash):
+        """Returns the temp path of a staged object, or None."""
+        return self.staged.get(hash)
+
+    def add(self, hash, data):
+        """Stages compressed object data."""
+        fd, temp_path = tempfile.mkstemp(dir=self.database.path, prefix=self.TEMP_PREFIX)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        self.add_file(hash, temp_path)
+
+    def add_file(self, hash, temp_path):
+        """Stages an already written temp file, taking ownership of it."""
+        with self.lock:
+            if hash in self.staged:
+                os.remove(temp_path)
+            else:
+                self.staged[hash] = temp_path
+
+    def commit(self):
+        """
+        Flushes the staged objects to disk with one sync, renames them into the
+        fan-out layout, then syncs each directory that got a new entry once.
+        """
+        touched_dirs = set()
+        if self.database.fsync and self.staged and hasattr(os, 'sync'):
+            os.sync()
+        try:
+            for hash in list(self.staged):
+                temp_path = self.staged[hash]
+                object_path = self.database.object_path(hash)
+                if os.path.exists(object_path):
+                    os.remove(temp_path)
+                else:
+                    self.database._make_fanout_dir(hash)
+                    os.replace(temp_path, object_path)
+                    touched_dirs.add(os.path.dirname(object_path))
+                del self.staged[hash]
+        except BaseException:
+            self.discard()
+            raise
+
+        if self.database.fsync and touched_dirs:
+            # objects/ too, in case the fan-out directories are new
+            for path in sorted(touched_dirs) + [self.database.path]:
+                self._sync_dir(path)
+
+    def discard(self):
+        for temp_path in self.staged.values():
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.staged.clear()
+
+    # ----- UTILS -----
+    @staticmethod
+    def _sync_dir(path):
+        """Makes the renames in a directory durable; not every platform can open directories."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,153 @@
+class Delta:
+    """
+    Encodes an object as a list of instructions to rebuild it from a base object.
+
+    Format (same instruction set as git's pack deltas):
+        header   base size and result size, each a little-endian base-128 varint
+        copy     0x80 | flags, then the offset bytes (flags bits 0-3) and size
+                 bytes (flags bits 4-6) that are present, least significant first
+        insert   a byte 1-127 followed by that many literal bytes
+    """
+
+    BLOCK_SIZE = 16
+    MAX_COPY = 0xFFFFFF
+    MAX_INSERT = 0x7F
+    COMPARE_CHUNK = 256
+
+    @classmethod
+    def compute(cls, base, target):
+        """Returns the delta that turns base into target."""
+        out = bytearray()
+        cls.write_varint(out, len(base))
+        cls.write_varint(out, len(target))
+
+        index = cls._index_blocks(base)
+        pending = bytearray()
+        i = 0
+        while i < len(target):
+            base_offset = index.get(target[i:i + cls.BLOCK_SIZE]) if i + cls.BLOCK_SIZE <= len(target) else None
+            if base_offset is None:
+                pending.append(target[i])
+                i += 1
+                continue
+
+            # Grow the match backwards into the pending literals, then forwards
+            while pending and base_offset > 0 and base[base_offset - 1] == pending[-1]:
+                pending.pop()
+                base_offset -= 1
+                i -= 1
+            length = cls._match_length(base, base_offset, target, i)
+
+            cls._write_insert(out, pending)
+            pending.clear()
+            cls._write_copy(out, base_offset, length)
+            i += length
+
+        cls._write_insert(out, pending)
+        return bytes(out)
+
+    @classmethod
+    def apply(cls, base, delta):
+        """Rebuilds the target object from its base and a delta."""
+        base_size, pos = cls.read_varint(delta, 0)
+        result_size, pos = cls.read_varint(delta, pos)
+        if base_size != len(base):
+            raise Exception("Delta base size mismatch")
+
+        result = bytearray()
+        while pos < len(delta):
+            op = delta[pos]
+            pos += 1
+            if op & 0x80:
+                offset = size = 0
+                for bit in range(4):
+                    if op & (1 << bit):
+                        offset |= delta[pos] << (8 * bit)
+                        pos += 1
+                for bit in range(3):
+                    if op & (1 << (4 + bit)):
+                        size |= delta[pos] << (8 * bit)
+                        pos += 1
+                if size == 0:
+                    size = 0x10000
+                result += base[offset:offset + size]
+            elif op:
+                result += delta[pos:pos + op]
+                pos += op
+            else:
+                raise Exception("Invalid delta instruction")
+
+        if len(result) != result_size:
+            raise Exception("Delta result size mismatch")
+        return bytes(result)
+
+    @staticmethod
+    def write_varint(out, value):
+        """Appends a little-endian base-128 varint to a bytearray."""
+        while True:
+            byte = value & 0x7F
+            value >>= 7
+            if value:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                return
+
+    @staticmethod
+    def read_varint(data, pos):
+        """Returns (value, position after the varint)."""
+        value = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, pos
+
+    # ----- UTILS -----
+    @classmethod
+    def _index_blocks(cls, base):
+        """Maps each aligned block of the base to its first offset."""
+        index = {}
+        for offset in range(0, len(base) - cls.BLOCK_SIZE + 1, cls.BLOCK_SIZE):
+            index.setdefault(base[offset:offset + cls.BLOCK_SIZE], offset)
+        return index
+
+    @classmethod
+    def _match_length(cls, base, base_offset, target, target_offset):
+        length = 0
+        limit = min(len(base) - base_offset, len(target) - target_offset, cls.MAX_COPY)
+        while length + cls.COMPARE_CHUNK <= limit:
+            a = base[base_offset + length:base_offset + length + cls.COMPARE_CHUNK]
+            b = target[target_offset + length:target_offset + length + cls.COMPARE_CHUNK]
+            if a != b:
+                break
+            length += cls.COMPARE_CHUNK
+        while length < limit and base[base_offset + length] == target[target_offset + length]:
+            length += 1
+        return length
+
+    @classmethod
+    def _write_copy(cls, out, offset, size):
+        flags = 0x80
+        args = bytearray()
+        for bit in range(4):
+            byte = (offset >> (8 * bit)) & 0xFF
+            if byte:
+                flags |= 1 << bit
+                args.append(byte)
+        for bit in range(3):
+            byte = (size >> (8 * bit)) & 0xFF
+            if byte:
+                flags |= 1 << (4 + bit)
+                args.append(byte)
+        out.append(flags)
+        out += args
+
+    @classmethod
+    def _write_insert(cls, out, data):
+        for start in range(0, len(data), cls.MAX_INSERT):
+            chunk = data[start:start + cls.MAX_INSERT]
+            out.append(len(chunk))
+            out += chunk
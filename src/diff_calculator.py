@@ -2,6 +2,7 @@ import difflib
 from .file_diff import FileDiff
 from .ref import Ref
 from .tree import Tree
+from .commit import Commit
 
 class DiffCalculator:
     """Calculates differences between repository states."""
@@ -12,7 +13,8 @@ class DiffCalculator:
         Calculates and returns a list of Diffs between the index and the worktree (unstaged files).
         """
         index_entries = repo.index.load_as_dict()
-        worktree_entries = repo.worktree.list_and_hash_files()
+        fsmonitor = repo.query_fsmonitor()
+        worktree_entries = repo.worktree.list_and_hash_files(repo.index, changed=fsmonitor[1] if fsmonitor else None)
         
         return cls._calculate_original_vs_new(repo, index_entries, worktree_entries)
     
@@ -22,10 +24,14 @@ class DiffCalculator:
         Calculates and returns a list of Diffs between the index and the last commit.
         """
         last_commit_hash = Ref.from_symbol(repo, 'HEAD').read_hash()
-        head_entries = Tree.get_entries_from_commit(repo.db, last_commit_hash)
-        index_entries = repo.index.load_as_dict()
-        
-        return cls._calculate_original_vs_new(repo, head_entries, index_entries, include_added_files=True)
+        head_tree_hash = Commit.tree_hash_of(repo.db, last_commit_hash)
+        entries, cache_tree = repo.index.load()
+        index_entries = {path: entry.hash for path, entry in entries.items()}
+        changes = Tree.diff_index(repo.db, head_tree_hash, index_entries, cache_tree)
+
+        head_entries = {path: head for path, (head, _) in changes.items() if head}
+        changed_entries = {path: index for path, (_, index) in changes.items() if index}
+        return cls._calculate_original_vs_new(repo, head_entries, changed_entries, include_added_files=True)
     
     @classmethod
     def calculate_file_vs_file(cls, repo, path, hash_a, hash_b, n = 3) -> FileDiff:
@@ -0,0 +1,341 @@
+import os
+import select
+import socket
+import itertools
+from .inotify import Inotify
+from .worktree import Worktree
+
+class FSMonitor:
+    """
+    A daemon that watches the worktree and answers "what changed since token X"
+    over a Unix socket, so status, add and diff can skip every file that wasn't
+    touched. Changes come from inotify where the system has it; elsewhere the
+    worktree's stat data is rescanned on each query, which is slower but gives
+    the same answers.
+
+    Protocol: the client sends one line, "query <token>" (the token may be
+    empty) or "stop". A query is answered with NUL-separated fields: the new
+    token, then every path changed since the given token, directories with a
+    trailing slash standing for everything below them. A lone "/" means the
+    token is unknown (e.g. the daemon restarted) and everything may have
+    changed.
+
+    Before answering, the daemon creates a cookie file in the .bit directory
+    and waits for its own event, so every change made before the query is
+    sure to be in the answer.
+    """
+
+    SOCKET_NAME = 'fsmonitor.sock'
+    COOKIE_PREFIX = 'fsmonitor-cookie-'
+    EVERYTHING = '/'
+    MAX_CHANGES = 100_000
+    QUERY_TIMEOUT = 5
+    REQUEST_SIZE = 4096
+
+    def __init__(self, worktree_path, bit_dir, force_polling=False):
+        self.worktree_path = worktree_path
+        self.bit_dir = bit_dir
+        self.socket_path = os.path.join(bit_dir, self.SOCKET_NAME)
+        self.bit_prefix = os.path.relpath(bit_dir, worktree_path).replace(os.sep, '/') + '/'
+
+        self.watcher = None
+        if not force_polling:
+            try:
+                self.watcher = _InotifyWatcher(worktree_path, bit_dir, self.bit_prefix)
+            except OSError:
+                pass
+        if self.watcher is None:
+            self.watcher = _PollingWatcher(worktree_path)
+
+        self.instance = os.urandom(8).hex()
+        self.sequence = 0
+        self.oldest_sequence = 0
+        self.changes = {}
+        self.pending = {}
+        self.cookie_numbers = itertools.count()
+        self.wake_read, self.wake_write = os.pipe()
+        self.server = self._listen()
+
+    @property
+    def backend(self):
+        return 'inotify' if isinstance(self.watcher, _InotifyWatcher) else 'polling'
+
+    def serve(self):
+        """Answers queries until stop() is called or a client asks the daemon to stop."""
+        try:
+            while True:
+                sources = [self.server, self.wake_read]
+                if self.watcher.fileno() is not None:
+                    sources.append(self.watcher)
+                readable, _, _ = select.select(sources, [], [])
+                if self.watcher in readable:
+                    self._record(self.watcher.read())
+                if self.server in readable and not self._accept():
+                    break
+                if self.wake_read in readable:
+                    break
+        finally:
+            self.close()
+
+    def stop(self):
+        os.write(self.wake_write, b'x')
+
+    def close(self):
+        for conn, _ in self.pending.values():
+            conn.close()
+        self.pending.clear()
+        self.server.close()
+        try:
+            # Leave the socket alone if a new daemon has taken its place
+            if os.stat(self.socket_path).st_ino == self.socket_ino:
+                os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self.watcher.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+    @classmethod
+    def query(cls, socket_path, token):
+        """
+        Asks a running daemon what changed since token. Returns (new token,
+        changed paths), the paths being None if everything has to be checked,
+        or None if no daemon answers.
+        """
+        response = cls._request(socket_path, f"query {token or ''}")
+        if response is None:
+            return None
+        new_token, *paths = response.split('\0')
+        if cls.EVERYTHING in paths:
+            return new_token, None
+        return new_token, paths
+
+    @classmethod
+    def request_stop(cls, socket_path):
+        """Asks a running daemon to exit. Returns False if none was running."""
+        return cls._request(socket_path, "stop") is not None
+
+    # ----- UTILS -----
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            if self._request(self.socket_path, "query") is not None:
+                raise Exception(f"An fsmonitor daemon is already running for '{self.worktree_path}'")
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        self.socket_ino = os.stat(self.socket_path).st_ino
+        return server
+
+    def _accept(self):
+        """Reads one request. Returns False if it asked the daemon to stop."""
+        conn, _ = self.server.accept()
+        conn.settimeout(self.QUERY_TIMEOUT)
+        try:
+            request = conn.recv(self.REQUEST_SIZE).decode('utf-8').strip()
+        except (OSError, UnicodeDecodeError):
+            conn.close()
+            return True
+
+        command, _, token = request.partition(' ')
+        if command == 'stop':
+            conn.sendall(b'ok')
+            conn.close()
+            return False
+        if command != 'query':
+            conn.close()
+            return True
+
+        if self.watcher.fileno() is None:
+            self._record(self.watcher.read())
+            self._answer(conn, token)
+            return True
+
+        cookie = f"{self.COOKIE_PREFIX}{next(self.cookie_numbers)}"
+        try:
+            with open(os.path.join(self.bit_dir, cookie), 'wb'):
+                pass
+        except OSError:
+            self._answer(conn, None)
+            return True
+        self.pending[self.bit_prefix + cookie] = (conn, token)
+        return True
+
+    def _record(self, paths):
+        for path in paths:
+            if path == self.EVERYTHING:
+                # Events were lost, so no earlier token can be answered
+                self.instance = os.urandom(8).hex()
+                self.changes.clear()
+                for cookie in list(self.pending):
+                    self._answer_pending(cookie, everything=True)
+            elif path in self.pending:
+                self._answer_pending(path)
+            elif not path.startswith(self.bit_prefix):
+                self.sequence += 1
+                self.changes[path] = self.sequence
+
+        if len(self.changes) > self.MAX_CHANGES:
+            self.changes.clear()
+            self.oldest_sequence = self.sequence
+
+    def _answer_pending(self, cookie, everything=False):
+        """Answers the query waiting for a cookie and removes the cookie file."""
+        conn, token = self.pending.pop(cookie)
+        self._answer(conn, None if everything else token)
+        try:
+            os.remove(os.path.join(self.worktree_path, cookie))
+        except FileNotFoundError:
+            pass
+
+    def _answer(self, conn, token):
+        instance, _, sequence = (token or '').partition(':')
+        if instance == self.instance and sequence.isdigit() and int(sequence) >= self.oldest_sequence:
+            since = int(sequence)
+            paths = [path for path, changed_at in self.changes.items() if changed_at > since]
+        else:
+            paths = [self.EVERYTHING]
+        try:
+            conn.sendall('\0'.join([f"{self.instance}:{self.sequence}", *paths]).encode('utf-8'))
+        except OSError:
+            pass
+        conn.close()
+
+    @classmethod
+    def _request(cls, socket_path, request):
+        """Sends one request and returns the whole answer, or None if no daemon answers."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(cls.QUERY_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+            sock.sendall(request.encode('utf-8') + b'\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(64 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except OSError:
+            return None
+        finally:
+            sock.close()
+        return b''.join(chunks).decode('utf-8') if chunks else None
+
+class _InotifyWatcher:
+    """Watches every worktree directory with inotify, reporting changed paths relative to the worktree."""
+
+    MASK = (Inotify.IN_MODIFY | Inotify.IN_ATTRIB | Inotify.IN_CLOSE_WRITE | Inotify.IN_CREATE
+            | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | Inotify.IN_DELETE_SELF
+            | Inotify.IN_MOVE_SELF | Inotify.IN_ONLYDIR | Inotify.IN_DONT_FOLLOW | Inotify.IN_EXCL_UNLINK)
+    DIRECTORY_CHANGES = Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO
+    def __init__(self, root, bit_dir, bit_prefix):
+        self.root = root
+        self.inotify = Inotify()
+        self.prefixes = {}
+        try:
+            self._watch_tree("")
+            # Only the cookies are of interest in the .bit directory
+            self.prefixes[self.inotify.add_watch(bit_dir, Inotify.IN_CREATE | Inotify.IN_ONLYDIR)] = bit_prefix
+        except OSError:
+            self.inotify.close()
+            raise
+
+    def fileno(self):
+        return self.inotify.fileno()
+
+    def read(self):
+        """Returns the paths changed since the last read, in event order."""
+        paths = []
+        for wd, mask, _, name in self.inotify.read():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                paths.append(FSMonitor.EVERYTHING)
+                continue
+            if mask & Inotify.IN_IGNORED:
+                self.prefixes.pop(wd, None)
+                continue
+            prefix = self.prefixes.get(wd)
+            if prefix is None:
+                continue
+            if not name:
+                # The parent directory reports moves and deletions, except for the root
+                if prefix == "" and mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF):
+                    paths.append(FSMonitor.EVERYTHING)
+                continue
+
+            path = prefix + name
+            if not mask & Inotify.IN_ISDIR:
+                paths.append(path)
+            elif mask & self.DIRECTORY_CHANGES and name not in Worktree.SKIPPED_DIRS:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self._watch_tree(path + '/')
+                elif mask & Inotify.IN_MOVED_FROM:
+                    self._unwatch_tree(path + '/')
+                paths.append(path + '/')
+        return paths
+
+    def close(self):
+        self.inotify.close()
+
+    # ----- UTILS -----
+    def _watch_tree(self, prefix):
+        """Watches a directory and everything below it, skipping .bit/.git and symlinks."""
+        stack = [prefix]
+        while stack:
+            prefix = stack.pop()
+            directory = os.path.join(self.root, prefix)
+            try:
+                self.prefixes[self.inotify.add_watch(directory, self.MASK)] = prefix
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and entry.name not in Worktree.SKIPPED_DIRS:
+                            stack.append(prefix + entry.name + '/')
+            except (FileNotFoundError, NotADirectoryError):
+                pass # Removed while we were adding it; its parent reports that
+
+    def _unwatch_tree(self, prefix):
+        for wd, watched in list(self.prefixes.items()):
+            if watched.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.prefixes[wd]
+
+class _PollingWatcher:
+    """
+    The pure-Python fallback: compares the stat data of every worktree file
+    with the previous scan. It has no descriptor to wait on, so the daemon
+    calls read() when a query comes in.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.snapshot = self._scan()
+
+    def fileno(self):
+        return None
+
+    def read(self):
+        snapshot = self._scan()
+        changed = [path for path in snapshot.keys() | self.snapshot.keys() if snapshot.get(path) != self.snapshot.get(path)]
+        self.snapshot = snapshot
+        return sorted(changed)
+
+    def close(self):
+        pass
+
+    # ----- UTILS -----
+    def _scan(self):
+        snapshot = {}
+        stack = [("", self.root)]
+        while stack:
+            prefix, directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in Worktree.SKIPPED_DIRS:
+                                stack.append((prefix + entry.name + '/', entry.path))
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        snapshot[prefix + entry.name] = (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino, st.st_mode)
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+        return snapshot
@@ -0,0 +1,32 @@
+class FSMonitorState:
+    """
+    The fsmonitor token of the last status, and the paths that didn't match
+    the index at that point (modified, deleted or untracked). Every other
+    tracked file is known to match its index entry unless the fsmonitor
+    reports it as changed after the token. A path whose index entry changes
+    is added to the paths, since its worktree file was only ever compared
+    with the old entry.
+    """
+
+    SIGNATURE = b'FSMN'
+
+    def __init__(self, token, paths=None):
+        self.token = token
+        self.paths = set(paths) if paths is not None else set()
+        self.dirty = False
+
+    def __eq__(self, other):
+        return isinstance(other, FSMonitorState) and self.token == other.token and self.paths == other.paths
+
+    def invalidate(self, path):
+        if path not in self.paths:
+            self.paths.add(path)
+            self.dirty = True
+
+    def serialize(self):
+        return '\0'.join([self.token, *sorted(self.paths)]).encode('utf-8')
+
+    @classmethod
+    def parse(cls, data):
+        token, *paths = bytes(data).decode('utf-8').split('\0')
+        return cls(token, paths)
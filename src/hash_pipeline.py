@@ -0,0 +1,61 @@
+import os
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .database import Database
+
+class HashPipeline:
+    """
+    Runs per-file work such as hashing on a pool of threads. hashlib and zlib
+    release the GIL, so the threads keep several disks' worth of reads busy.
+    Results come back in input order, and only a couple of files per worker
+    are in flight at once, so memory stays bounded however many files there
+    are. One worker (the default) runs everything inline; 0 or less uses
+    one per CPU.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    DEFAULT_WORKERS = 1
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers if workers >= 1 else (os.cpu_count() or 1)
+
+    def map(self, func, items):
+        """Yields (item, func(item)) for every item, in input order."""
+        if self.workers == 1:
+            for item in items:
+                yield item, func(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for item in items:
+                pending.append((item, executor.submit(func, item)))
+                if len(pending) >= 2 * self.workers:
+                    done_item, future = pending.popleft()
+                    yield done_item, future.result()
+            while pending:
+                done_item, future = pending.popleft()
+                yield done_item, future.result()
+
+    @classmethod
+    def hash_file(cls, path):
+        """
+        Returns the hash a file's content gets as a blob, reading it in
+        fixed-size chunks. The header needs the size up front, so if the file
+        changes size while it is read, it is hashed again from one full read.
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            sha = hashlib.sha1(Database.object_header('blob', size))
+            read_size = 0
+            while True:
+                chunk = f.read(cls.CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                read_size += len(chunk)
+            if read_size != size:
+                f.seek(0)
+                return Database.hash_content(f.read())
+        return sha.hexdigest()
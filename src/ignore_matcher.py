@@ -0,0 +1,74 @@
+import re
+
+class IgnoreMatcher:
+    """
+    Matches worktree paths against .bitignore rules using a few combined
+    regexes instead of testing every rule separately.
+
+    Rules without a slash apply to the basename only, so they are tested
+    against the entry name. Anchored rules ("/build") and rules that contain
+    a slash are tested against the whole relative path. Rules ending in "/"
+    only match directories. "*" and "?" don't match "/", while "**" does.
+    Walks skip ignored directories, so a rule never has to match the paths
+    below a directory it ignores.
+    """
+
+    def __init__(self, patterns=()):
+        rules = {(kind, dir_only): [] for kind in ('basename', 'path') for dir_only in (False, True)}
+        for pattern in patterns:
+            dir_only = pattern.endswith('/')
+            if dir_only:
+                pattern = pattern[:-1]
+
+            if pattern.startswith('/'):
+                rules[('path', dir_only)].append(self._translate(pattern[1:]))
+            elif '/' in pattern:
+                rules[('path', dir_only)].append('(?:.*/)?' + self._translate(pattern))
+            else:
+                rules[('basename', dir_only)].append(self._translate(pattern))
+
+        self.file_basename = self._combine(rules[('basename', False)])
+        self.file_path = self._combine(rules[('path', False)])
+        self.dir_basename = self._combine(rules[('basename', False)] + rules[('basename', True)])
+        self.dir_path = self._combine(rules[('path', False)] + rules[('path', True)])
+
+    @classmethod
+    def from_file(cls, path):
+        """Reads the rules of an ignore file, skipping blank lines and comments."""
+        patterns = []
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        patterns.append(line)
+        except FileNotFoundError:
+            pass
+        return cls(patterns)
+
+    def matches(self, path, is_dir=False):
+        """Checks a single relative path, assuming the directories above it are not ignored."""
+        basename_rule, path_rule = (self.dir_basename, self.dir_path) if is_dir else (self.file_basename, self.file_path)
+        if basename_rule and basename_rule.fullmatch(path.rpartition('/')[2]):
+            return True
+        return bool(path_rule and path_rule.fullmatch(path))
+
+    def is_ignored(self, path, is_dir=False):
+        """Checks a relative path, including every directory above it."""
+        components = path.split('/')
+        for i in range(1, len(components)):
+            if self.matches('/'.join(components[:i]), is_dir=True):
+                return True
+        return self.matches(path, is_dir)
+
+    # ----- UTILS -----
+    @staticmethod
+    def _translate(pattern):
+        regex = re.escape(pattern)
+        return regex.replace(r'\*\*', '.*').replace(r'\*', '[^/]*').replace(r'\?', '[^/]')
+
+    @staticmethod
+    def _combine(regexes):
+        if not regexes:
+            return None
+        return re.compile('|'.join(f'(?:{regex})' for regex in regexes))
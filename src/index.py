@@ -1,54 +1,462 @@
 import os
+import mmap
+import bisect
+import hashlib
+import struct
+from .cache_tree import CacheTree
+from .untracked_cache import UntrackedCache
+from .fsmonitor_state import FSMonitorState
+
+class IndexEntry:
+    """A single staged file: its blob hash plus the stat data it had when staged."""
+
+    def __init__(self, path, hash, ctime=0, mtime=0, size=0, ino=0, mode=0):
+        self.path = path
+        self.hash = hash
+        self.ctime = ctime
+        self.mtime = mtime
+        self.size = size
+        self.ino = ino
+        self.mode = mode
+
+    @classmethod
+    def from_stat(cls, path, hash, st):
+        """Builds an entry from an os.stat_result (nanosecond timestamps)."""
+        if st is None:
+            return cls(path, hash)
+        return cls(path, hash, st.st_ctime_ns, st.st_mtime_ns, st.st_size, st.st_ino, st.st_mode)
+
+    def stat_matches(self, st):
+        """Checks if the stat data recorded in the entry still describes the file."""
+        return (self.mtime == st.st_mtime_ns
+                and self.ctime == st.st_ctime_ns
+                and self.size == st.st_size
+                and self.ino == st.st_ino
+                and self.mode == st.st_mode)
 
 class Index:
-    """Manages the staging area (the index file)."""
+    """
+    Manages the staging area (the index file).
+
+    Binary layout (all integers big-endian):
+        header   signature "BIDX", version, entry count, path table size
+        records  one fixed-width record per entry, sorted by path:
+                 raw 20-byte hash, ctime, mtime, size, inode, mode,
+                 path offset and path length into the path table
+        paths    the utf-8 encoded paths, concatenated
+        extensions  optional sections, each a 4-byte signature, a length and
+                 its data (e.g. the cache tree)
+        trailer  SHA-1 of everything above
+    """
+
+    SIGNATURE = b'BIDX'
+    VERSION = 2
+    HEADER = struct.Struct('>4sIII')
+    EXTENSION_HEADER = struct.Struct('>4sI')
+    RECORD = struct.Struct('>20sQQQQIII')
+    PATH_FIELDS = struct.Struct('>II')
+    PATH_FIELDS_OFFSET = 56
+    CHECKSUM_SIZE = 20
 
     def __init__(self, path):
         self.path = path
-        
+        self.mtime = 0
+
     def load_as_list(self):
         """Load the index file into a list of file paths."""
-        entries = []
-        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
-            with open(self.path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    hash, path = line.strip().split(' ', 1)
-                    entries.append(path)
-        return entries
+        return list(self.load_entries().keys())
 
     def load_as_dict(self):
         """Load the index file into a dictionary of {path: hash}."""
-        entries = {}
-        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
-            with open(self.path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    hash, path = line.strip().split(' ', 1)
-                    entries[path] = hash
+        return {path: entry.hash for path, entry in self.load_entries().items()}
+
+    def load_entries(self):
+        """Load the index file into a dictionary of {path: IndexEntry}, sorted by path."""
+        entries, _ = self.load(include_cache_tree=False)
         return entries
-    
-    def write(self, entries_dict):
-        """Write a dictionary of {path: hash} to the index file."""
-        # Convert dict to list format for sorting and writing
-        entries_list = [{'path': p, 'hash': h} for p, h in entries_dict.items()]
-        entries_list.sort(key=lambda e: e['path'])
-        
-        with open(self.path, 'w', encoding='utf-8') as f:
-            for entry in entries_list:
-                f.write(f"{entry['hash']} {entry['path']}\n")
-    
+
+    def get(self, path):
+        """
+        Looks up a single path with a binary search over the memory-mapped
+        records, touching only the pages it needs. The checksum is left to
+        full loads, which read the whole file anyway.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            st = os.fstat(f.fileno())
+            self.mtime = st.st_mtime_ns
+            if not st.st_size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(self.SIGNATURE)] != self.SIGNATURE:
+                    return self._parse_text(data[:]).get(path)
+
+                count, paths_start, _ = self._parse_header(data, verify=False)
+                paths = _RecordPaths(data, count, paths_start)
+                i = bisect.bisect_left(paths, path)
+                if i < count and paths[i] == path:
+                    return self._parse_record(data, i, paths_start)
+                return None
+
+    def load_cache_tree(self):
+        """Load the cache tree extension, or an empty CacheTree if there is none."""
+        _, cache_tree = self.load(include_entries=False)
+        return cache_tree
+
+    def load_untracked_cache(self):
+        """Load the untracked cache extension, or None if there is none."""
+        _, _, untracked_cache, _ = self._load(include_entries=False, include_cache_tree=False, include_fsmonitor=False)
+        return untracked_cache
+
+    def load_fsmonitor_state(self):
+        """Load the fsmonitor extension, or None if there is none."""
+        _, _, _, fsmonitor_state = self._load(include_entries=False, include_cache_tree=False, include_untracked_cache=False)
+        return fsmonitor_state
+
+    def load(self, include_entries=True, include_cache_tree=True):
+        """Parses the entries ({path: IndexEntry}) and the cache tree from a single read of the index file."""
+        entries, cache_tree, _, _ = self._load(include_entries, include_cache_tree, include_untracked_cache=False, include_fsmonitor=False)
+        return entries, cache_tree
+
+    def transaction(self):
+        """
+        Opens the index once for a batch of changes. Use it as a context manager:
+        the changes are written in a single atomic write when the block exits
+        without an exception, and discarded otherwise.
+        """
+        return IndexTransaction(self)
+
+    def write(self, entries_dict, cache_tree=None, untracked_cache=None, fsmonitor_state=None):
+        """
+        Write a dictionary of {path: hash} or {path: IndexEntry} to the index file.
+        Plain hashes are stored without stat data, so they get re-hashed on the next status.
+        Callers that know which paths they touched pass an already invalidated cache
+        tree; otherwise the previous one is invalidated for every path that changed.
+        The untracked cache and the fsmonitor state are only kept if they are passed in.
+        """
+        if cache_tree is None:
+            with self.transaction() as index:
+                index.replace_all(entries_dict)
+            return
+        self._write_locked(self._lock(), entries_dict, cache_tree, untracked_cache, fsmonitor_state)
+
     def remove(self, path):
-        entries = self.load_as_dict()
-        if path in entries:
-            del entries[path]
-            self.write(entries)
-          
+        with self.transaction() as index:
+            index.remove(path)
+
     def clear(self):
         """Clear the index file."""
-        open(self.path, 'w').close()
+        self.write({}, CacheTree())
 
     def is_empty(self):
         """Check if the index is empty."""
-        if not os.path.exists(self.path):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
             return True
-        return os.path.getsize(self.path) == 0
+        with open(self.path, 'rb') as f:
+            header = f.read(self.HEADER.size)
+        if not header.startswith(self.SIGNATURE):
+            return False
+        return self.HEADER.unpack(header)[2] == 0
+
+    def is_stat_clean(self, entry, st):
+        """
+        Checks if a file can reuse its cached hash. Files modified in the same
+        timestamp tick as the index was written are "racily clean": their stat
+        data can't prove the content is unchanged, so they must be re-hashed.
+        """
+        if st is None or not entry.stat_matches(st):
+            return False
+        return entry.mtime < self.mtime
+
+    # ----- UTILS -----
+    def _lock(self):
+        """
+        Creates index.lock and returns its file descriptor, raising FileExistsError
+        if it already exists. Whoever holds it is the only one allowed to write
+        the index.
+        """
+        lock_path = self.path + '.lock'
+        try:
+            return os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            raise FileExistsError(f"Unable to create '{lock_path}': another bit process seems to be running")
+
+    def _unlock(self, fd):
+        """Gives up index.lock without touching the index."""
+        os.close(fd)
+        os.remove(self.path + '.lock')
+
+    def _write_locked(self, fd, entries_dict, cache_tree, untracked_cache=None, fsmonitor_state=None):
+        """Writes the index into the held lock file and renames it over the index, releasing the lock."""
+        # Readers never see a half-written index: it only replaces the old one once complete
+        lock_path = self.path + '.lock'
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                body = self._serialize(entries_dict, cache_tree, untracked_cache, fsmonitor_state)
+                f.write(body + hashlib.sha1(body).digest())
+            os.replace(lock_path, self.path)
+        except BaseException:
+            os.remove(lock_path)
+            raise
+        self.mtime = os.stat(self.path).st_mtime_ns
+        cache_tree.dirty = False
+        if untracked_cache is not None:
+            untracked_cache.dirty = False
+        if fsmonitor_state is not None:
+            fsmonitor_state.dirty = False
+
+    def _serialize(self, entries_dict, cache_tree, untracked_cache, fsmonitor_state):
+        records = []
+        path_table = bytearray()
+        sorted_paths = sorted(entries_dict)
+        for path in sorted_paths:
+            entry = entries_dict[path]
+            if not isinstance(entry, IndexEntry):
+                entry = IndexEntry(path, entry)
+            path_bytes = path.encode('utf-8')
+            records.append(self.RECORD.pack(
+                bytes.fromhex(entry.hash), entry.ctime, entry.mtime, entry.size,
+                entry.ino, entry.mode, len(path_table), len(path_bytes)
+            ))
+            path_table += path_bytes
+
+        header = self.HEADER.pack(self.SIGNATURE, self.VERSION, len(sorted_paths), len(path_table))
+        extensions = []
+        if cache_tree.trees:
+            tree_data = cache_tree.serialize()
+            extensions.append(self.EXTENSION_HEADER.pack(CacheTree.SIGNATURE, len(tree_data)) + tree_data)
+        if untracked_cache is not None and untracked_cache.ignore_hash is not None:
+            untracked_data = untracked_cache.serialize()
+            extensions.append(self.EXTENSION_HEADER.pack(UntrackedCache.SIGNATURE, len(untracked_data)) + untracked_data)
+        if fsmonitor_state is not None:
+            fsmonitor_data = fsmonitor_state.serialize()
+            extensions.append(self.EXTENSION_HEADER.pack(FSMonitorState.SIGNATURE, len(fsmonitor_data)) + fsmonitor_data)
+        return b''.join([header, *records, path_table, *extensions])
+
+    def _load(self, include_entries=True, include_cache_tree=True, include_untracked_cache=True, include_fsmonitor=True):
+        data = self._read()
+        if data is None:
+            return {}, CacheTree(), None, None
+        if not data.startswith(self.SIGNATURE):
+            return self._parse_text(data), CacheTree(), None, None
+
+        count, paths_start, extensions_start = self._parse_header(data)
+        entries = {}
+        if include_entries:
+            for i in range(count):
+                entry = self._parse_record(data, i, paths_start)
+                entries[entry.path] = entry
+
+        cache_tree = CacheTree()
+        untracked_cache = None
+        fsmonitor_state = None
+        if include_cache_tree or include_untracked_cache or include_fsmonitor:
+            extensions = self._parse_extensions(data, extensions_start)
+            if include_cache_tree and CacheTree.SIGNATURE in extensions:
+                cache_tree = CacheTree.parse(extensions[CacheTree.SIGNATURE])
+            if include_untracked_cache and UntrackedCache.SIGNATURE in extensions:
+                untracked_cache = UntrackedCache.parse(extensions[UntrackedCache.SIGNATURE])
+            if include_fsmonitor and FSMonitorState.SIGNATURE in extensions:
+                fsmonitor_state = FSMonitorState.parse(extensions[FSMonitorState.SIGNATURE])
+        return entries, cache_tree, untracked_cache, fsmonitor_state
+
+    def _read(self):
+        """Reads the whole index file in one go, returning None if there is none."""
+        try:
+            with open(self.path, 'rb') as f:
+                self.mtime = os.fstat(f.fileno()).st_mtime_ns
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return data or None
+
+    def _parse_header(self, data, verify=True):
+        signature, version, count, paths_size = self.HEADER.unpack_from(data)
+        if version != self.VERSION:
+            raise Exception(f"Unsupported index version {version}")
+
+        if verify:
+            body = memoryview(data)[:-self.CHECKSUM_SIZE]
+            if hashlib.sha1(body).digest() != data[-self.CHECKSUM_SIZE:]:
+                raise Exception("Index file is corrupt: checksum mismatch")
+
+        paths_start = self.HEADER.size + count * self.RECORD.size
+        return count, paths_start, paths_start + paths_size
+
+    def _parse_extensions(self, data, offset):
+        """Returns {signature: data} for every extension section."""
+        extensions = {}
+        end = len(data) - self.CHECKSUM_SIZE
+        while offset < end:
+            signature, size = self.EXTENSION_HEADER.unpack_from(data, offset)
+            offset += self.EXTENSION_HEADER.size
+            extensions[signature] = memoryview(data)[offset:offset + size]
+            offset += size
+        return extensions
+
+    def _parse_record(self, data, i, paths_start):
+        hash, ctime, mtime, size, ino, mode, path_offset, path_length = self.RECORD.unpack_from(
+            data, self.HEADER.size + i * self.RECORD.size
+        )
+        start = paths_start + path_offset
+        path = data[start:start + path_length].decode('utf-8')
+        return IndexEntry(path, hash.hex(), ctime, mtime, size, ino, mode)
+
+    @staticmethod
+    def _parse_text(data):
+        """Parses the legacy text index ("hash path" or tab-separated stat lines)."""
+        entries = {}
+        for line in data.decode('utf-8').splitlines():
+            if '\t' not in line:
+                hash, path = line.split(' ', 1)
+                entries[path] = IndexEntry(path, hash)
+                continue
+
+            hash, ctime, mtime, size, ino, mode, path = line.split('\t', 6)
+            entries[path] = IndexEntry(path, hash, int(ctime), int(mtime), int(size), int(ino), int(mode))
+        return dict(sorted(entries.items()))
+
+class IndexTransaction:
+    """
+    An in-memory copy of the index that collects changes and writes them once.
+    It holds index.lock from the moment it reads the index until it commits or
+    aborts, so a second writer fails up front instead of writing over changes
+    it never saw.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.lock_fd = index._lock()
+        try:
+            self.entries, self.cache_tree, self.untracked_cache, self.fsmonitor_state = index._load()
+        except BaseException:
+            self.abort()
+            raise
+        self.changed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def get(self, path):
+        """Returns the IndexEntry staged for a path, or None."""
+        return self.entries.get(path)
+
+    def as_dict(self):
+        """Returns the staged entries as {path: hash}."""
+        return {path: entry.hash for path, entry in self.entries.items()}
+
+    def add(self, path, hash, st=None):
+        """Stages a file, invalidating the cached trees above it if its content changed."""
+        previous = self.entries.get(path)
+        if previous is None or previous.hash != hash:
+            self.cache_tree.invalidate(path)
+            self._invalidate_fsmonitor(path)
+        self.entries[path] = IndexEntry.from_stat(path, hash, st)
+        self.changed = True
+
+    def refresh(self, entry):
+        """Replaces the stat data of an entry whose content is known to be unchanged."""
+        current = self.entries.get(entry.path)
+        if current is not None and current.hash == entry.hash:
+            self.entries[entry.path] = entry
+            self.changed = True
+
+    def remove(self, path):
+        """Unstages a path. Returns True if it was in the index."""
+        if path not in self.entries:
+            return False
+        del self.entries[path]
+        self.cache_tree.invalidate(path)
+        self._invalidate_untracked(path)
+        self._invalidate_fsmonitor(path)
+        self.changed = True
+        return True
+
+    def replace_all(self, entries_dict):
+        """
+        Replaces the whole index with {path: hash} or {path: IndexEntry}, keeping
+        the cached trees of every directory whose contents didn't change.
+        """
+        new_entries = {}
+        for path, entry in entries_dict.items():
+            new_entries[path] = entry if isinstance(entry, IndexEntry) else IndexEntry(path, entry)
+
+        for path in self.entries.keys() | new_entries.keys():
+            old, new = self.entries.get(path), new_entries.get(path)
+            if old is None or new is None or old.hash != new.hash:
+                self.cache_tree.invalidate(path)
+                self._invalidate_fsmonitor(path)
+            if new is None:
+                self._invalidate_untracked(path)
+
+        self.entries = new_entries
+        self.changed = True
+
+    def set_untracked_cache(self, untracked_cache):
+        """Stores the untracked cache updated by a worktree walk."""
+        self.untracked_cache = untracked_cache
+        self.changed = True
+
+    def set_fsmonitor_state(self, fsmonitor_state):
+        """Stores the fsmonitor token and unmatched paths of a status, if they changed."""
+        if fsmonitor_state != self.fsmonitor_state:
+            self.fsmonitor_state = fsmonitor_state
+            self.changed = True
+
+    def commit(self):
+        """Writes the index if anything changed, and releases the lock."""
+        untracked_dirty = self.untracked_cache is not None and self.untracked_cache.dirty
+        fsmonitor_dirty = self.fsmonitor_state is not None and self.fsmonitor_state.dirty
+        if self.changed or self.cache_tree.dirty or untracked_dirty or fsmonitor_dirty:
+            lock_fd, self.lock_fd = self.lock_fd, None
+            self.index._write_locked(lock_fd, self.entries, self.cache_tree, self.untracked_cache, self.fsmonitor_state)
+            self.changed = False
+        else:
+            self.abort()
+
+    def abort(self):
+        """Drops the changes and releases the lock."""
+        if self.lock_fd is not None:
+            lock_fd, self.lock_fd = self.lock_fd, None
+            self.index._unlock(lock_fd)
+
+    # ----- UTILS -----
+    def _invalidate_untracked(self, path):
+        """A file that stops being tracked may still be on disk, now as an untracked file."""
+        if self.untracked_cache is not None:
+            self.untracked_cache.invalidate(path)
+
+    def _invalidate_fsmonitor(self, path):
+        """A file whose index entry changes has to be compared again, whatever the fsmonitor says."""
+        if self.fsmonitor_state is not None:
+            self.fsmonitor_state.invalidate(path)
+
+class _RecordPaths:
+    """Sequence view over the record paths of a binary index, decoded on demand for bisect."""
+
+    def __init__(self, data, count, paths_start):
+        self.data = data
+        self.count = count
+        self.paths_start = paths_start
+
+    def __len__(self):
+        return self.count
 
+    def __getitem__(self, i):
+        record_start = Index.HEADER.size + i * Index.RECORD.size
+        path_offset, path_length = Index.PATH_FIELDS.unpack_from(self.data, record_start + Index.PATH_FIELDS_OFFSET)
+        start = self.paths_start + path_offset
+        return self.data[start:start + path_length].decode('utf-8')
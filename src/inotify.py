@@ -0,0 +1,81 @@
+import os
+import ctypes
+import ctypes.util
+import struct
+
+class Inotify:
+    """
+    A minimal ctypes binding for Linux inotify. The descriptor is non-blocking,
+    so read() returns whatever events are queued. Raises OSError on systems
+    without inotify.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_EXCL_UNLINK = 0x04000000
+    IN_ISDIR = 0x40000000
+
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+    EVENT = struct.Struct('iIII')
+    READ_SIZE = 64 * 1024
+
+    def __init__(self):
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init = self.libc.inotify_init1
+        except (OSError, AttributeError, TypeError):
+            raise OSError("inotify is not available on this system")
+        self.fd = self._check(init(self.IN_NONBLOCK | self.IN_CLOEXEC))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """Watches a path, returning its watch descriptor (the same one if it is already watched)."""
+        return self._check(self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask)))
+
+    def rm_watch(self, wd):
+        try:
+            self._check(self.libc.inotify_rm_watch(self.fd, wd))
+        except OSError:
+            pass # Already gone with its directory
+
+    def read(self):
+        """Returns the queued events as (watch descriptor, mask, cookie, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, self.READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        os.close(self.fd)
+
+    # ----- UTILS -----
+    @staticmethod
+    def _check(result):
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return result
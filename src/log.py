@@ -1,11 +1,18 @@
 from .formatter import Formatter
+from .commit import Commit
 
 class Log:
-    def __init__(self, hash, commit, head_ref, refs):
+    """A log entry. The commit is only parsed when it is first used, e.g. to format the entry."""
+
+    def __init__(self, hash, database, head_ref, refs):
         self.hash = hash
-        self.commit = commit
+        self.database = database
         self.head_ref = head_ref
         self.refs = refs
+
+    @property
+    def commit(self):
+        return Commit.load(self.database, self.hash)
         
     def format(self):
       lines = []
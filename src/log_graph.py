@@ -0,0 +1,67 @@
+class LogGraph:
+    """
+    Draws the ASCII history graph to the left of log entries. Each column is
+    a line of history waiting for the commit it leads to, so entries have to
+    come in topological order. A merge opens a column for each parent not
+    already waited for, and a commit whose parent is already waited for in
+    another column folds into it:
+
+        * commit merge
+        |\\  Merge: ...
+        | * commit side
+        * | commit master
+        |/
+        * commit base
+    """
+
+    def __init__(self):
+        self.columns = []
+
+    def format(self, commit_hash, parent_hashes, text):
+        """Returns text with the graph drawn to its left, the commit's node on its first line."""
+        if commit_hash not in self.columns:
+            self.columns.append(commit_hash)
+        index = self.columns.index(commit_hash)
+        parents = list(dict.fromkeys(parent_hashes))
+
+        new_parents = [parent for parent in parents if parent not in self.columns]
+        new_columns = self.columns[:index] + new_parents + self.columns[index + 1:]
+        edges = []
+        for i, hash in enumerate(self.columns):
+            if i == index:
+                edges.extend((i, new_columns.index(parent)) for parent in parents)
+            else:
+                edges.append((i, new_columns.index(hash)))
+
+        lines = text.split('\n')
+        node_row = ''.join('* ' if i == index else '| ' for i in range(len(self.columns)))
+        output = [self._join(node_row, lines[0])]
+
+        rest = lines[1:]
+        width = 2 * max(len(self.columns), len(new_columns))
+        if any(source != target for source, target in edges):
+            edge_row = self._edge_row(edges, width)
+            output.append(self._join(edge_row, rest.pop(0)) if rest else edge_row.rstrip())
+        self.columns = new_columns
+
+        # Keep the entry's text lined up with the widest row drawn for it
+        column_row = ('| ' * len(self.columns)).ljust(width)
+        output.extend(self._join(column_row, line) for line in rest)
+        return '\n'.join(output)
+
+    # ----- UTILS -----
+    @staticmethod
+    def _edge_row(edges, width):
+        row = [' '] * width
+        for source, target in edges:
+            if target == source:
+                row[2 * source] = '|'
+            elif target > source:
+                row[2 * source + 1] = '\\'
+            else:
+                row[2 * source - 1] = '/'
+        return ''.join(row)
+
+    @staticmethod
+    def _join(prefix, line):
+        return prefix + line if line else prefix.rstrip()
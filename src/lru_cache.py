@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    A least-recently-used cache bounded by the total size of its values.
+    A budget of 0 disables it. Hit and miss counters help tune the budget.
+    It is safe to share between threads.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """Returns the cached value (marking it recently used), or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Caches a value, evicting the least recently used ones to stay within budget."""
+        with self.lock:
+            if size > self.max_bytes or key in self.entries:
+                return
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def format_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evictions} evictions, {self.current_bytes}/{self.max_bytes} bytes in {len(self)} entries")
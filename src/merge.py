@@ -1,8 +1,9 @@
-from collections import deque
 from .commit import Commit
 from .tree import Tree
 from .ref import Ref
 from .diff_calculator import DiffCalculator
+from .migration import Migration
+from .merge_base import MergeBase
 from exceptions.merge_conflict import MergeConflict
 import os
 
@@ -34,44 +35,29 @@ class Merge:
         return f"MERGE_SUCCESS:{commit_hash}"
             
     def fast_forward(self):
-        self.head_ref.update(self.other_ref.read_hash())
-        self.repo.checkout(self.head_ref.name, force=True)
+        head_hash = self.head_ref.read_hash()
+        other_hash = self.other_ref.read_hash()
+        self.head_ref.update(other_hash)
+        Migration.between_commits(self.repo, head_hash, other_hash).apply()
         
     def resolve_automatic_merge(self):
-      base_entries = Tree.get_entries_from_commit(self.repo.db, self.base_hash)
-      head_entries = Tree.get_entries_from_commit(self.repo.db, self.head_ref.read_hash())
-      other_entries = Tree.get_entries_from_commit(self.repo.db, self.other_ref.read_hash())
-      
-      all_paths = set(base_entries.keys()) | set(head_entries.keys()) | set(other_entries.keys())
-      merged_entries = {}
-
-      for path in all_paths:
-          base = base_entries.get(path)
-          head = head_entries.get(path)
-          other = other_entries.get(path)
-
-          if head == other:
-              if head: merged_entries[path] = head
-          elif base == head:
-              if other: merged_entries[path] = other
-          elif base == other:
-              if head: merged_entries[path] = head
-          else:
-                head_diff = DiffCalculator.calculate_file_vs_file(self.repo, path, base, head, n=0)
-                other_diff = DiffCalculator.calculate_file_vs_file(self.repo, path, base, other, n=0)
+      changes = []
+      with self.repo.db.batch():
+          for path, base, head, other in self._changed_paths():
+              if base == other:
+                  continue
+              if base == head:
+                  changes.append((path, head, other))
+              else:
+                    head_diff = DiffCalculator.calculate_file_vs_file(self.repo, path, base, head, n=0)
+                    other_diff = DiffCalculator.calculate_file_vs_file(self.repo, path, base, other, n=0)
                 
-                base_content = self.repo.db.read(base)
-                merged_content = self._merge_file_contents(base_content, head_diff, other_diff)
-                merged_entries[path] = self.repo.db.store(merged_content)
+                    base_content = self.repo.db.read(base)
+                    merged_content = self._merge_file_contents(base_content, head_diff, other_diff)
+                    changes.append((path, head, self.repo.db.store(merged_content)))
 
-      self.repo.index.write(merged_entries)
-      for path, hash_val in merged_entries.items():
-          content = self.repo.db.read(hash_val)
-          self.repo.worktree.write_file(path, content)
-      
-      for path in head_entries:
-          if path not in merged_entries:
-              self.repo.worktree.remove_file(path)
+      # The worktree is clean, so only the paths the merge changed need updating
+      Migration(self.repo, changes).apply()
 
       # Record MERGE_HEAD so Repository.commit knows to add the second parent
       merge_head_path = os.path.join(self.repo.bit_dir, 'MERGE_HEAD')
@@ -99,53 +85,15 @@ class Merge:
         
     # ----- UTILS -----
     def find_common_ancestor(self):
-        head_hash = self.head_ref.read_hash()
-        other_hash = self.other_ref.read_hash()
-        
-        def parents_of(commit_hash):
-            commit = Commit.parse(self.repo.db.read(commit_hash))
-            return commit.parent_hashes or []
-
-        # BFS backwards from head to get all reachable ancestors in DAG
-        head_ancestors = set()
-        queue = deque([head_hash])
-        
-        while queue:
-            curr = queue.popleft()
-            if curr in head_ancestors:
-                continue
-            head_ancestors.add(curr)
-            queue.extend(parents_of(curr))
-
-        # BFS from other until we hit something in head_ancestors
-        queue = deque([other_hash])
-        visited = set()
-
-        while queue:
-            curr = queue.popleft()
-            if curr in head_ancestors:
-                return curr
-            if curr in visited:
-                continue
-            visited.add(curr)
-            queue.extend(parents_of(curr))
-
-        return None
-
+        cache_path = os.path.join(self.repo.bit_dir, MergeBase.CACHE_NAME)
+        return MergeBase(self.repo.db, cache_path).find(self.head_ref.read_hash(), self.other_ref.read_hash())
 
     def get_conflicts(self):
-        base_entries = Tree.get_entries_from_commit(self.repo.db, self.base_hash)
-        head_entries = Tree.get_entries_from_commit(self.repo.db, self.head_ref.read_hash())
-        other_entries = Tree.get_entries_from_commit(self.repo.db, self.other_ref.read_hash())
-        
-        all_paths = set(base_entries.keys()) | set(head_entries.keys()) | set(other_entries.keys())
         modify_conflicts = []
         delete_conflicts = []
         
-        for path in sorted(all_paths):
-            in_base = base_entries.get(path)
-            in_head = head_entries.get(path)
-            in_other = other_entries.get(path)
+        # Only paths that differ between the branches can conflict
+        for path, in_base, in_head, in_other in sorted(self._changed_paths()):
             
             # check for different changes in both branches
             if in_base and in_head and in_other and in_head != in_other:
@@ -157,4 +105,13 @@ class Merge:
             if (in_base and in_head and in_base != in_head and not in_other) or (in_base and in_other and in_other != in_head and not in_head):
                 delete_conflicts.append({ "modified": self.head_ref.name if in_head else self.other_ref.name, "deleted": self.head_ref.name if not in_head else self.head_ref.name })
         
-        return modify_conflicts, delete_conflicts
\ No newline at end of file
+        return modify_conflicts, delete_conflicts
+
+    def _changed_paths(self):
+        """Yields (path, base, head, other) blob hashes for every path where head and other differ."""
+        return Tree.diff_three(
+            self.repo.db,
+            Commit.tree_hash_of(self.repo.db, self.base_hash),
+            Commit.tree_hash_of(self.repo.db, self.head_ref.read_hash()),
+            Commit.tree_hash_of(self.repo.db, self.other_ref.read_hash())
+        )
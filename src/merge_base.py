@@ -0,0 +1,143 @@
+import os
+import heapq
+from .commit import Commit
+
+class MergeBase:
+    """
+    Finds the best common ancestor of two commits.
+
+    Both sides are walked at once from a priority queue that always pops the
+    commit with the highest generation number (then the newest), marking
+    every commit with the sides it is reachable from. Parents always have a
+    lower generation, so once every queued commit is already known to be
+    below a common ancestor the walk stops, without ever visiting the shared
+    history beneath. Commits missing from the commit-graph rank above all
+    others, since none of the commits in it can have them as ancestors.
+
+    When several common ancestors remain (criss-cross merges), those that
+    are ancestors of another one are dropped, and the one with the highest
+    generation (then the newest) wins.
+
+    Results are kept in a small cache file keyed by the pair of commits:
+    commits never change, so neither does their merge base.
+    """
+
+    CACHE_NAME = 'merge-base-cache'
+    MAX_CACHE_ENTRIES = 256
+    NONE = '-'
+
+    HEAD = 1
+    OTHER = 2
+    STALE = 4
+
+    def __init__(self, database, cache_path=None):
+        self.database = database
+        self.cache_path = cache_path
+
+    def find(self, head_hash, other_hash):
+        """Returns the merge base of two commits, or None if they share no history."""
+        if not head_hash or not other_hash:
+            return None
+        key = tuple(sorted((head_hash, other_hash)))
+        cache = self._read_cache()
+        if key in cache:
+            return cache[key]
+
+        candidates = self._common_ancestors(head_hash, other_hash)
+        base = self._best(candidates)
+        cache[key] = base
+        self._write_cache(cache)
+        return base
+
+    def is_ancestor(self, ancestor, descendant):
+        """Checks if ancestor is reachable from descendant, not walking below ancestor's generation."""
+        cutoff = Commit.rank_of(self.database, ancestor)[0]
+        stack = [descendant]
+        seen = set()
+        while stack:
+            commit_hash = stack.pop()
+            if commit_hash == ancestor:
+                return True
+            if commit_hash in seen:
+                continue
+            seen.add(commit_hash)
+            for parent in Commit.parents_of(self.database, commit_hash):
+                if Commit.rank_of(self.database, parent)[0] >= cutoff:
+                    stack.append(parent)
+        return False
+
+    # ----- UTILS -----
+    def _common_ancestors(self, head_hash, other_hash):
+        if head_hash == other_hash:
+            return [head_hash]
+
+        flags = {head_hash: self.HEAD, other_hash: self.OTHER}
+        queue = []
+        self._push(queue, head_hash)
+        self._push(queue, other_hash)
+        queued = {head_hash, other_hash}
+        results = []
+
+        # Stop once nothing in the queue can lead to a new common ancestor
+        active = 2
+        while active:
+            _, _, commit_hash = heapq.heappop(queue)
+            queued.discard(commit_hash)
+            commit_flags = flags[commit_hash]
+            if not commit_flags & self.STALE:
+                active -= 1
+                if commit_flags & (self.HEAD | self.OTHER) == self.HEAD | self.OTHER:
+                    results.append(commit_hash)
+                    commit_flags |= self.STALE
+                    flags[commit_hash] = commit_flags
+
+            for parent in Commit.parents_of(self.database, commit_hash):
+                parent_flags = flags.get(parent, 0)
+                new_flags = parent_flags | commit_flags
+                if new_flags == parent_flags:
+                    continue
+                flags[parent] = new_flags
+                if parent not in queued:
+                    self._push(queue, parent)
+                    queued.add(parent)
+                    if not new_flags & self.STALE:
+                        active += 1
+                elif new_flags & self.STALE and not parent_flags & self.STALE:
+                    active -= 1
+        return results
+
+    def _best(self, candidates):
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        independent = [c for c in candidates
+                       if not any(other != c and self.is_ancestor(c, other) for other in candidates)]
+        return max(independent, key=lambda c: (Commit.rank_of(self.database, c), c))
+
+    def _push(self, queue, commit_hash):
+        generation, commit_time = Commit.rank_of(self.database, commit_hash)
+        heapq.heappush(queue, (-generation, -commit_time, commit_hash))
+
+    def _read_cache(self):
+        """Returns {(commit, commit): base or None}, oldest first."""
+        cache = {}
+        if self.cache_path is None:
+            return cache
+        try:
+            with open(self.cache_path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 3:
+                        cache[(parts[0], parts[1])] = None if parts[2] == self.NONE else parts[2]
+        except FileNotFoundError:
+            pass
+        return cache
+
+    def _write_cache(self, cache):
+        if self.cache_path is None:
+            return
+        entries = list(cache.items())[-self.MAX_CACHE_ENTRIES:]
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for (first, second), base in entries:
+                f.write(f"{first} {second} {base or self.NONE}\n")
+        os.replace(temp_path, self.cache_path)
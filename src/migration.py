@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .commit import Commit
+from .config import Config
+from .index import IndexEntry
+from .tree import Tree
+
+class Migration:
+    """
+    Moves the worktree and the index from one tree to another, writing or
+    deleting only the paths whose blob hash differs. Unchanged files are not
+    touched, so their mtimes (and every build tool's view of them) survive.
+    Trees don't record file modes, so there are no mode-only changes to apply.
+
+    Changes are (path, current blob hash, target blob hash) tuples, with None
+    for a missing side.
+
+    Large updates are written from a pool of checkout.workers threads (1, the
+    default, writes serially; 0 or less uses one per CPU) once at least
+    checkout.thresholdForParallelism files change.
+    """
+
+    DEFAULT_WORKERS = 1
+    DEFAULT_PARALLEL_THRESHOLD = 100
+
+    def __init__(self, repo, changes, target_entries=None):
+        self.repo = repo
+        self.changes = list(changes)
+        self.target_entries = target_entries
+
+    @classmethod
+    def between_trees(cls, repo, current_tree_hash, target_tree_hash):
+        """
+        Plans the move between two trees for a clean worktree whose index matches
+        the current tree. Only the trees along changed paths are read.
+        """
+        return cls(repo, Tree.diff_trees(repo.db, current_tree_hash, target_tree_hash))
+
+    @classmethod
+    def from_worktree(cls, repo, commit_hash, remove_untracked=False):
+        """
+        Plans the move from whatever is on disk to a commit, discarding local
+        changes. Untracked files are kept unless remove_untracked is set.
+        The index is reset to the commit's entries.
+        """
+        target_entries = Tree.get_entries_from_commit(repo.db, commit_hash)
+        worktree_entries = repo.worktree.list_and_hash_files(repo.index)
+        tracked = repo.index.load_entries()
+
+        changes = []
+        for path in sorted(target_entries.keys() | worktree_entries.keys()):
+            current, target = worktree_entries.get(path), target_entries.get(path)
+            if current == target:
+                continue
+            if target is None and not remove_untracked and path not in tracked:
+                continue
+            changes.append((path, current, target))
+        return cls(repo, changes, target_entries)
+
+    @classmethod
+    def between_commits(cls, repo, current_hash, target_hash):
+        return cls.between_trees(repo, Commit.tree_hash_of(repo.db, current_hash), Commit.tree_hash_of(repo.db, target_hash))
+
+    def apply(self):
+        """Updates the worktree, then writes the index once."""
+        worktree = self.repo.worktree
+
+        # Deletions go first so a file can be replaced by a directory and vice versa
+        for path, _, target in self.changes:
+            if target is None:
+                worktree.remove_file(path)
+        self._write_files([(path, target) for path, _, target in self.changes if target is not None])
+
+        with self.repo.index.transaction() as index:
+            if self.target_entries is None:
+                for path, _, target in self.changes:
+                    if target is None:
+                        index.remove(path)
+                    else:
+                        index.add(path, target, worktree.stat_file(path))
+            else:
+                index.replace_all(self._target_index_entries(index))
+
+    # ----- UTILS -----
+    def _write_files(self, writes):
+        """
+        Writes (path, blob hash) pairs, in parallel when configured. Directories
+        are created once up front. If writes fail, the error of the first
+        failing path in order is raised, whatever order the threads ran in.
+        """
+        worktree = self.repo.worktree
+        worktree.make_parent_dirs(path for path, _ in writes)
+
+        def write(item):
+            path, hash = item
+            worktree.write_file(path, self.repo.db.read(hash), create_dirs=False)
+
+        workers = self._worker_count(len(writes))
+        if workers == 1:
+            for item in writes:
+                write(item)
+            return
+
+        # Load the pack list before the threads race to do it
+        self.repo.db.packs
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(write, item) for item in writes]
+        for future in futures:
+            future.result()
+
+    def _worker_count(self, write_count):
+        config = Config(self.repo)
+        threshold = config.get_int("checkout", "thresholdForParallelism", default=self.DEFAULT_PARALLEL_THRESHOLD)
+        if write_count < max(threshold, 2):
+            return 1
+        workers = config.get_int("checkout", "workers", default=self.DEFAULT_WORKERS)
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        return min(workers, write_count)
+
+    def _target_index_entries(self, index):
+        """Keeps the stat data of entries that already match, and stats the rest."""
+        written = {path for path, _, target in self.changes if target is not None}
+        entries = {}
+        for path, hash in self.target_entries.items():
+            current = index.get(path)
+            if path not in written and current is not None and current.hash == hash:
+                entries[path] = current
+            else:
+                entries[path] = IndexEntry.from_stat(path, hash, self.repo.worktree.stat_file(path))
+        return entries
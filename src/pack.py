@@ -0,0 +1,348 @@
+import os
+import mmap
+import bisect
+import hashlib
+import struct
+import zlib
+from .delta import Delta
+from .lru_cache import LRUCache
+
+class Pack:
+    """
+    Reads objects from a packfile through its index.
+
+    Both files are memory-mapped once, so looking up and inflating an object
+    costs no system calls. Recently rebuilt delta bases are kept in a small
+    cache, since neighbouring versions of a file usually share a chain.
+
+    Pack layout (integers big-endian):
+        header   signature "PACK", version, object count
+        objects  a type byte, the content size as a base-128 varint, the raw
+                 20-byte base hash for deltas, then the zlib-compressed
+                 content (or delta against the base)
+        trailer  SHA-1 of everything above
+
+    Index layout:
+        header   signature "PIDX", version, object count
+        fan-out  256 cumulative counts of hashes by first byte
+        hashes   the sorted raw 20-byte hashes
+        offsets  the 8-byte pack offset of each hash
+        trailer  the pack checksum, then SHA-1 of everything above
+    """
+
+    SIGNATURE = b'PACK'
+    INDEX_SIGNATURE = b'PIDX'
+    VERSION = 1
+    HEADER = struct.Struct('>4sII')
+    FANOUT = struct.Struct('>256I')
+    OFFSET = struct.Struct('>Q')
+
+    TYPE_COMMIT = 1
+    TYPE_TREE = 2
+    TYPE_BLOB = 3
+    TYPE_DELTA = 7
+    TYPE_CODES = {'commit': TYPE_COMMIT, 'tree': TYPE_TREE, 'blob': TYPE_BLOB}
+    TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+    READ_SIZE = 64 * 1024
+    DELTA_BASE_CACHE_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.pack_path = index_path[:-len('.idx')] + '.pack'
+        self.index_data = self._map(index_path)
+        self._pack_data = None
+        self.delta_base_cache = LRUCache(self.DELTA_BASE_CACHE_SIZE)
+
+        signature, version, self.count = self.HEADER.unpack_from(self.index_data)
+        if signature != self.INDEX_SIGNATURE or version != self.VERSION:
+            raise Exception(f"Unsupported pack index '{index_path}'")
+        self.fanout = self.FANOUT.unpack_from(self.index_data, self.HEADER.size)
+        self.hashes_start = self.HEADER.size + self.FANOUT.size
+        self.offsets_start = self.hashes_start + 20 * self.count
+
+    def __contains__(self, hash):
+        return self._find(hash) is not None
+
+    def hashes(self):
+        """Yields every object hash in the pack, in sorted order."""
+        table = HashTable(self.index_data, self.hashes_start, self.count)
+        for i in range(self.count):
+            yield table[i].hex()
+
+    @property
+    def pack_data(self):
+        """The memory-mapped pack file, mapped on first use."""
+        if self._pack_data is None:
+            self._pack_data = self._map(self.pack_path)
+        return self._pack_data
+
+    def read_object(self, hash):
+        """Returns (type, size, content), resolving delta chains. Raises FileNotFoundError if absent."""
+        chain = []
+        while True:
+            cached = self.delta_base_cache.get(hash)
+            if cached is not None:
+                type_code, data = cached
+                break
+
+            type_code, base_hash, data = self._read_entry(self._offset_of(hash))
+            if type_code != self.TYPE_DELTA:
+                break
+            chain.append((hash, data))
+            hash = base_hash
+
+        for i in range(len(chain) - 1, -1, -1):
+            self.delta_base_cache.put(hash, (type_code, data), len(data))
+            hash, delta = chain[i]
+            data = Delta.apply(data, delta)
+        return self.TYPE_NAMES[type_code], len(data), data
+
+    def read_header(self, hash):
+        """
+        Returns (type, size) without inflating the object. For deltas the size
+        comes from the delta header and the type from the end of the chain.
+        """
+        size = None
+        while True:
+            offset = self._offset_of(hash)
+            type_code, entry_size, base_hash, data_start = self._parse_entry_header(offset)
+            if type_code != self.TYPE_DELTA:
+                return self.TYPE_NAMES[type_code], size if size is not None else entry_size
+
+            if size is None:
+                delta_header = zlib.decompressobj().decompress(self.pack_data[data_start:data_start + self.READ_SIZE], 32)
+                _, pos = Delta.read_varint(delta_header, 0)
+                size, _ = Delta.read_varint(delta_header, pos)
+            hash = base_hash
+
+    def read_chunks(self, hash):
+        """
+        Yields the content of an object in chunks of at most READ_SIZE bytes,
+        inflating it from the mapping as it goes. Deltas have to be resolved
+        in memory, so they come back in one piece.
+        """
+        offset = self._offset_of(hash)
+        type_code, _, _, pos = self._parse_entry_header(offset)
+        if type_code == self.TYPE_DELTA:
+            yield self.read_object(hash)[2]
+            return
+
+        view = memoryview(self.pack_data)
+        try:
+            decompressor = zlib.decompressobj()
+            while not decompressor.eof:
+                data = decompressor.unconsumed_tail
+                if not data:
+                    data = view[pos:pos + self.READ_SIZE]
+                    if not data:
+                        raise Exception(f"Truncated pack '{self.pack_path}'")
+                    pos += len(data)
+                yield decompressor.decompress(data, self.READ_SIZE)
+        finally:
+            view.release()
+
+    def close(self):
+        self.index_data.close()
+        if self._pack_data is not None:
+            self._pack_data.close()
+
+    # ----- UTILS -----
+    def _find(self, hash):
+        """Returns the pack offset of a hash using the fan-out table and a binary search."""
+        raw = bytes.fromhex(hash)
+        lo = self.fanout[raw[0] - 1] if raw[0] else 0
+        hi = self.fanout[raw[0]]
+        table = HashTable(self.index_data, self.hashes_start, self.count)
+        i = bisect.bisect_left(table, raw, lo, hi)
+        if i < hi and table[i] == raw:
+            return self.OFFSET.unpack_from(self.index_data, self.offsets_start + 8 * i)[0]
+        return None
+
+    def _offset_of(self, hash):
+        offset = self._find(hash)
+        if offset is None:
+            raise FileNotFoundError(f"Object {hash} is not in pack '{self.pack_path}'")
+        return offset
+
+    def _parse_entry_header(self, offset):
+        """Returns (type code, size, base hash or None, offset of the compressed data)."""
+        data = self.pack_data
+        type_code = data[offset]
+        size, pos = Delta.read_varint(data, offset + 1)
+
+        base_hash = None
+        if type_code == self.TYPE_DELTA:
+            base_hash = data[pos:pos + 20].hex()
+            pos += 20
+        return type_code, size, base_hash, pos
+
+    def _read_entry(self, offset):
+        """Reads the entry at offset, returning (type code, base hash or None, inflated data)."""
+        type_code, size, base_hash, pos = self._parse_entry_header(offset)
+
+        # Feed zero-copy windows of the mapping until the zlib stream ends
+        view = memoryview(self.pack_data)
+        decompressor = zlib.decompressobj()
+        chunks = []
+        while not decompressor.eof:
+            window = view[pos:pos + self.READ_SIZE]
+            if not window:
+                raise Exception(f"Truncated pack '{self.pack_path}'")
+            chunks.append(decompressor.decompress(window))
+            pos += len(window)
+        view.release()
+        data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+        if len(data) != size:
+            raise Exception(f"Corrupt object at offset {offset} in '{self.pack_path}'")
+        return type_code, base_hash, data
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class PackWriter:
+    """
+    Writes a set of objects into a new pack, storing each one as a delta against
+    a similar object of the same type when that is much smaller.
+    Candidates are compared within a sliding window after sorting by type,
+    file name and size, so successive versions of the same file sit together.
+
+    Objects are read from the database only when their turn comes and the pack
+    is written to disk as it is built, so only the window is held in memory.
+    Objects of at least big_object_threshold bytes skip delta compression and
+    are streamed from the store in chunks.
+    """
+
+    WINDOW = 10
+    MAX_DEPTH = 50
+    MIN_DELTA_SIZE = 64
+
+    def __init__(self, pack_dir, big_object_threshold):
+        self.pack_dir = pack_dir
+        self.big_object_threshold = big_object_threshold
+
+    def write(self, objects, database):
+        """
+        Packs objects given as (hash, type, name hint) tuples, reading them from
+        the database. Returns (index path, number of objects stored as deltas).
+        """
+        os.makedirs(self.pack_dir, exist_ok=True)
+        sized = [(hash, type, name, database.read_header(hash)[1]) for hash, type, name in objects]
+        ordered = sorted(sized, key=lambda o: (o[1], os.path.basename(o[2] or ''), o[2] or '', -o[3]))
+
+        name = hashlib.sha1(''.join(sorted(o[0] for o in sized)).encode('ascii')).hexdigest()
+        base_path = os.path.join(self.pack_dir, f"pack-{name}")
+        temp_path = base_path + '.pack.tmp'
+
+        offsets = {}
+        depths = {}
+        window = []
+        delta_count = 0
+        checksum = hashlib.sha1()
+        with open(temp_path, 'wb') as f:
+            def emit(data):
+                f.write(data)
+                checksum.update(data)
+                return len(data)
+
+            position = emit(Pack.HEADER.pack(Pack.SIGNATURE, Pack.VERSION, len(ordered)))
+            for hash, type, _, size in ordered:
+                offsets[hash] = position
+                if size >= self.big_object_threshold:
+                    position += emit(self._entry_header(type, size))
+                    compressor = zlib.compressobj()
+                    for chunk in database.read_chunks(hash):
+                        position += emit(compressor.compress(chunk))
+                    position += emit(compressor.flush())
+                    depths[hash] = 0
+                    continue
+
+                content = database.read_object(hash)[2]
+                base_hash, delta = self._find_delta(window, depths, type, content)
+                if base_hash:
+                    position += emit(self._entry_header(type, len(delta), base_hash) + zlib.compress(delta))
+                    depths[hash] = depths[base_hash] + 1
+                    delta_count += 1
+                else:
+                    position += emit(self._entry_header(type, len(content)) + zlib.compress(content))
+                    depths[hash] = 0
+
+                window.append((hash, type, content))
+                if len(window) > self.WINDOW:
+                    window.pop(0)
+
+            pack_checksum = checksum.digest()
+            f.write(pack_checksum)
+        os.replace(temp_path, base_path + '.pack')
+        self._write_file(base_path + '.idx', self._build_index(offsets, pack_checksum))
+        return base_path + '.idx', delta_count
+
+    # ----- UTILS -----
+    def _find_delta(self, window, depths, type, content):
+        """Returns (base hash, delta) for the best base in the window, or (None, None)."""
+        best = (None, None)
+        if len(content) < self.MIN_DELTA_SIZE:
+            return best
+        for base_hash, base_type, base_content in window:
+            if base_type != type or depths[base_hash] >= self.MAX_DEPTH:
+                continue
+            if len(base_content) < len(content) // 2 or len(base_content) > len(content) * 2:
+                continue
+            delta = Delta.compute(base_content, content)
+            if len(delta) < len(content) // 2 and (best[1] is None or len(delta) < len(best[1])):
+                best = (base_hash, delta)
+        return best
+
+    @staticmethod
+    def _entry_header(type, size, base_hash=None):
+        header = bytearray([Pack.TYPE_DELTA if base_hash else Pack.TYPE_CODES[type]])
+        Delta.write_varint(header, size)
+        if base_hash:
+            header += bytes.fromhex(base_hash)
+        return bytes(header)
+
+    def _build_index(self, offsets, pack_checksum):
+        hashes = sorted(offsets)
+        counts = [0] * 256
+        for hash in hashes:
+            counts[int(hash[:2], 16)] += 1
+        fanout = []
+        total = 0
+        for count in counts:
+            total += count
+            fanout.append(total)
+
+        body = bytearray(Pack.HEADER.pack(Pack.INDEX_SIGNATURE, Pack.VERSION, len(hashes)))
+        body += Pack.FANOUT.pack(*fanout)
+        for hash in hashes:
+            body += bytes.fromhex(hash)
+        for hash in hashes:
+            body += Pack.OFFSET.pack(offsets[hash])
+        body += pack_checksum
+        body += hashlib.sha1(body).digest()
+        return bytes(body)
+
+    @staticmethod
+    def _write_file(path, data):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+class HashTable:
+    """Sequence view over the sorted raw hashes of a pack index, for bisect."""
+
+    def __init__(self, data, start, count):
+        self.data = data
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.start + 20 * i
+        return self.data[start:start + 20]
@@ -0,0 +1,74 @@
+import os
+import bisect
+
+class PackedRefs:
+    """
+    The packed-refs file: a "hash refs/heads/<branch>" line per ref, sorted by
+    name. Listing refs reads this one file instead of one file per branch, and
+    a single ref is found by binary search. A loose ref file overrides the
+    packed value of the same ref, so updates keep writing loose files and
+    `bit pack-refs` folds them back in.
+
+    The file is parsed once and only read again when its stat changes.
+    """
+
+    FILE_NAME = 'packed-refs'
+    HEADER = '# pack-refs with: sorted\n'
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.hashes = []
+        self.stat_key = None
+
+    def get(self, name):
+        """Returns the packed hash of a ref like 'refs/heads/master', or None."""
+        self._reload_if_changed()
+        i = bisect.bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return self.hashes[i]
+        return None
+
+    def items(self, prefix=''):
+        """Returns [(name, hash)] for the packed refs starting with prefix, sorted by name."""
+        self._reload_if_changed()
+        start = bisect.bisect_left(self.names, prefix)
+        items = []
+        for i in range(start, len(self.names)):
+            if not self.names[i].startswith(prefix):
+                break
+            items.append((self.names[i], self.hashes[i]))
+        return items
+
+    def write(self, refs):
+        """Replaces the file with {name: hash}, written to a temp file and renamed into place."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.HEADER)
+            for name in sorted(refs):
+                f.write(f"{refs[name]} {name}\n")
+        os.replace(temp_path, self.path)
+        self.stat_key = None
+
+    # ----- UTILS -----
+    def _reload_if_changed(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.names, self.hashes, self.stat_key = [], [], None
+            return
+        stat_key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if stat_key == self.stat_key:
+            return
+
+        refs = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                hash, name = line.rstrip('\n').split(' ', 1)
+                refs.append((name, hash))
+        refs.sort() # Tolerate a hand-edited file
+        self.names = [name for name, _ in refs]
+        self.hashes = [hash for _, hash in refs]
+        self.stat_key = stat_key
@@ -1,19 +1,25 @@
 import os
 
 class Ref:
-    """Represents a ref."""
+    """Represents a ref, stored in its own loose file or in packed-refs."""
     
+    HEADS_PREFIX = 'refs/heads/'
+
     def __init__(self, repo, path):
         self.repo = repo
         self.path = path
         self.name = path.split('/')[-1]
+        self.full_name = os.path.relpath(path, repo.bit_dir).replace(os.sep, '/')
         
     def read_hash(self):
-        """Reads the hash from the ref file, returning None if it doesn't exist."""
+        """Reads the hash from the loose ref file or else packed-refs, returning None if it doesn't exist."""
         if os.path.exists(self.path):
           with open(self.path, 'r') as f:
             return f.read().strip()
-        return None
+        return self.repo.packed_refs.get(self.full_name)
+
+    def exists(self):
+        return os.path.exists(self.path) or self.repo.packed_refs.get(self.full_name) is not None
 
     def update(self, new_hash):
         """Updates the ref file with a new hash."""
@@ -40,19 +46,19 @@ class Ref:
     
     @classmethod
     def from_branch(cls, repo, branch):
-        path = os.path.join(repo.bit_dir, 'refs', 'heads', branch)
+        ref = Ref(repo, os.path.join(repo.bit_dir, 'refs', 'heads', branch))
         
-        if not os.path.exists(path):
+        if not ref.exists():
             raise FileNotFoundError(f"Could not find ref for branch '{branch}'")
                 
-        return Ref(repo, path)
+        return ref
     
     @classmethod
     def new_branch(cls, repo, branch, hash):
         """Create a new ref in refs/heads for the given branch and returns a Ref."""
         path = os.path.join(repo.bit_dir, 'refs', 'heads', branch)
         
-        if (os.path.exists(path)):
+        if Ref(repo, path).exists():
             raise FileExistsError("Branch already exists")
         
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -61,29 +67,44 @@ class Ref:
         
         return Ref(repo, path)
             
-    @staticmethod
-    def list_all(repo):
-        refs_dir = os.path.join(repo.bit_dir, 'refs', 'heads')
-        refs = []
-        
-        if os.path.isdir(refs_dir):
-          for dir in os.listdir(refs_dir):
-              refs.append(dir)
-        else:
-            raise FileNotFoundError
-        
-        return refs
+    @classmethod
+    def list_all(cls, repo):
+        return list(cls.load_all_as_dict(repo))
 
     @classmethod
     def load_all_as_dict(cls, repo):
+        """Returns {branch: hash} sorted by branch, loose refs overriding packed ones."""
         refs_dir = os.path.join(repo.bit_dir, 'refs', 'heads')
-        refs = {}
-        
-        if os.path.isdir(refs_dir):
-          for dir in os.listdir(refs_dir):
-              ref = Ref(repo, os.path.join(refs_dir, dir))
-              refs[dir] = ref.read_hash()
-        else:
+        if not os.path.isdir(refs_dir):
             raise FileNotFoundError
-        
-        return refs
\ No newline at end of file
+
+        refs = {name[len(cls.HEADS_PREFIX):]: hash for name, hash in repo.packed_refs.items(cls.HEADS_PREFIX)}
+        for dir in os.listdir(refs_dir):
+            ref = Ref(repo, os.path.join(refs_dir, dir))
+            refs[dir] = ref.read_hash()
+        return dict(sorted(refs.items()))
+
+    @classmethod
+    def load_by_hash(cls, repo):
+        """Returns {hash: [branch, ...]}, the reverse of load_all_as_dict, for decorating commits."""
+        branches_by_hash = {}
+        for branch, hash in cls.load_all_as_dict(repo).items():
+            branches_by_hash.setdefault(hash, []).append(branch)
+        return branches_by_hash
+
+    @classmethod
+    def pack_all(cls, repo, prune=True):
+        """
+        Writes every branch into packed-refs and, with prune, removes the loose
+        files that were packed. Returns the number of refs packed.
+        """
+        refs = cls.load_all_as_dict(repo)
+        repo.packed_refs.write({cls.HEADS_PREFIX + branch: hash for branch, hash in refs.items()})
+        if prune:
+            refs_dir = os.path.join(repo.bit_dir, 'refs', 'heads')
+            for branch, hash in refs.items():
+                path = os.path.join(refs_dir, branch)
+                # Keep a loose ref that moved since it was read
+                if os.path.exists(path) and Ref(repo, path).read_hash() == hash:
+                    os.remove(path)
+        return len(refs)
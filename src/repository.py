@@ -1,25 +1,42 @@
 import os
+import itertools
 from .config import Config
 from .database import Database
 from .index import Index
+from .untracked_cache import UntrackedCache
+from .fsmonitor import FSMonitor
+from .fsmonitor_state import FSMonitorState
 from .commit import Commit
 from .ref import Ref
+from .packed_refs import PackedRefs
 from .tree import Tree
 from .worktree import Worktree
+from .hash_pipeline import HashPipeline
 from .status import Status
 from .log import Log
+from .rev_walk import RevWalk
 from .diff_calculator import DiffCalculator
 from .merge import Merge
+from .migration import Migration
 from .stash import Stash
 
 class Repository:
     """Represents a Bit repository."""
     
     def __init__(self, worktree_path):
-        self.worktree = Worktree(worktree_path)
         self.bit_dir = os.path.join(worktree_path, '.bit')
-        self.db = Database(os.path.join(self.bit_dir, 'objects'))
+        config = Config(self)
+        hash_workers = config.get_int("core", "hashWorkers", default=HashPipeline.DEFAULT_WORKERS)
+        self.worktree = Worktree(worktree_path, hash_workers=hash_workers)
+        cache_size = config.get_int("core", "objectCacheSize", default=Database.DEFAULT_CACHE_SIZE)
+        self.big_file_threshold = config.get_int("core", "bigFileThreshold", default=Database.DEFAULT_BIG_FILE_THRESHOLD)
+        self.use_untracked_cache = config.get_bool("core", "untrackedCache", default=False)
+        self.use_fsmonitor = config.get_bool("core", "fsmonitor", default=False)
+        self.fsmonitor_socket = os.path.join(self.bit_dir, FSMonitor.SOCKET_NAME)
+        fsync = config.get_bool("core", "fsyncObjectFiles", default=True)
+        self.db = Database(os.path.join(self.bit_dir, 'objects'), cache_size=cache_size, fsync=fsync)
         self.index = Index(os.path.join(self.bit_dir, 'index'))
+        self.packed_refs = PackedRefs(os.path.join(self.bit_dir, PackedRefs.FILE_NAME))
 
     def init(self):
         """Initialize a new repository. Raises FileExistsError if it already exists."""
@@ -37,12 +54,9 @@ class Repository:
 
         normalized_path = self.worktree.normalize_path(path)
         
-        current_entries = self.index.load_as_dict()
-        
-        if normalized_path not in current_entries:
-             raise FileNotFoundError()
-        
-        self.index.remove(normalized_path)
+        with self.index.transaction() as index:
+            if not index.remove(normalized_path):
+                raise FileNotFoundError()
         
         self.worktree.remove_file(path)
 
@@ -51,31 +65,7 @@ class Repository:
         Add one or more files to the index, creating a full snapshot.
         Returns the number of files actually staged (changed).
         """
-        current_entries = self.index.load_as_dict()
-        
-        staged_count = 0
-        for path in paths:
-            full_path = os.path.join(self.worktree.path, path)
-            normalized_path = self.worktree.normalize_path(path)
-            
-            if not os.path.exists(full_path):
-                self.index.remove(normalized_path)
-                if normalized_path in current_entries:
-                  del current_entries[normalized_path]
-                  staged_count += 1
-                else:
-                    raise FileNotFoundError(f"Could not find file '{normalized_path}'")
-            else:
-              content = self.worktree.read_file(normalized_path)
-              file_hash = self.db.store(content)
-              
-              if current_entries.get(normalized_path) != file_hash:
-                  staged_count += 1
-              
-              current_entries[normalized_path] = file_hash
-
-        self.index.write(current_entries)
-        return staged_count
+        return self._add_paths(paths)
 
     def add_all(self):
         """
@@ -83,12 +73,19 @@ class Repository:
         Stages new files, modifications, and deletions.
         """
         
-        worktree_paths = set(self.worktree.list_files())
-        index_paths = set(self.index.load_as_dict().keys())
+        index_entries = self.index.load_entries()
+        untracked_cache = self._load_untracked_cache()
+        fsmonitor = self.query_fsmonitor()
+        changed = fsmonitor[1] if fsmonitor else None
+        worktree_paths = set(self.worktree.list_files(untracked_cache, index_entries, changed))
+        if changed is None:
+            index_paths = set(index_entries.keys())
+        else:
+            index_paths = {path for path in index_entries if self.worktree.is_reported(path, changed)}
         
         all_paths_to_check = list(worktree_paths | index_paths)
         
-        return self.add(all_paths_to_check)
+        return self._add_paths(all_paths_to_check, untracked_cache)
 
     def commit(self, message):
       status = self.status()
@@ -116,8 +113,9 @@ class Repository:
       email = config.get("user", "email", default="unknown@example.com")
       
       commit = Commit(root_tree.hash, parent_hashes, message, author=name, email=email)
-      commit_hash = self.db.store(commit.serialize())
+      commit_hash = self.db.store(commit.serialize(), 'commit')
       head_ref.update(commit_hash)
+      self.db.write_commit_graph([commit_hash])
       
       if is_merging:
           os.remove(merge_head_path)
@@ -130,26 +128,32 @@ class Repository:
         
         
         last_commit_hash = Ref.from_symbol(self, 'HEAD').read_hash()
-        head_entries = Tree.get_entries_from_commit(self.db, last_commit_hash)
-        worktree_entries = self.worktree.list_and_hash_files()
-        index_entries = self.index.load_as_dict()
-        
-        all_paths = set(head_entries.keys()) | set(index_entries.keys()) | set(worktree_entries.keys())
+        head_tree_hash = Commit.tree_hash_of(self.db, last_commit_hash)
+        entries, cache_tree = self.index.load()
+        index_entries = {path: entry.hash for path, entry in entries.items()}
+        staged_changes = Tree.diff_index(self.db, head_tree_hash, index_entries, cache_tree)
+        refreshed = {}
+        untracked_cache = self._load_untracked_cache()
+        fsmonitor = self.query_fsmonitor()
+        changed = fsmonitor[1] if fsmonitor else None
+        worktree_entries = self.worktree.list_and_hash_files(self.index, refreshed, untracked_cache, changed)
+        
+        # --- Compare Index to HEAD (Staged Changes) ---
+        for path in sorted(staged_changes):
+            in_head, in_index = staged_changes[path]
+            if not in_index:
+                status.staged[path] = 'deleted'
+            elif not in_head:
+                status.staged[path] = 'new file'
+            else:
+                status.staged[path] = 'modified'
+
+        all_paths = set(index_entries.keys()) | set(worktree_entries.keys())
         
         for path in sorted(all_paths):
-            in_head = head_entries.get(path)
             in_index = index_entries.get(path)
             in_worktree = worktree_entries.get(path)
 
-            # --- Compare Index to HEAD (Staged Changes) ---
-            if in_index and in_index != in_head:
-                if not in_head:
-                    status.staged[path] = 'new file'
-                else:
-                    status.staged[path] = 'modified'
-            elif not in_index and in_head:
-                status.staged[path] = 'deleted'
-
             # --- Compare Worktree to Index (Unstaged Changes) ---
             if in_index and in_worktree and in_index != in_worktree:
                 status.unstaged[path] = 'modified'
@@ -157,32 +161,46 @@ class Repository:
                 status.unstaged[path] = 'deleted'
             
             # --- Untracked Files ---
-            if not in_index and not in_head and in_worktree:
+            # A path missing from the index is only in HEAD if it was staged for deletion
+            if not in_index and in_worktree and path not in staged_changes:
                 status.untracked.append(path)
+
+        # Save the token with every path that doesn't match the index, so the
+        # next status only has to look at those and whatever changes after it
+        fsmonitor_state = None
+        if fsmonitor is not None:
+            fsmonitor_state = FSMonitorState(fsmonitor[0], (path for path in all_paths if index_entries.get(path) != worktree_entries.get(path)))
+
+        if refreshed or (untracked_cache is not None and untracked_cache.dirty) or fsmonitor_state is not None:
+            self._refresh_index(refreshed, untracked_cache, fsmonitor_state)
                 
         return status
     
-    def log(self):
-        """Return linear commit history following the first-parent chain."""
-        logs = []
-        all_refs = Ref.load_all_as_dict(self)
+    def log(self, max_count=None, skip=0, all=False, topo_order=False, paths=None):
+        """
+        Yields the history of HEAD (or of every branch too, with `all`) as Log
+        entries through every parent, newest first, leaving out the first
+        `skip` commits and stopping after `max_count`. With `topo_order` no
+        commit comes before its children, and with `paths` only commits that
+        changed one of them are listed. The history is walked as the entries
+        are consumed, so reading only the first few doesn't walk the rest.
+        """
+        branches_by_hash = Ref.load_by_hash(self)
         head_ref = Ref.from_symbol(self, 'HEAD')
-        commit_hash = head_ref.read_hash()
-        
-        while commit_hash:
-            commit_bytes = self.db.read(commit_hash)
-            commit = Commit.parse(commit_bytes)
+        tips = [head_ref.read_hash()]
+        if all:
+            tips.extend(branches_by_hash)
 
-            refs = [branch for branch, h in all_refs.items() if h == commit_hash]
+        if paths:
+            paths = [self.worktree.normalize_path(path) for path in paths]
+            if '.' in paths:
+                paths = None
 
-            logs.append(Log(commit_hash, commit, head_ref, refs))
-
-            if commit.parent_hashes:
-                commit_hash = commit.parent_hashes[0]
-            else:
-                commit_hash = None
-        
-        return logs
+        # Parents come from the commit-graph; commits are only parsed when formatted
+        walk = iter(RevWalk(self.db, tips, topo_order=topo_order, paths=paths))
+        stop = None if max_count is None else skip + max_count
+        for commit_hash in itertools.islice(walk, skip, stop):
+            yield Log(commit_hash, self.db, head_ref, branches_by_hash.get(commit_hash, []))
 
     def branch(self, branch):
         if '/' in branch:
@@ -213,19 +231,13 @@ class Repository:
         
         with open(os.path.join(self.bit_dir, "HEAD"), "w") as f:
             f.write(f"ref: refs/heads/{branch}\n")
-            
-        current_entries = Tree.get_entries_from_commit(self.db, current_head.read_hash())
-        target_entries = Tree.get_entries_from_commit(self.db, target_head.read_hash())
-        
-        for path, hash in target_entries.items():
-            content = self.db.read(hash)
-            self.worktree.write_file(path, content)
-        
-        for path, hash in current_entries.items():
-            if path not in target_entries:
-                self.worktree.remove_file(path)
         
-        self.index.write(target_entries)
+        # A forced checkout can't trust the worktree to match the current commit
+        if force:
+            migration = Migration.from_worktree(self, target_head.read_hash())
+        else:
+            migration = Migration.between_commits(self, current_head.read_hash(), target_head.read_hash())
+        migration.apply()
         
     def diff(self):
         return DiffCalculator.calculate_index_vs_worktree(self)
@@ -268,35 +280,24 @@ class Repository:
         if mode == "--soft":
             return
 
-        target_entries = Tree.get_entries_from_commit(self.db, target_hash)
-        self.index.write(target_entries)
-
         if mode == "--mixed":
+            with self.index.transaction() as index:
+                index.replace_all(Tree.get_entries_from_commit(self.db, target_hash))
             return
 
-        current_files = self.worktree.list_files()
-        
-        for path, hash_val in target_entries.items():
-            content = self.db.read(hash_val)
-            self.worktree.write_file(path, content)
-        
-        for path in current_files:
-            if path not in target_entries:
-                self.worktree.remove_file(path)
+        Migration.from_worktree(self, target_hash, remove_untracked=True).apply()
       
     def restore(self, targets, staged=False):
         if staged:
             head_hash = Ref.from_symbol(self, "HEAD").read_hash()
             head_entries = Tree.get_entries_from_commit(self.db, head_hash)
-            index_entries = self.index.load_as_dict()
-            for target in targets:
-                original = head_entries.get(target)
-                if original:    
-                    index_entries[target] = original
-                else:
-                    del index_entries[target]
-            
-            self.index.write(index_entries)
+            with self.index.transaction() as index:
+                for target in targets:
+                    original = head_entries.get(target)
+                    if original:
+                        index.add(target, original)
+                    elif not index.remove(target):
+                        raise FileNotFoundError(f"Could not find file '{target}'")
             
         else:
             target_entries = self.index.load_as_dict()
@@ -306,6 +307,25 @@ class Repository:
                     raise FileNotFoundError(f"Could not find file '{target}'")
                 self.worktree.write_file(target, self.db.read(original))
         
+    def gc(self):
+        """
+        Packs every object, loose or already packed, into a single pack,
+        rewrites the commit-graph with exactly the reachable commits, and packs
+        the refs.
+        """
+        self.pack_refs()
+        result = self.db.repack(self._object_names(), all=True, big_object_threshold=self.big_file_threshold)
+        self.db.write_commit_graph(self._ref_tips(), keep_existing=False)
+        return result
+
+    def pack_refs(self, prune=True):
+        """Moves the branches into packed-refs (see Ref.pack_all). Returns the number of refs packed."""
+        return Ref.pack_all(self, prune)
+
+    def repack(self):
+        """Moves the loose objects into a new pack."""
+        return self.db.repack(self._object_names(), big_object_threshold=self.big_file_threshold)
+
     def stash_push(self, message=None):
         return Stash(self).push(message)
 
@@ -315,6 +335,140 @@ class Repository:
     def stash_list(self):
         return Stash(self).list_all()
     
+    def fsmonitor_daemon(self, force_polling=False):
+        """Returns an FSMonitor watching this worktree, listening on the repository's socket."""
+        return FSMonitor(self.worktree.path, self.bit_dir, force_polling=force_polling)
+
+    def stop_fsmonitor(self):
+        """Stops the fsmonitor daemon. Returns False if none was running."""
+        return FSMonitor.request_stop(self.fsmonitor_socket)
+
     # ----- UTILS -----
     def current_branch(self):
-        return Ref.from_symbol(self, "HEAD").name
\ No newline at end of file
+        return Ref.from_symbol(self, "HEAD").name
+
+    def query_fsmonitor(self):
+        """
+        Asks the fsmonitor daemon what changed since the token saved in the
+        index. Returns (new token, paths to check): the reported paths plus the
+        ones that didn't match the index last time, or None when every path has
+        to be checked (no saved token, lost events or a changed .bitignore).
+        Returns None when core.fsmonitor is off or no daemon answers.
+        """
+        if not self.use_fsmonitor:
+            return None
+        state = self.index.load_fsmonitor_state()
+        response = FSMonitor.query(self.fsmonitor_socket, state.token if state else None)
+        if response is None:
+            return None
+        token, changed = response
+        if state is None or changed is None or '.bitignore' in changed:
+            return token, None
+        return token, state.paths.union(changed)
+
+    def _object_names(self):
+        """
+        Maps every blob and tree reachable from a branch or the stash to a path
+        it appears at, so packing can delta successive versions of a file.
+        """
+        names = {}
+        seen = set()
+        commit_hashes = self._ref_tips()
+        trees = []
+
+        while commit_hashes:
+            commit_hash = commit_hashes.pop()
+            if not commit_hash or commit_hash in seen:
+                continue
+            seen.add(commit_hash)
+            commit_hashes.extend(Commit.parents_of(self.db, commit_hash))
+            trees.append((Commit.tree_hash_of(self.db, commit_hash), ""))
+
+        while trees:
+            tree_hash, path = trees.pop()
+            if tree_hash in seen:
+                continue
+            seen.add(tree_hash)
+            names.setdefault(tree_hash, path)
+            for type, hash_val, name in Tree.read_entries(self.db, tree_hash):
+                entry_path = f"{path}/{name}" if path else name
+                if type == 'tree':
+                    trees.append((hash_val, entry_path))
+                else:
+                    names.setdefault(hash_val, entry_path)
+        return names
+
+    def _ref_tips(self):
+        """Returns the commits that branches and the stash point at."""
+        tips = list(Ref.load_all_as_dict(self).values())
+        stash_hash = Ref(self, os.path.join(self.bit_dir, 'refs', 'stash')).read_hash()
+        if stash_hash:
+            tips.append(stash_hash)
+        return tips
+
+    def _store_file(self, path, st):
+        """Stores a worktree file, streaming it if it is at least core.bigFileThreshold bytes."""
+        if st is not None and st.st_size >= self.big_file_threshold:
+            with self.worktree.open_file(path) as f:
+                return self.db.store_stream(f)
+        return self.db.store(self.worktree.read_file(path))
+
+    def _add_paths(self, paths, untracked_cache=None):
+        """Stages paths in one index transaction, saving the untracked cache of the walk that found them."""
+        staged_count = 0
+        with self.index.transaction() as index:
+            # Set first, so unstaging below invalidates the walk's cache
+            if untracked_cache is not None and untracked_cache.dirty:
+                index.set_untracked_cache(untracked_cache)
+            to_store = {}
+            for path in paths:
+                full_path = os.path.join(self.worktree.path, path)
+                normalized_path = self.worktree.normalize_path(path)
+                
+                if not os.path.exists(full_path):
+                    if index.remove(normalized_path):
+                        staged_count += 1
+                    else:
+                        raise FileNotFoundError(f"Could not find file '{normalized_path}'")
+                else:
+                    st = self.worktree.stat_file(normalized_path)
+                    entry = index.get(normalized_path)
+                    if entry and self.index.is_stat_clean(entry, st):
+                        continue
+                    to_store[normalized_path] = (entry, st)
+            
+            # Files are read and stored on the hash pipeline; results come back in order.
+            # The batch publishes the objects before the index is written.
+            with self.db.batch():
+                stored = self.worktree.hash_pipeline.map(lambda path: self._store_file(path, to_store[path][1]), to_store)
+                for normalized_path, file_hash in stored:
+                    entry, st = to_store[normalized_path]
+                    if not entry or entry.hash != file_hash:
+                        staged_count += 1
+                    
+                    index.add(normalized_path, file_hash, st)
+
+        return staged_count
+
+    def _load_untracked_cache(self):
+        """Returns the index's untracked cache (a new one if it has none), or None when core.untrackedCache is off."""
+        if not self.use_untracked_cache:
+            return None
+        return self.index.load_untracked_cache() or UntrackedCache()
+
+    def _refresh_index(self, refreshed, untracked_cache=None, fsmonitor_state=None):
+        """
+        Stores fresh stat data for files whose content was verified to match the
+        index, the untracked cache a worktree walk updated and the fsmonitor state.
+        """
+        try:
+            transaction = self.index.transaction()
+        except FileExistsError:
+            return # Another process is writing the index; the refresh only saves work next time
+        with transaction as index:
+            for entry in refreshed.values():
+                index.refresh(entry)
+            if untracked_cache is not None and untracked_cache.dirty:
+                index.set_untracked_cache(untracked_cache)
+            if fsmonitor_state is not None:
+                index.set_fsmonitor_state(fsmonitor_state)
\ No newline at end of file
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+from .commit import Commit
+from .tree import Tree
+
+class RevWalk:
+    """
+    Walks the history of one or more commits through every parent, yielding
+    each reachable commit hash once. Nothing is recursive: the walk is driven
+    by priority queues plus a visited set, and it only goes as deep as the
+    caller reads.
+
+    Date order (the default) always yields the newest queued commit next.
+    Topological order also never shows a commit before all of its children.
+    It is worked out incrementally: a commit can only be a child of commits
+    with a higher generation number, so before a commit is shown, only the
+    commits above its generation need to have been explored to know all of
+    its children. Commits missing from the commit-graph rank above every
+    graph commit (see Commit.rank_of).
+
+    Given paths, only the commits that changed one of them are yielded: those
+    that differ from each of their parents there, or add them in a root
+    commit. The commit-graph's changed-path Bloom filters rule out most
+    commits without reading a tree; only the rest get a real lookup.
+    """
+
+    def __init__(self, database, tips, topo_order=False, paths=None):
+        self.database = database
+        self.tips = list(dict.fromkeys(tip for tip in tips if tip))
+        self.topo_order = topo_order
+        self.paths = paths
+
+    def __iter__(self):
+        walk = self._walk_topo() if self.topo_order else self._walk_date()
+        if self.paths:
+            return (commit_hash for commit_hash in walk if self.changes_paths(commit_hash))
+        return walk
+
+    def changes_paths(self, commit_hash):
+        """Checks if a commit changed any of the paths, consulting its Bloom filter first."""
+        graph = self.database.commit_graph
+        position = graph.position(commit_hash) if graph is not None else None
+        bloom = graph.bloom_filter_at(position) if position is not None else None
+        if bloom is not None and not any(bloom.might_contain(path) for path in self.paths):
+            return False
+
+        tree_hash = Commit.tree_hash_of(self.database, commit_hash)
+        entries = [Tree.entry_at(self.database, tree_hash, path) for path in self.paths]
+        parents = Commit.parents_of(self.database, commit_hash)
+        if not parents:
+            return any(entry is not None for entry in entries)
+        for parent in parents:
+            parent_tree_hash = Commit.tree_hash_of(self.database, parent)
+            if entries == [Tree.entry_at(self.database, parent_tree_hash, path) for path in self.paths]:
+                return False
+        return True
+
+    # ----- UTILS -----
+    def _walk_date(self):
+        # Ties on commit time go to the commit queued first, so a parent never
+        # comes out ahead of the same-second child that queued it
+        queue = []
+        seen = set(self.tips)
+        order = itertools.count()
+        for tip in self.tips:
+            heapq.heappush(queue, (-Commit.rank_of(self.database, tip)[1], next(order), tip))
+        while queue:
+            _, _, commit_hash = heapq.heappop(queue)
+            yield commit_hash
+            for parent in Commit.parents_of(self.database, commit_hash):
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(queue, (-Commit.rank_of(self.database, parent)[1], next(order), parent))
+
+    def _walk_topo(self):
+        # Explored commits have had their edges counted into their parents' in-degree
+        explore_queue = []
+        seen = set(self.tips)
+        indegree = {}
+        ranks = {}
+        for tip in self.tips:
+            ranks[tip] = Commit.rank_of(self.database, tip)
+            heapq.heappush(explore_queue, (-ranks[tip][0], tip))
+
+        def explore_down_to(generation):
+            while explore_queue and -explore_queue[0][0] >= generation:
+                _, commit_hash = heapq.heappop(explore_queue)
+                for parent in Commit.parents_of(self.database, commit_hash):
+                    indegree[parent] = indegree.get(parent, 0) + 1
+                    if parent not in seen:
+                        seen.add(parent)
+                        ranks[parent] = Commit.rank_of(self.database, parent)
+                        heapq.heappush(explore_queue, (-ranks[parent][0], parent))
+
+        # Commits with no known children left to show, newest first
+        ready = [(-ranks[tip][1], tip) for tip in self.tips]
+        heapq.heapify(ready)
+        queued = set(self.tips)
+        while ready:
+            _, commit_hash = ready[0]
+            explore_down_to(ranks[commit_hash][0])
+            heapq.heappop(ready)
+            queued.discard(commit_hash)
+            if indegree.get(commit_hash, 0):
+                continue # A child turned up; the last child shown queues it again
+
+            yield commit_hash
+            for parent in Commit.parents_of(self.database, commit_hash):
+                indegree[parent] -= 1
+                if not indegree[parent] and parent not in queued:
+                    heapq.heappush(ready, (-ranks[parent][1], parent))
+                    queued.add(parent)
@@ -3,6 +3,7 @@ from .ref import Ref
 from .commit import Commit
 from .tree import Tree
 from .merge import Merge
+from .migration import Migration
 from exceptions.merge_conflict import MergeConflict
 
 class Stash:
@@ -19,11 +20,13 @@ class Stash:
         if status.is_clean():
             raise Exception("No local changes to save")
 
-        original_index = self.repo.index.load_as_dict()
+        head_hash = Ref.from_symbol(self.repo, 'HEAD').read_hash()
+        if not head_hash:
+            raise Exception("You do not have the initial commit yet")
+
         self.repo.add_all()
         worktree_tree = Tree.build_from_index(self.repo.index, self.repo.db)
         
-        head_hash = Ref.from_symbol(self.repo, 'HEAD').read_hash()
         prev_stash = self.stash_ref.read_hash()
         
         parent_hashes = [head_hash]
@@ -32,12 +35,12 @@ class Stash:
             
         msg = message if message else f"WIP on {self.repo.current_branch()}"
         stash_commit = Commit(worktree_tree.hash, parent_hashes, msg)
-        stash_hash = self.repo.db.store(stash_commit.serialize())
+        stash_hash = self.repo.db.store(stash_commit.serialize(), 'commit')
         
         self.stash_ref.update(stash_hash)
         
-        self.repo.index.write(original_index)
-        self.repo.reset(head_hash, mode="--hard")
+        # The index now matches the stashed tree, so only the stashed paths are reverted
+        Migration.between_trees(self.repo, worktree_tree.hash, Commit.tree_hash_of(self.repo.db, head_hash)).apply()
         
         return stash_hash
 
@@ -53,7 +56,7 @@ class Stash:
         if not status.is_clean():
             raise Exception(f"Please stash or commit your current changes before popping the stash.")
             
-        stash_commit = Commit.parse(self.repo.db.read(stash_hash))
+        stash_commit = Commit.load(self.repo.db, stash_hash)
         head_ref = Ref.from_symbol(self.repo, "HEAD")
         other_ref = Ref(self.repo, self.stash_ref_path)
         merge_engine = Merge(self.repo, head_ref, other_ref)
@@ -87,7 +90,7 @@ class Stash:
         
         index = 0
         while curr_hash:
-            commit = Commit.parse(self.repo.db.read(curr_hash))
+            commit = Commit.load(self.repo.db, curr_hash)
             stashes.append({
                 "index": index,
                 "hash": curr_hash,
@@ -1,7 +1,9 @@
-import os
 from .commit import Commit
 
 class Tree:
+    # Rough memory cost of one {path: hash} entry beyond the path itself
+    FLAT_ENTRY_OVERHEAD = 150
+
     def __init__(self, entries):
         self.entries = entries
         self.hash = None
@@ -15,23 +17,40 @@ class Tree:
 
     @classmethod
     def build_from_index(cls, index, database):
-        index_entries_dict = index.load_as_dict()
-        file_structure = cls._build_file_structure(index_entries_dict)
-        return cls._build_tree_recursive(file_structure, database)
+        """
+        Writes the tree objects for the index and returns the root Tree.
+        Directories with a valid hash in the index's cache tree are reused
+        as-is, so only the trees above changed paths get serialized and stored.
+        The new trees are written as one batch, before the refreshed cache tree
+        is saved back into the index.
+        """
+        with index.transaction() as transaction:
+            file_structure = cls._build_file_structure(transaction.as_dict())
+            with database.batch():
+                root_tree = cls._build_tree_recursive(file_structure, database, transaction.cache_tree, "")
+        return root_tree
     
     @classmethod
-    def _build_tree_recursive(cls, tree_data, database):
+    def _build_tree_recursive(cls, tree_data, database, cache_tree, directory):
+        cached_hash = cache_tree.get(directory)
+        if cached_hash:
+            tree = Tree(None)
+            tree.hash = cached_hash
+            return tree
+        
         entries = []
         for name, data in tree_data.items():
             if 'type' in data and data['type'] == 'blob':
                 entries.append({'type': 'blob', 'hash': data['hash'], 'name': name})
             else:
-                subtree = cls._build_tree_recursive(data, database)
+                subdirectory = f"{directory}/{name}" if directory else name
+                subtree = cls._build_tree_recursive(data, database, cache_tree, subdirectory)
                 entries.append({'type': 'tree', 'hash': subtree.hash, 'name': name})
         
         tree = Tree(entries)
         tree_content = tree.serialize()
-        tree.hash = database.store(tree_content)
+        tree.hash = database.store(tree_content, 'tree')
+        cache_tree.set(directory, tree.hash)
         return tree
 
     @staticmethod
@@ -51,32 +70,197 @@ class Tree:
 
     @classmethod
     def get_entries_from_commit(cls, database, commit_hash):
-        """Reads a commit and starts walking the commit tree."""
+        """Reads a commit and returns a flat dict of {path: hash} for its tree."""
         if commit_hash is None:
             return {}
             
-        commit_data_bytes = database.read(commit_hash)
-        commit = Commit.parse(commit_data_bytes)
-        root_tree_hash = commit.tree_hash
-        
-        return cls._walk_tree(database, root_tree_hash, "")
+        commit = Commit.load(database, commit_hash)
+        return dict(cls._walk_tree(database, commit.tree_hash))
 
     @classmethod
-    def _walk_tree(cls, database, tree_hash, current_path):
-        """Recursively walks tree objects to build a flat dict of {path: hash}."""
-        entries = {}
-        tree_content_bytes = database.read(tree_hash)
-        tree_content = tree_content_bytes.decode('utf-8')
+    def diff_trees(cls, database, old_hash, new_hash, prefix=""):
+        """
+        Yields (path, old blob hash, new blob hash) for every file that differs
+        between two trees, with None for a missing side. Subtrees with the same
+        hash on both sides are skipped without being read, so the cost follows
+        the size of the change rather than the size of the trees.
+        """
+        if old_hash == new_hash:
+            return
+
+        old_entries = cls._entries_by_name(database, old_hash)
+        new_entries = cls._entries_by_name(database, new_hash)
+        for name in sorted(old_entries.keys() | new_entries.keys()):
+            old, new = old_entries.get(name), new_entries.get(name)
+            if old == new:
+                continue
+
+            path = prefix + name
+            if old and new and old[0] == 'tree' and new[0] == 'tree':
+                yield from cls.diff_trees(database, old[1], new[1], path + "/")
+                continue
+
+            old_files = cls._files_at(database, old, path)
+            new_files = cls._files_at(database, new, path)
+            for file_path in sorted(old_files.keys() | new_files.keys()):
+                old_file, new_file = old_files.get(file_path), new_files.get(file_path)
+                if old_file != new_file:
+                    yield file_path, old_file, new_file
+
+    @classmethod
+    def entry_at(cls, database, tree_hash, path):
+        """Returns the (type, hash) at a file or directory path in a tree, or None if it isn't there."""
+        entry = ('tree', tree_hash)
+        for name in path.strip('/').split('/'):
+            if entry[0] != 'tree':
+                return None
+            entry = cls._entries_by_name(database, entry[1]).get(name)
+            if entry is None:
+                return None
+        return entry
+
+    @classmethod
+    def diff_three(cls, database, base_hash, head_hash, other_hash, prefix=""):
+        """
+        Yields (path, base, head, other) blob hashes for the files a merge has to
+        look at: those that differ between head and other. Subtrees that are
+        identical on both sides, or that other left as they were in base, are
+        skipped without being read.
+        """
+        if head_hash == other_hash or base_hash == other_hash:
+            return
+
+        base_entries = cls._entries_by_name(database, base_hash)
+        head_entries = cls._entries_by_name(database, head_hash)
+        other_entries = cls._entries_by_name(database, other_hash)
+        for name in sorted(base_entries.keys() | head_entries.keys() | other_entries.keys()):
+            base, head, other = base_entries.get(name), head_entries.get(name), other_entries.get(name)
+            if head == other or base == other:
+                continue
+
+            path = prefix + name
+            if head and other and head[0] == 'tree' and other[0] == 'tree' and (base is None or base[0] == 'tree'):
+                yield from cls.diff_three(database, base[1] if base else None, head[1], other[1], path + "/")
+                continue
+
+            base_files = cls._files_at(database, base, path)
+            head_files = cls._files_at(database, head, path)
+            other_files = cls._files_at(database, other, path)
+            for file_path in sorted(base_files.keys() | head_files.keys() | other_files.keys()):
+                head_file, other_file = head_files.get(file_path), other_files.get(file_path)
+                if head_file != other_file:
+                    yield file_path, base_files.get(file_path), head_file, other_file
+
+    @classmethod
+    def diff_index(cls, database, tree_hash, index_entries, cache_tree):
+        """
+        Returns {path: (tree blob hash, index blob hash)} for the files that differ
+        between a tree and the index entries ({path: hash}). Directories whose
+        cache-tree hash matches the tree are skipped on both sides.
+        """
+        tree_files = {}
+        skipped = set()
+        cls._collect_uncached(database, tree_hash, "", cache_tree, tree_files, skipped)
+        if "" in skipped:
+            return {}
 
-        for line in tree_content.splitlines():
-            type, hash_val, name = line.split(' ', 2)
-            path = os.path.join(current_path, name).replace(os.sep, '/')
+        changes = {}
+        skipped_by_dir = {}
+        for path, index_hash in index_entries.items():
+            if cls._in_skipped_dir(path, skipped, skipped_by_dir):
+                continue
+            tree_file = tree_files.get(path)
+            if tree_file != index_hash:
+                changes[path] = (tree_file, index_hash)
+        for path, tree_file in tree_files.items():
+            if path not in index_entries:
+                changes[path] = (tree_file, None)
+        return changes
+
+    @classmethod
+    def read_entries(cls, database, tree_hash):
+        """Reads a tree object into a list of (type, hash, name) tuples, memoized by hash."""
+        key = ('tree', tree_hash)
+        entries = database.parsed_cache.get(key)
+        if entries is None:
+            tree_content = database.read(tree_hash)
+            entries = [tuple(line.split(' ', 2)) for line in tree_content.decode('utf-8').splitlines()]
+            database.parsed_cache.put(key, entries, len(tree_content))
+        return entries
 
+    @classmethod
+    def _walk_tree(cls, database, tree_hash):
+        """
+        Recursively walks tree objects to build a flat dict of {path: hash}
+        relative to the tree. Results are memoized per tree hash, so subtrees
+        shared between commits are only flattened once. The returned dict is
+        shared with the cache and must not be modified.
+        """
+        key = ('flat', tree_hash)
+        entries = database.parsed_cache.get(key)
+        if entries is not None:
+            return entries
+
+        entries = {}
+        size = 0
+        for type, hash_val, name in cls.read_entries(database, tree_hash):
             if type == 'blob':
-                entries[path] = hash_val
+                entries[name] = hash_val
+                size += len(name) + cls.FLAT_ENTRY_OVERHEAD
             elif type == 'tree':
-                sub_entries = cls._walk_tree(database, hash_val, path)
-                entries.update(sub_entries)
+                for sub_path, sub_hash in cls._walk_tree(database, hash_val).items():
+                    path = f"{name}/{sub_path}"
+                    entries[path] = sub_hash
+                    size += len(path) + cls.FLAT_ENTRY_OVERHEAD
         
+        database.parsed_cache.put(key, entries, size)
         return entries
 
+    @classmethod
+    def _entries_by_name(cls, database, tree_hash):
+        """Returns {name: (type, hash)} for a tree, or an empty dict for None."""
+        if tree_hash is None:
+            return {}
+        return {name: (type, hash_val) for type, hash_val, name in cls.read_entries(database, tree_hash)}
+
+    @classmethod
+    def _files_at(cls, database, entry, path):
+        """Returns {path: blob hash} for everything a (type, hash) tree entry holds."""
+        if entry is None:
+            return {}
+        type, hash_val = entry
+        if type == 'blob':
+            return {path: hash_val}
+        return {f"{path}/{sub_path}": sub_hash for sub_path, sub_hash in cls._walk_tree(database, hash_val).items()}
+
+    @classmethod
+    def _collect_uncached(cls, database, tree_hash, directory, cache_tree, files, skipped):
+        """Flattens a tree into files, stopping at directories the cache tree already matches."""
+        if tree_hash is None:
+            return
+        if cache_tree.get(directory) == tree_hash:
+            skipped.add(directory)
+            return
+
+        for type, hash_val, name in cls.read_entries(database, tree_hash):
+            path = f"{directory}/{name}" if directory else name
+            if type == 'tree':
+                cls._collect_uncached(database, hash_val, path, cache_tree, files, skipped)
+            else:
+                files[path] = hash_val
+
+    @staticmethod
+    def _in_skipped_dir(path, skipped, skipped_by_dir):
+        """Checks if any directory above path was skipped, memoizing the answer per directory."""
+        directory = path.rpartition('/')[0]
+        result = skipped_by_dir.get(directory)
+        if result is None:
+            result = False
+            parent = directory
+            while parent:
+                if parent in skipped:
+                    result = True
+                    break
+                parent = parent.rpartition('/')[0]
+            skipped_by_dir[directory] = result
+        return result
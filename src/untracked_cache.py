@@ -0,0 +1,86 @@
+import struct
+
+class UntrackedCache:
+    """
+    Remembers, per worktree directory, what a walk found in it last time: its
+    stat data, its subdirectories and its untracked file names. While the
+    directory's mtime is unchanged no entry can have been added, removed or
+    renamed in it, so a walk can reuse the names instead of listing it again.
+    Tracked files are taken from the index instead. The cache only holds for
+    the .bitignore content it was built with, and is dropped when it changes.
+    Directories are keyed by their relative path with a trailing slash, ""
+    being the root.
+    """
+
+    SIGNATURE = b'UNTR'
+    DIRECTORY = struct.Struct('>IQQII')
+
+    def __init__(self, ignore_hash=None, directories=None):
+        self.ignore_hash = ignore_hash
+        self.directories = directories if directories is not None else {}
+        self.dirty = False
+
+    def use_ignore_hash(self, ignore_hash):
+        """Drops every directory if the ignore rules changed since the cache was built."""
+        if self.ignore_hash != ignore_hash:
+            self.ignore_hash = ignore_hash
+            self.directories.clear()
+            self.dirty = True
+
+    def lookup(self, directory, st):
+        """Returns (subdirectories, untracked names) if the directory is unchanged, else None."""
+        cached = self.directories.get(directory)
+        if cached is None or cached[0] != st.st_mtime_ns or cached[1] != st.st_ino:
+            return None
+        return cached[2], cached[3]
+
+    def set(self, directory, st, subdirectories, untracked):
+        self.directories[directory] = (st.st_mtime_ns, st.st_ino, subdirectories, untracked)
+        self.dirty = True
+
+    def invalidate(self, path):
+        """Forgets the directory holding a file, e.g. when the file stops being tracked."""
+        directory = path.rpartition('/')[0]
+        if self.directories.pop(directory + '/' if directory else "", None) is not None:
+            self.dirty = True
+
+    def retain(self, directories):
+        """Drops directories that the last walk didn't reach."""
+        for directory in list(self.directories):
+            if directory not in directories:
+                del self.directories[directory]
+                self.dirty = True
+
+    def serialize(self):
+        parts = [bytes.fromhex(self.ignore_hash)]
+        for directory in sorted(self.directories):
+            mtime, ino, subdirectories, untracked = self.directories[directory]
+            path_bytes = directory.encode('utf-8')
+            subdirectory_bytes = '\0'.join(subdirectories).encode('utf-8')
+            untracked_bytes = '\0'.join(untracked).encode('utf-8')
+            parts.append(self.DIRECTORY.pack(len(path_bytes), mtime, ino, len(subdirectory_bytes), len(untracked_bytes)))
+            parts.extend([path_bytes, subdirectory_bytes, untracked_bytes])
+        return b''.join(parts)
+
+    @classmethod
+    def parse(cls, data):
+        data = bytes(data)
+        ignore_hash = data[:20].hex()
+        directories = {}
+        offset = 20
+        while offset < len(data):
+            path_length, mtime, ino, subdirectories_length, untracked_length = cls.DIRECTORY.unpack_from(data, offset)
+            offset += cls.DIRECTORY.size
+            directory = data[offset:offset + path_length].decode('utf-8')
+            offset += path_length
+            subdirectories = cls._split_names(data[offset:offset + subdirectories_length])
+            offset += subdirectories_length
+            untracked = cls._split_names(data[offset:offset + untracked_length])
+            offset += untracked_length
+            directories[directory] = (mtime, ino, subdirectories, untracked)
+        return cls(ignore_hash, directories)
+
+    # ----- UTILS -----
+    @staticmethod
+    def _split_names(data):
+        return data.decode('utf-8').split('\0') if data else []
@@ -1,12 +1,20 @@
 import os
 import sys
-import hashlib
-import re
+import stat
+import time
+from .index import IndexEntry
+from .hash_pipeline import HashPipeline
+from .database import Database
+from .ignore_matcher import IgnoreMatcher
 
 class Worktree:
-    def __init__(self, path):
+    SKIPPED_DIRS = ('.bit', '.git')
+    UNTRACKED_CACHE_RACY_NS = 1_000_000_000
+
+    def __init__(self, path, hash_workers=HashPipeline.DEFAULT_WORKERS):
         self.path = path
         self.ignore_path = os.path.join(self.path, '.bitignore')
+        self.hash_pipeline = HashPipeline(hash_workers)
 
     def normalize_path(self, user_path):
         """
@@ -21,12 +29,33 @@ class Worktree:
         with open(os.path.join(self.path, path), 'rb') as f:
             return f.read()
     
-    def write_file(self, path, content_bytes):
-        """Writes to a file in the worktree."""
+    def open_file(self, path):
+        """Opens a worktree file for binary reading, for callers that stream it."""
+        return open(os.path.join(self.path, path), 'rb')
+
+    def stat_file(self, path):
+        """Returns the lstat result for a worktree file, or None if it doesn't exist."""
+        try:
+            return os.lstat(os.path.join(self.path, path))
+        except FileNotFoundError:
+            return None
+
+    def write_file(self, path, content_bytes, create_dirs=True):
+        """Writes to a file in the worktree. Pass create_dirs=False if make_parent_dirs already ran."""
         full_path = os.path.join(self.path, path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if create_dirs:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
         with open(full_path, 'wb') as f:
             f.write(content_bytes)
+
+    def make_parent_dirs(self, paths):
+        """Creates the parent directories of many files up front, each one only once."""
+        created = set()
+        for path in paths:
+            directory = os.path.dirname(path)
+            if directory and directory not in created:
+                os.makedirs(os.path.join(self.path, directory), exist_ok=True)
+                created.add(directory)
             
     def remove_file(self, path):
         """Removes a file and any newly empty parent directories up to the root."""
@@ -51,97 +80,197 @@ class Worktree:
     
     # ----- UTILS -----
         
-    def list_files(self):
+    def list_files(self, untracked_cache=None, tracked=None, changed=None):
         """
         Recursively lists all files in the worktree, respecting .bitignore.
         """
-        files = []
-        ignore_patterns = self.get_ignore_patterns()
-        for root, dirs, filenames in os.walk(self.path):
-            rel_root = self.normalize_path(root)
-            if rel_root == ".":
-                rel_root = ""
-            
-            if '.bit' in dirs:
-                dirs.remove('.bit')
-            if '.git' in dirs:
-                dirs.remove('.git')
-
-            dirs[:] = [d for d in dirs if not self.is_ignored(os.path.join(rel_root, d), ignore_patterns)]
-
-            for filename in filenames:
-                rel_path = os.path.join(rel_root, filename)
-                
-                if not self.is_ignored(rel_path, ignore_patterns):
-                    files.append(rel_path)
-        return files
+        return [rel_path for rel_path, _ in self.walk_files(untracked_cache=untracked_cache, tracked=tracked, changed=changed)]
+
+    def walk_files(self, matcher=None, untracked_cache=None, tracked=None, changed=None):
+        """
+        Yields (relative path, os.DirEntry) for every file in the worktree that
+        isn't ignored. Directories are read with os.scandir, so entry types come
+        from the listing itself and paths are built by concatenation. Ignored
+        directories (and .bit/.git) are never entered. Symlinks to directories
+        are neither listed nor followed.
+
+        With an untracked cache and the tracked paths, directories whose mtime
+        hasn't changed since they were cached aren't listed at all: their
+        tracked files come from the index and their untracked files and
+        subdirectories from the cache. The cache is updated in place.
+
+        With the paths an fsmonitor reported as changed, only the files at or
+        below them are yielded.
+        """
+        if matcher is None:
+            matcher = self.ignore_matcher()
+        if changed is not None:
+            yield from self._walk_changed(matcher, changed)
+            return
+        if untracked_cache is not None:
+            yield from self._walk_with_untracked_cache(matcher, untracked_cache, tracked or {})
+            return
+
+        stack = [("", self.path)]
+        while stack:
+            prefix, directory = stack.pop()
+            files, subdirs = self._scan_directory(prefix, directory, matcher)
+            yield from files
+            stack.extend(reversed(subdirs))
     
-    def list_and_hash_files(self):
+    def list_and_hash_files(self, index=None, refreshed=None, untracked_cache=None, changed=None):
+      """
+      Hashes every file in the worktree, respecting .bitignore.
+      When an index is given, files whose stat data still matches their index
+      entry reuse the cached hash instead of being read; the rest go through
+      the hash pipeline. Re-hashed files whose content turned out to match the
+      index are collected into `refreshed` as IndexEntry objects so the caller
+      can update their stat data. An untracked cache is passed on to walk_files.
+      With the paths an fsmonitor reported as changed, only those are looked at
+      and every other tracked file is taken to match the index.
+      """
       files = {}
-      ignore_patterns = self.get_ignore_patterns()
+      cached_entries = index.load_entries() if index else {}
+      to_hash = []
+      if changed is not None:
+          for rel_path, entry in cached_entries.items():
+              if not self.is_reported(rel_path, changed):
+                  files[rel_path] = entry.hash
       
-      for root, dirs, filenames in os.walk(self.path):
-          rel_root = self.normalize_path(root)
-          if rel_root == ".":
-              rel_root = ""
+      for rel_path, dir_entry in self.walk_files(untracked_cache=untracked_cache, tracked=cached_entries, changed=changed):
+          entry = cached_entries.get(rel_path)
+          st = dir_entry.stat(follow_symlinks=False) if entry else None
+          if entry and index.is_stat_clean(entry, st):
+              files[rel_path] = entry.hash
+              continue
           
-          if '.bit' in dirs:
-              dirs.remove('.bit')
-
-          dirs[:] = [d for d in dirs if not self.is_ignored(os.path.join(rel_root, d), ignore_patterns)]
-
-          for filename in filenames:
-              rel_path = os.path.join(rel_root, filename)
-              
-              if self.is_ignored(rel_path, ignore_patterns):
-                  continue
-                  
-              content = self.read_file(rel_path)
-              file_hash = hashlib.sha1(content).hexdigest()
-              files[rel_path] = file_hash
+          # Keep the walk order; the hash is filled in by the pipeline below
+          files[rel_path] = None
+          to_hash.append((rel_path, entry, st))
+      
+      hashed = self.hash_pipeline.map(lambda item: HashPipeline.hash_file(os.path.join(self.path, item[0])), to_hash)
+      for (rel_path, entry, st), file_hash in hashed:
+          files[rel_path] = file_hash
+          if entry and refreshed is not None and entry.hash == file_hash and st is not None:
+              refreshed[rel_path] = IndexEntry.from_stat(rel_path, file_hash, st)
               
       return files
 
-    def get_ignore_patterns(self):
-        """Returns a list of ignore rules for the current worktree."""
-        regex_patterns = []
-        
-        if os.path.exists(self.ignore_path):
-            with open(self.ignore_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith("#"):
-                        regex_patterns.append(self.compile_pattern(line))
-        
-        return regex_patterns
-
-    def compile_pattern(self, pattern):
-        """Converts a single .bitignore pattern into a regex."""
-        is_dir_only = pattern.endswith('/')
-        if is_dir_only:
-            pattern = pattern[:-1]
-
-        if pattern.startswith('/'):
-            anchored = True
-            pattern = pattern[1:]
-        else:
-            anchored = False
-
-        regex = re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.')
-
-        if anchored:
-            regex = '^' + regex
-        else:
-            # Match start of path or after any directory separator
-            regex = '(^|.*/)' + regex
-
-        if is_dir_only:
-            regex += '(/.*)?$'
-        else:
-            regex += '$'
-
-        return re.compile(regex)
-
-    def is_ignored(self, path, compiled_patterns):
-        """Checks if a normalized path matches any of the compiled patterns."""
-        return any(p.match(path) for p in compiled_patterns)
\ No newline at end of file
+    def ignore_matcher(self):
+        """Returns the compiled .bitignore rules for the current worktree."""
+        return IgnoreMatcher.from_file(self.ignore_path)
+
+    def ignore_hash(self):
+        """Blob hash of the .bitignore file, or of an empty file if there is none."""
+        try:
+            return HashPipeline.hash_file(self.ignore_path)
+        except FileNotFoundError:
+            return Database.hash_content(b'')
+
+    @staticmethod
+    def is_reported(path, changed):
+        """Checks if a path, or a directory above it, is in a set of paths reported as changed."""
+        if path in changed:
+            return True
+        slash = path.find('/')
+        while slash != -1:
+            if path[:slash + 1] in changed:
+                return True
+            slash = path.find('/', slash + 1)
+        return False
+
+    def _scan_directory(self, prefix, directory, matcher):
+        """Lists one directory, returning its files as (path, DirEntry) and its subdirectories as (prefix, path)."""
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+
+        files = []
+        subdirs = []
+        for entry in entries:
+            rel_path = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in self.SKIPPED_DIRS and not matcher.matches(rel_path, is_dir=True):
+                    subdirs.append((rel_path + '/', entry.path))
+            elif not entry.is_dir() and not matcher.matches(rel_path):
+                files.append((rel_path, entry))
+        return files, subdirs
+
+    def _walk_with_untracked_cache(self, matcher, untracked_cache, tracked):
+        untracked_cache.use_ignore_hash(self.ignore_hash())
+        tracked_by_dir = {}
+        for path in tracked:
+            directory, _, name = path.rpartition('/')
+            tracked_by_dir.setdefault(directory + '/' if directory else "", []).append(name)
+
+        # Directories changed within the last second might change again without
+        # their mtime moving, so they are listed but not cached
+        cacheable_before = time.time_ns() - self.UNTRACKED_CACHE_RACY_NS
+        visited = set()
+        stack = [("", self.path)]
+        while stack:
+            prefix, directory = stack.pop()
+            visited.add(prefix)
+            st = os.stat(directory)
+            cached = untracked_cache.lookup(prefix, st)
+
+            if cached is None:
+                files, subdirs = self._scan_directory(prefix, directory, matcher)
+                if st.st_mtime_ns < cacheable_before:
+                    untracked = [rel_path[len(prefix):] for rel_path, _ in files if rel_path not in tracked]
+                    untracked_cache.set(prefix, st, [path[len(prefix):-1] for path, _ in subdirs], untracked)
+                yield from files
+            else:
+                subdir_names, untracked = cached
+                subdirs = [(prefix + name + '/', os.path.join(directory, name)) for name in subdir_names]
+                files = []
+                for name in tracked_by_dir.get(prefix, ()):
+                    rel_path = prefix + name
+                    file_st = self.stat_file(rel_path)
+                    if file_st is not None and not stat.S_ISDIR(file_st.st_mode) and not matcher.matches(rel_path):
+                        files.append((rel_path, _CachedEntry(os.path.join(directory, name), file_st)))
+                for name in untracked:
+                    if prefix + name not in tracked:
+                        files.append((prefix + name, _CachedEntry(os.path.join(directory, name))))
+                files.sort(key=lambda item: item[0])
+                yield from files
+            stack.extend(reversed(subdirs))
+
+        untracked_cache.retain(visited)
+
+    def _walk_changed(self, matcher, changed):
+        """Yields the files at or below reported paths ("dir/" being a directory) that exist and aren't ignored."""
+        for path in sorted(changed):
+            rel_path = path.rstrip('/')
+            parent = rel_path.rpartition('/')[0]
+            if not rel_path or (parent and self.is_reported(parent + '/', changed)):
+                continue # Covered by a reported directory above it
+            if any(name in self.SKIPPED_DIRS for name in rel_path.split('/')):
+                continue
+
+            full_path = os.path.join(self.path, rel_path)
+            st = self.stat_file(rel_path)
+            if st is None:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if matcher.is_ignored(rel_path, is_dir=True):
+                    continue
+                stack = [(rel_path + '/', full_path)]
+                while stack:
+                    prefix, directory = stack.pop()
+                    files, subdirs = self._scan_directory(prefix, directory, matcher)
+                    yield from files
+                    stack.extend(reversed(subdirs))
+            elif not matcher.is_ignored(rel_path) and not os.path.isdir(full_path):
+                yield rel_path, _CachedEntry(full_path, st)
+
+class _CachedEntry:
+    """Stands in for the os.DirEntry of a file listed from the untracked cache."""
+
+    def __init__(self, path, st=None):
+        self.path = path
+        self._st = st
+
+    def stat(self, follow_symlinks=False):
+        if self._st is None:
+            self._st = os.lstat(self.path)
+        return self._st
@@ -20,6 +20,7 @@ class TestRepository(unittest.TestCase):
         self.repo.init() 
 
     def tearDown(self):
+        self.doCleanups()
         os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
         shutil.rmtree(self.test_dir)
 
@@ -32,10 +33,10 @@ class TestRepository(unittest.TestCase):
 
     def _read_object(self, hash_val):
         """ Reads object as bytes """
-        path = os.path.join(self.repo.db.path, hash_val)
-        if not os.path.exists(path): return None # Handle missing object case
-        with open(path, 'rb') as f:
-            return f.read()
+        try:
+            return self.repo.db.read(hash_val)
+        except FileNotFoundError:
+            return None # Handle missing object case
             
     def _read_object_str(self, hash_val):
         """ Reads object as bytes and decodes for string assertions. """
@@ -60,7 +61,7 @@ class TestRepository(unittest.TestCase):
 
     def _get_commit_hash(self, commit_obj: Commit) -> str:
         # Use bytes directly for hashing
-        return self.repo.db.store(commit_obj.serialize().encode('utf-8')) 
+        return self.repo.db.store(commit_obj.serialize().encode('utf-8'), 'commit')
         
     def _get_branch_hash(self, branch_name):
         # Handle nested branches in path
@@ -237,18 +238,1074 @@ class TestRepository(unittest.TestCase):
         status = self.repo.status()
         self.assertIn("new.txt", status.untracked)
 
+    # ----- STAT CACHE TESTS -----
+    def _backdate(self, path, seconds=10):
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10**9))
+
+    def test_status_reuses_hash_for_stat_clean_files(self):
+        self._write_file("file.txt", "content")
+        self._backdate("file.txt")
+        self.repo.add(["file.txt"])
+        self.repo.commit("initial")
+
+        def fail_read(path):
+            raise AssertionError(f"unexpected read of {path}")
+        self.repo.worktree.read_file = fail_read
+
+        self.assertTrue(self.repo.status().is_clean())
+
+    def test_status_rehashes_when_stat_changes(self):
+        self._write_file("file.txt", "v1")
+        self._backdate("file.txt")
+        self.repo.add(["file.txt"])
+        self.repo.commit("initial")
+        self._write_file("file.txt", "v2")
+        self.assertEqual("modified", self.repo.status().unstaged["file.txt"])
+
+    def test_racily_clean_entry_is_not_trusted(self):
+        self._write_file("file.txt", "v1")
+        self.repo.add(["file.txt"])
+        entry = self.repo.index.load_entries()["file.txt"]
+        self.repo.index.mtime = entry.mtime
+        self.assertFalse(self.repo.index.is_stat_clean(entry, os.lstat("file.txt")))
+
+    def test_status_refreshes_stat_data_for_touched_files(self):
+        self._write_file("file.txt", "content")
+        self.repo.add(["file.txt"])
+        self.repo.commit("initial")
+        self._backdate("file.txt")
+        self.assertTrue(self.repo.status().is_clean())
+        entry = self.repo.index.load_entries()["file.txt"]
+        self.assertEqual(os.lstat("file.txt").st_mtime_ns, entry.mtime)
+
+    # ----- UNTRACKED CACHE TESTS -----
+    def _enable_untracked_cache(self):
+        Config(self.repo).set("core", "untrackedCache", "true")
+        self.repo = Repository(self.test_dir)
+
+    def _backdate_dirs(self):
+        for root, dirs, _ in os.walk(self.test_dir):
+            if '.bit' in dirs:
+                dirs.remove('.bit')
+            self._backdate(root)
+
+    def _count_scandirs(self, func):
+        from unittest import mock
+        real_scandir = os.scandir
+        scanned = []
+        def recording_scandir(path):
+            scanned.append(os.path.relpath(path, self.test_dir))
+            return real_scandir(path)
+        with mock.patch("os.scandir", recording_scandir):
+            result = func()
+        return result, scanned
+
+    def test_untracked_cache_skips_unchanged_directories(self):
+        self._enable_untracked_cache()
+        self._write_file("src/tracked.py", "code")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self._write_file("src/untracked.py", "new")
+        self._write_file("vendor/lib/a.js", "a")
+        self._backdate_dirs()
+
+        first = self.repo.status()
+        self.assertEqual(["src/untracked.py", "vendor/lib/a.js"], first.untracked)
+        second, scanned = self._count_scandirs(self.repo.status)
+        self.assertEqual([], scanned)
+        self.assertEqual(first.untracked, second.untracked)
+
+        self._write_file("vendor/lib/b.js", "b")
+        third, scanned = self._count_scandirs(self.repo.status)
+        self.assertEqual(["vendor/lib"], scanned)
+        self.assertEqual(["src/untracked.py", "vendor/lib/a.js", "vendor/lib/b.js"], third.untracked)
+
+    def test_untracked_cache_follows_index_and_ignore_changes(self):
+        self._enable_untracked_cache()
+        self._write_file("dir/keep.txt", "keep")
+        self._write_file("dir/new.log", "log")
+        self.repo.add(["dir/keep.txt"])
+        self.repo.commit("initial")
+        self.repo.add(["dir/new.log"])
+        self._backdate_dirs()
+        self.assertEqual([], self.repo.status().untracked)
+
+        # Unstaging doesn't touch the directory, so the index change must invalidate it
+        self.repo.restore(["dir/new.log"], staged=True)
+        self.assertEqual(["dir/new.log"], self.repo.status().untracked)
+
+        self._write_file(".bitignore", "*.log")
+        self._backdate_dirs()
+        self.assertEqual([".bitignore"], self.repo.status().untracked)
+
+    # ----- FSMONITOR TESTS -----
+    def _start_fsmonitor(self, force_polling=False):
+        import threading
+        Config(self.repo).set("core", "fsmonitor", "true")
+        self.repo = Repository(self.test_dir)
+        daemon = self.repo.fsmonitor_daemon(force_polling)
+        thread = threading.Thread(target=daemon.serve)
+        thread.start()
+        def stop():
+            if thread.is_alive():
+                daemon.stop()
+                thread.join()
+        self.addCleanup(stop)
+        return thread
+
+    def test_fsmonitor_reports_changes_since_token(self):
+        from src.fsmonitor import FSMonitor
+        for force_polling in (False, True):
+            with self.subTest(force_polling=force_polling):
+                thread = self._start_fsmonitor(force_polling)
+                socket_path = self.repo.fsmonitor_socket
+                token, changed = FSMonitor.query(socket_path, None)
+                self.assertIsNone(changed)
+
+                name = "polling" if force_polling else "inotify"
+                self._write_file(f"{name}.txt", "a")
+                self._write_file(f"{name}/b.txt", "b")
+                token, changed = FSMonitor.query(socket_path, token)
+                self.assertIn(f"{name}.txt", changed)
+                self.assertTrue(f"{name}/" in changed or f"{name}/b.txt" in changed)
+                self.assertEqual((token, []), FSMonitor.query(socket_path, token))
+                self.assertIsNone(FSMonitor.query(socket_path, "unknown:0")[1])
+
+                self.assertTrue(self.repo.stop_fsmonitor())
+                thread.join()
+                self.assertIsNone(FSMonitor.query(socket_path, token))
+
+    def test_status_with_fsmonitor_only_looks_at_reported_paths(self):
+        for i in range(3):
+            self._write_file(f"dir{i}/file.txt", f"content {i}")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self._start_fsmonitor()
+        self.assertTrue(self.repo.status().is_clean())
+
+        status, scanned = self._count_scandirs(self.repo.status)
+        self.assertTrue(status.is_clean())
+        self.assertEqual([], scanned)
+
+        self._write_file("dir1/file.txt", "changed")
+        self._write_file("new/inner/file.txt", "new")
+        status, scanned = self._count_scandirs(self.repo.status)
+        self.assertEqual({"dir1/file.txt": "modified"}, status.unstaged)
+        self.assertEqual(["new/inner/file.txt"], status.untracked)
+        self.assertNotIn("dir0", scanned)
+        self.assertEqual(1, len(self.repo.diff()))
+
+        self.repo.add_all()
+        status = self.repo.status()
+        self.assertEqual({"dir1/file.txt": "modified", "new/inner/file.txt": "new file"}, status.staged)
+        self.assertEqual({}, status.unstaged)
+
+    def test_fsmonitor_rechecks_paths_whose_index_entry_changed(self):
+        self._write_file("keep.txt", "keep")
+        self.repo.add(["keep.txt"])
+        self.repo.commit("initial")
+        self._start_fsmonitor()
+        self._write_file("new.txt", "new")
+        self.repo.add(["new.txt"])
+        self.assertEqual([], self.repo.status().untracked)
+
+        # Unstaging doesn't touch the file, so no event reports it
+        self.repo.restore(["new.txt"], staged=True)
+        self.assertEqual(["new.txt"], self.repo.status().untracked)
+
+    def test_clone_while_fsmonitor_runs_leaves_daemon_state_behind(self):
+        from commands.clone import CloneCommand
+        self._enable_untracked_cache()
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self._backdate_dirs()
+        self.repo.status()
+        self._start_fsmonitor()
+        self.repo.status()
+        self.assertIsNotNone(self.repo.index.load_fsmonitor_state())
+        source_inodes = {cached[1] for cached in self.repo.index.load_untracked_cache().directories.values()}
+        self.assertTrue(source_inodes)
+
+        dest_path = os.path.join(self.test_dir, "clone")
+        CloneCommand(self.repo, [self.test_dir, dest_path]).run(print_output=False)
+        dest_repo = Repository(dest_path)
+        self.assertEqual("content", open(os.path.join(dest_path, "file.txt")).read())
+        self.assertFalse(os.path.exists(dest_repo.fsmonitor_socket))
+        self.assertIsNone(dest_repo.index.load_fsmonitor_state())
+        # Checkout may have cached the new worktree's directories, but not the source's
+        dest_cache = dest_repo.index.load_untracked_cache()
+        if dest_cache is not None:
+            self.assertFalse(source_inodes & {cached[1] for cached in dest_cache.directories.values()})
+        self.assertEqual(["file.txt"], list(dest_repo.index.load_as_dict()))
+
+    # ----- INDEX FORMAT TESTS -----
+    def test_index_is_binary_with_checksum(self):
+        self._write_file("file.txt", "content")
+        self.repo.add(["file.txt"])
+        with open(self.repo.index.path, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b"BIDX"))
+        import hashlib
+        self.assertEqual(hashlib.sha1(data[:-20]).digest(), data[-20:])
+
+    def test_index_get_finds_single_path(self):
+        for name in ["b.txt", "a.txt", "dir/c.txt", "d.txt"]:
+            self._write_file(name, name)
+        self.repo.add_all()
+        entry = self.repo.index.get("dir/c.txt")
+        self.assertEqual(self.repo.db.hash_content("dir/c.txt"), entry.hash)
+        self.assertIsNone(self.repo.index.get("missing.txt"))
+
+    def test_index_get_does_not_checksum_whole_file(self):
+        from unittest import mock
+        import src.index
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        with mock.patch.object(src.index.hashlib, "sha1", wraps=src.index.hashlib.sha1) as sha1:
+            self.assertIsNotNone(self.repo.index.get("file.txt"))
+        self.assertEqual(0, sha1.call_count)
+
+    def test_index_rejects_corrupt_file(self):
+        self._write_file("file.txt", "content")
+        self.repo.add(["file.txt"])
+        with open(self.repo.index.path, 'r+b') as f:
+            f.seek(20)
+            f.write(b"\xff")
+        with self.assertRaises(Exception):
+            self.repo.index.load_entries()
+
+    def test_text_index_migrates_on_write(self):
+        hash_val = self.repo.db.store(b"legacy")
+        with open(self.repo.index.path, 'w') as f:
+            f.write(f"{hash_val} legacy file.txt\n")
+        self.assertEqual({"legacy file.txt": hash_val}, self.repo.index.load_as_dict())
+        self._write_file("new.txt", "new")
+        self.repo.add(["new.txt"])
+        with open(self.repo.index.path, 'rb') as f:
+            self.assertTrue(f.read().startswith(b"BIDX"))
+        self.assertIn("legacy file.txt", self.repo.index.load_as_dict())
+
+    # ----- CACHE TREE TESTS -----
+    def test_commit_only_rewrites_trees_above_changed_path(self):
+        self._write_file("a/b/c/deep.txt", "v1")
+        self._write_file("a/other.txt", "other")
+        self._write_file("d/e/f.txt", "f")
+        self.repo.add_all()
+        self.repo.commit("initial")
+
+        self._write_file("a/b/c/deep.txt", "v2")
+        self.repo.add(["a/b/c/deep.txt"])
+
+        stored = []
+        original_store = self.repo.db.store
+        def recording_store(content, *args):
+            stored.append(content)
+            return original_store(content, *args)
+        self.repo.db.store = recording_store
+        self.repo.commit("change deep file")
+
+        # a/b/c, a/b, a and the root tree, plus the commit itself
+        self.assertEqual(5, len(stored))
+
+    def test_cache_tree_matches_full_rebuild(self):
+        from src.cache_tree import CacheTree
+        from src.tree import Tree
+        self._write_file("a/b/one.txt", "1")
+        self._write_file("a/two.txt", "2")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self._write_file("a/b/one.txt", "changed")
+        self.repo.rm("a/two.txt")
+        self.repo.add(["a/b/one.txt"])
+        cached_hash = Tree.build_from_index(self.repo.index, self.repo.db).hash
+
+        self.repo.index.write(self.repo.index.load_entries(), CacheTree())
+        self.assertEqual(cached_hash, Tree.build_from_index(self.repo.index, self.repo.db).hash)
+
+    def test_add_invalidates_only_ancestor_directories(self):
+        self._write_file("a/one.txt", "1")
+        self._write_file("b/two.txt", "2")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self._write_file("a/one.txt", "changed")
+        self.repo.add(["a/one.txt"])
+        cache_tree = self.repo.index.load_cache_tree()
+        self.assertIsNone(cache_tree.get(""))
+        self.assertIsNone(cache_tree.get("a"))
+        self.assertIsNotNone(cache_tree.get("b"))
+
+    # ----- INDEX TRANSACTION TESTS -----
+    def test_add_writes_index_once_for_many_deletions(self):
+        for i in range(20):
+            self._write_file(f"file{i}.txt", str(i))
+        self.repo.add_all()
+        self.repo.commit("initial")
+        for i in range(20):
+            os.remove(f"file{i}.txt")
+
+        # Every write of the index file, from write() or a transaction, goes through _write_locked
+        writes = []
+        original_write = self.repo.index._write_locked
+        def counting_write(*args, **kwargs):
+            writes.append(args)
+            return original_write(*args, **kwargs)
+        self.repo.index._write_locked = counting_write
+
+        self.assertEqual(20, self.repo.add_all())
+        self.assertEqual(1, len(writes))
+        self.assertEqual({}, self.repo.index.load_as_dict())
+
+    def test_index_transaction_discards_changes_on_error(self):
+        self._write_file("file.txt", "content")
+        self.repo.add(["file.txt"])
+        with self.assertRaises(FileNotFoundError):
+            self.repo.add(["file.txt", "missing.txt"])
+        with self.assertRaises(RuntimeError):
+            with self.repo.index.transaction() as index:
+                index.remove("file.txt")
+                raise RuntimeError("abort")
+        self.assertIn("file.txt", self.repo.index.load_as_dict())
+        self.assertFalse(os.path.exists(self.repo.index.path + ".lock"))
+
+    def test_index_write_fails_when_locked(self):
+        open(self.repo.index.path + ".lock", "w").close()
+        self._write_file("file.txt", "content")
+        with self.assertRaises(Exception):
+            self.repo.add(["file.txt"])
+        self.assertTrue(self.repo.index.is_empty())
+
+    def test_index_transaction_holds_lock_until_it_ends(self):
+        self._write_file("first.txt", "first")
+        self._write_file("second.txt", "second")
+        with self.repo.index.transaction() as index:
+            index.add("first.txt", self.repo.db.store(b"first"))
+            with self.assertRaises(FileExistsError):
+                self.repo.add(["second.txt"])
+            with self.assertRaises(FileExistsError):
+                self.repo.index.transaction()
+            # status still works, it just skips saving refreshed stat data
+            self.repo.status()
+        self.assertFalse(os.path.exists(self.repo.index.path + ".lock"))
+        self.assertEqual(["first.txt"], list(self.repo.index.load_as_dict()))
+
+        self.repo.add(["second.txt"])
+        self.assertEqual(["first.txt", "second.txt"], list(self.repo.index.load_as_dict()))
+
+    # ----- OBJECT LAYOUT TESTS -----
+    def test_objects_are_stored_in_fanout_directories(self):
+        hash_val = self.repo.db.store(b"content")
+        self.assertTrue(os.path.isfile(os.path.join(self.repo.db.path, hash_val[:2], hash_val[2:])))
+        self.assertFalse(os.path.exists(os.path.join(self.repo.db.path, hash_val)))
+
+    def test_read_falls_back_to_flat_layout(self):
+        hash_val = self.repo.db.hash_content(b"legacy")
+        with open(os.path.join(self.repo.db.path, hash_val), 'wb') as f:
+            f.write(b"legacy")
+        self.assertEqual(b"legacy", self.repo.db.read(hash_val))
+
+    def test_migrate_objects_moves_flat_objects(self):
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("initial")
+        for name in os.listdir(self.repo.db.path):
+            fanout_dir = os.path.join(self.repo.db.path, name)
+            for rest in os.listdir(fanout_dir):
+                os.replace(os.path.join(fanout_dir, rest), os.path.join(self.repo.db.path, name + rest))
+            os.rmdir(fanout_dir)
+        self.repo.db.created_dirs.clear()
+
+        self.assertEqual(3, self.repo.db.migrate_objects())
+        self.assertEqual(0, self.repo.db.migrate_objects())
+        self.assertTrue(os.path.isfile(self.repo.db.object_path(commit_hash)))
+        self.assertEqual("initial", list(self.repo.log())[0].commit.message)
+
+    def test_objects_are_compressed_with_typed_header(self):
+        import zlib
+        self._write_file("file.txt", "hello")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("initial")
+        with open(self.repo.db.object_path(commit_hash), 'rb') as f:
+            raw = zlib.decompress(f.read())
+        self.assertTrue(raw.startswith(b"commit "))
+        self.assertEqual(self.repo.db.hash_content(b"hello"), self.repo.index.load_as_dict()["file.txt"])
+
+    def test_read_object_and_header_report_type_and_size(self):
+        self._write_file("file.txt", "hello")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("initial")
+        commit = Commit.parse(self.repo.db.read(commit_hash))
+        self.assertEqual(("tree", len(self.repo.db.read(commit.tree_hash))), self.repo.db.read_header(commit.tree_hash))
+        blob_hash = self.repo.index.load_as_dict()["file.txt"]
+        self.assertEqual(("blob", 5, b"hello"), self.repo.db.read_object(blob_hash))
+        self.assertEqual("commit", self.repo.db.read_header(commit_hash)[0])
+
+    def test_object_hash_covers_its_type(self):
+        # Same hash as `git hash-object` for a file containing "hello"
+        self.assertEqual("b6fc4c620b67d95f953a5c1c1230aaab5db5a1b0", self.repo.db.hash_content(b"hello"))
+        content = f"blob {'a' * 40} file.txt".encode()
+        blob_hash = self.repo.db.store(content, 'blob')
+        tree_hash = self.repo.db.store(content, 'tree')
+        self.assertNotEqual(blob_hash, tree_hash)
+        self.assertEqual(("blob", len(content)), self.repo.db.read_header(blob_hash))
+        self.assertEqual(("tree", len(content), content), self.repo.db.read_object(tree_hash))
+
+    def test_migrate_objects_compresses_raw_objects(self):
+        tree_content = f"blob {'a' * 40} file.txt".encode()
+        hash_val = self.repo.db.hash_content(tree_content)
+        os.makedirs(os.path.dirname(self.repo.db.object_path(hash_val)), exist_ok=True)
+        with open(self.repo.db.object_path(hash_val), 'wb') as f:
+            f.write(tree_content)
+        self.assertEqual(("tree", len(tree_content)), self.repo.db.read_header(hash_val))
+        self.assertEqual(1, self.repo.db.migrate_objects())
+        self.assertEqual(("tree", len(tree_content), tree_content), self.repo.db.read_object(hash_val))
+
+    def test_store_stream_matches_store(self):
+        import io
+        content = os.urandom(self.repo.db.CHUNK_SIZE * 2 + 5)
+        with open("big.bin", "wb") as f:
+            f.write(content)
+        with open("big.bin", "rb") as f:
+            hash_val = self.repo.db.store_stream(f)
+        self.assertEqual(self.repo.db.hash_content(content), hash_val)
+        self.assertEqual(("blob", len(content), content), self.repo.db.read_object(hash_val))
+        self.assertEqual([], [name for name in os.listdir(self.repo.db.path) if name.startswith("tmp_obj_")])
+
+        with self.assertRaises(Exception):
+            self.repo.db.store_stream(io.BytesIO(b"short"), size=100)
+        self.assertEqual([], [name for name in os.listdir(self.repo.db.path) if name.startswith("tmp_obj_")])
+
+    def test_add_streams_files_above_big_file_threshold(self):
+        Config(self.repo).set("core", "bigFileThreshold", "1k")
+        repo = Repository(self.test_dir)
+        self._write_file("small.txt", "small")
+        self._write_file("big.txt", "x" * 4096)
+        streamed = []
+        original_store_stream = repo.db.store_stream
+        def recording_store_stream(fileobj, *args, **kwargs):
+            streamed.append(os.path.basename(fileobj.name))
+            return original_store_stream(fileobj, *args, **kwargs)
+        repo.db.store_stream = recording_store_stream
+
+        repo.add_all()
+        self.assertEqual(["big.txt"], streamed)
+        self.assertEqual(b"x" * 4096, repo.db.read(repo.index.get("big.txt").hash))
+
+    def test_batched_objects_are_published_when_batch_ends(self):
+        db = self.repo.db
+        with db.batch():
+            hash_val = db.store(b"batched")
+            self.assertFalse(os.path.exists(db.object_path(hash_val)))
+            self.assertEqual(b"batched", db.read(hash_val))
+            self.assertTrue(db.has_object(hash_val))
+        self.assertTrue(os.path.exists(db.object_path(hash_val)))
+        self.assertEqual([], [name for name in os.listdir(db.path) if name.startswith("tmp_obj_")])
+
+        with self.assertRaises(ValueError):
+            with db.batch():
+                discarded = db.store(b"discarded")
+                raise ValueError("abort")
+        self.assertFalse(db.has_object(discarded))
+        self.assertEqual([], [name for name in os.listdir(db.path) if name.startswith("tmp_obj_")])
+
+    def test_add_syncs_each_batch_once_and_its_directories_by_default(self):
+        from unittest import mock
+        from src.database import ObjectWriteBatch
+        for i in range(10):
+            self._write_file(f"file{i}.txt", f"content {i}")
+
+        repo = Repository(self.test_dir)
+        synced_dirs = []
+        with mock.patch("os.sync") as sync, mock.patch("os.fsync", wraps=os.fsync) as fsync, \
+                mock.patch.object(ObjectWriteBatch, "_sync_dir", side_effect=synced_dirs.append):
+            repo.add_all()
+        self.assertEqual(1, sync.call_count)
+        # Only the directories: the objects are flushed by the one os.sync()
+        self.assertEqual(0, fsync.call_count)
+        fanout_dirs = {os.path.dirname(repo.db.object_path(h)) for h in repo.index.load_as_dict().values()}
+        self.assertEqual(sorted(fanout_dirs) + [repo.db.path], synced_dirs)
+
+        # core.fsyncObjectFiles only opts out
+        self._write_file("file0.txt", "changed")
+        Config(self.repo).set("core", "fsyncObjectFiles", "false")
+        repo = Repository(self.test_dir)
+        with mock.patch("os.sync") as sync, mock.patch("os.fsync") as fsync:
+            repo.add_all()
+        self.assertEqual(0, sync.call_count)
+        self.assertEqual(0, fsync.call_count)
+
+    # ----- PACK TESTS -----
+    def test_delta_round_trip(self):
+        from src.delta import Delta
+        base = b"".join(f"line {i}\n".encode() for i in range(500))
+        target = base[:1000] + b"inserted text\n" + base[1200:] + b"appended\n"
+        delta = Delta.compute(base, target)
+        self.assertLess(len(delta), len(target) // 10)
+        self.assertEqual(target, Delta.apply(base, delta))
+
+    def test_gc_packs_objects_with_deltas(self):
+        lines = [f"line {i}\n" for i in range(400)]
+        commits = []
+        for version in range(5):
+            lines[version * 50] = f"edit {version}\n"
+            self._write_file("big.txt", "".join(lines))
+            self.repo.add_all()
+            commits.append(self.repo.commit(f"v{version}"))
+
+        object_count, delta_count = self.repo.gc()
+        self.assertGreaterEqual(delta_count, 4)
+        self.assertEqual([], list(self.repo.db.loose_objects()))
+        self.assertEqual(1, len(self.repo.db.packs))
+        self.assertEqual(object_count, self.repo.db.packs[0].count)
+
+        fresh_repo = Repository(self.test_dir)
+        self.assertEqual(5, len(list(fresh_repo.log())))
+        fresh_repo.reset(commits[0], mode="--hard")
+        self.assertIn("edit 0\n", self._read_worktree_file_str("big.txt"))
+        self.assertNotIn("edit 1\n", self._read_worktree_file_str("big.txt"))
+
+    def test_repack_then_gc_consolidates_packs(self):
+        self._write_file("a.txt", "a")
+        self.repo.add_all()
+        self.repo.commit("a")
+        self.repo.repack()
+        self._write_file("b.txt", "b")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("b")
+        self.repo.repack()
+        self.assertEqual(2, len(self.repo.db.packs))
+
+        self.repo.gc()
+        self.assertEqual(1, len(self.repo.db.packs))
+        self.assertEqual("b", Commit.parse(self.repo.db.read(commit_hash)).message)
+        self.assertEqual(("commit", len(self.repo.db.read(commit_hash))), self.repo.db.read_header(commit_hash))
+
+    def test_repack_streams_big_objects_without_reading_them_whole(self):
+        from unittest import mock
+        from src.database import Database
+        import random
+        rng = random.Random(7)
+        content = bytes(rng.getrandbits(8) for _ in range(200 * 1024))
+        with open("big.bin", "wb") as f:
+            f.write(content)
+        self._write_file("small.txt", "small")
+        self.repo.add_all()
+        self.repo.commit("big")
+        big_hash = self.repo.index.load_as_dict()["big.bin"]
+        self.repo.big_file_threshold = 100 * 1024
+
+        read_hashes = []
+        original = Database.read_object
+        def read_object(db, hash):
+            read_hashes.append(hash)
+            return original(db, hash)
+        with mock.patch.object(Database, "read_object", read_object):
+            self.repo.repack() # From the loose object
+            self.repo.gc() # From the first pack
+        self.assertNotIn(big_hash, read_hashes)
+        self.assertIn(self.repo.index.load_as_dict()["small.txt"], read_hashes)
+
+        fresh_repo = Repository(self.test_dir)
+        self.assertEqual(1, len(fresh_repo.db.packs))
+        self.assertEqual(content, fresh_repo.db.read(big_hash))
+
+    def test_pack_reload_keeps_packs_other_readers_hold(self):
+        import threading
+        blob_hashes = self._commit_versions(3)
+        self.repo.gc()
+        db = Repository(self.test_dir).db
+        pack = db.packs[0]
+
+        errors = []
+        def read_loop():
+            try:
+                for _ in range(200):
+                    for hash_val in blob_hashes:
+                        pack.read_object(hash_val)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=read_loop) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(50):
+            with self.assertRaises(FileNotFoundError):
+                db.read("0" * 40)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertIs(pack, db.packs[0])
+
+    def test_store_skips_objects_already_packed(self):
+        hash_val = self.repo.db.store(b"packed content")
+        self.repo.gc()
+        self.assertEqual(hash_val, self.repo.db.store(b"packed content"))
+        self.assertEqual([], list(self.repo.db.loose_objects()))
+
+    def _commit_versions(self, count):
+        lines = [f"line {i}\n" for i in range(400)]
+        blob_hashes = []
+        for version in range(count):
+            lines[version * 50] = f"edit {version}\n"
+            self._write_file("big.txt", "".join(lines))
+            self.repo.add_all()
+            self.repo.commit(f"v{version}")
+            blob_hashes.append(self.repo.index.load_as_dict()["big.txt"])
+        return blob_hashes
+
+    def test_pack_read_header_does_not_resolve_deltas(self):
+        from src.delta import Delta
+        blob_hashes = self._commit_versions(4)
+        self.repo.gc()
+        pack = Repository(self.test_dir).db.packs[0]
+        sizes = {h: len(pack.read_object(h)[2]) for h in blob_hashes}
+
+        original_apply = Delta.apply
+        Delta.apply = staticmethod(lambda base, delta: self.fail("delta applied"))
+        try:
+            for hash_val in blob_hashes:
+                self.assertEqual(("blob", sizes[hash_val]), pack.read_header(hash_val))
+        finally:
+            Delta.apply = original_apply
+
+    def test_pack_caches_delta_bases(self):
+        blob_hashes = self._commit_versions(4)
+        self.repo.gc()
+        pack = Repository(self.test_dir).db.packs[0]
+        contents = [pack.read_object(h)[2] for h in blob_hashes]
+        self.assertGreater(len(pack.delta_base_cache), 0)
+        self.assertEqual(contents, [Repository(self.test_dir).db.read(h) for h in blob_hashes])
+
+    # ----- OBJECT CACHE TESTS -----
+    def test_lru_cache_evicts_least_recently_used_within_budget(self):
+        from src.lru_cache import LRUCache
+        cache = LRUCache(10)
+        cache.put("a", b"aaaa", 4)
+        cache.put("b", b"bbbb", 4)
+        cache.get("a")
+        cache.put("c", b"cccc", 4)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(8, cache.current_bytes)
+        self.assertEqual((1, 0, 1), (cache.hits, cache.misses, cache.evictions))
+
+    def test_database_serves_repeated_reads_from_cache(self):
+        hash_val = self.repo.db.store(b"cached content")
+        self.repo.db.read(hash_val)
+        os.remove(self.repo.db.object_path(hash_val))
+        self.assertEqual(b"cached content", self.repo.db.read(hash_val))
+        self.assertEqual(1, self.repo.db.cache.hits)
+        self.assertEqual(1, self.repo.db.cache.misses)
+
+    def test_object_cache_size_is_configurable(self):
+        config = Config(self.repo)
+        config.set("core", "objectCacheSize", "2k")
+        self.assertEqual(2048, Repository(self.test_dir).db.cache.max_bytes)
+
+        config.set("core", "objectCacheSize", "0")
+        repo = Repository(self.test_dir)
+        hash_val = repo.db.store(b"not cached")
+        repo.db.read(hash_val)
+        self.assertEqual(0, len(repo.db.cache))
+
+    def test_commit_load_is_memoized(self):
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("initial")
+        self.assertIs(Commit.load(self.repo.db, commit_hash), Commit.load(self.repo.db, commit_hash))
+
+    def test_flattened_trees_are_memoized_and_shared_between_commits(self):
+        from src.tree import Tree
+        self._write_file("shared/a.txt", "a")
+        self._write_file("shared/b.txt", "b")
+        self._write_file("top.txt", "v1")
+        self.repo.add_all()
+        first = self.repo.commit("first")
+        self._write_file("top.txt", "v2")
+        self.repo.add_all()
+        second = self.repo.commit("second")
+
+        self.repo.db.cache.clear()
+        self.repo.db.parsed_cache.clear()
+        Tree.get_entries_from_commit(self.repo.db, first)
+        reads_before = self.repo.db.cache.misses
+        entries = Tree.get_entries_from_commit(self.repo.db, second)
+        # Only the second commit and its root tree are read; "shared" is reused
+        self.assertEqual(2, self.repo.db.cache.misses - reads_before)
+        self.assertEqual({"shared/a.txt", "shared/b.txt", "top.txt"}, set(entries))
+
+        entries["top.txt"] = "mutated"
+        self.assertNotEqual("mutated", Tree.get_entries_from_commit(self.repo.db, second)["top.txt"])
+
+    # ----- TREE DIFF TESTS -----
+    def _tree_hash(self, commit_hash):
+        return Commit.load(self.repo.db, commit_hash).tree_hash
+
+    def test_diff_trees_skips_identical_subtrees(self):
+        from src.tree import Tree
+        for i in range(5):
+            self._write_file(f"big/dir{i}/file.txt", str(i))
+        self._write_file("small/a.txt", "a")
+        self._write_file("small/b.txt", "b")
+        self.repo.add_all()
+        first = self.repo.commit("first")
+        self._write_file("small/a.txt", "changed")
+        os.remove("small/b.txt")
+        self._write_file("small/c.txt", "c")
+        self.repo.add_all()
+        second = self.repo.commit("second")
+
+        first_tree, second_tree = self._tree_hash(first), self._tree_hash(second)
+        self.repo.db.cache.clear()
+        self.repo.db.parsed_cache.clear()
+        reads_before = self.repo.db.cache.misses
+        changes = list(Tree.diff_trees(self.repo.db, first_tree, second_tree))
+        self.assertEqual(["small/a.txt", "small/b.txt", "small/c.txt"], [path for path, _, _ in changes])
+        self.assertIsNone(changes[1][2])
+        self.assertIsNone(changes[2][1])
+        # Two root trees and two "small" trees; "big" is never opened
+        self.assertEqual(4, self.repo.db.cache.misses - reads_before)
+
+    def test_diff_trees_handles_file_replaced_by_directory(self):
+        from src.tree import Tree
+        self._write_file("thing", "file")
+        self.repo.add_all()
+        first = self.repo.commit("first")
+        self.repo.rm("thing")
+        self._write_file("thing/inner.txt", "inner")
+        self.repo.add(["thing/inner.txt"])
+        second = self.repo.commit("second")
+
+        changes = {path: (old, new) for path, old, new in Tree.diff_trees(self.repo.db, self._tree_hash(first), self._tree_hash(second))}
+        self.assertEqual({"thing", "thing/inner.txt"}, set(changes))
+        self.assertIsNone(changes["thing"][1])
+        self.assertIsNone(changes["thing/inner.txt"][0])
+
+    def test_diff_three_only_yields_paths_changed_between_branches(self):
+        from src.tree import Tree
+        self._write_file("shared/x.txt", "x")
+        self._write_file("mine.txt", "base")
+        self._write_file("theirs.txt", "base")
+        self.repo.add_all()
+        base = self.repo.commit("base")
+        self.repo.branch("feature")
+        self._write_file("mine.txt", "head")
+        self.repo.add_all()
+        head = self.repo.commit("head change")
+        self.repo.checkout("feature")
+        self._write_file("theirs.txt", "other")
+        self.repo.add_all()
+        other = self.repo.commit("other change")
+
+        changes = list(Tree.diff_three(self.repo.db, self._tree_hash(base), self._tree_hash(head), self._tree_hash(other)))
+        # mine.txt is skipped too: other left it as it was in base, so head's version wins
+        self.assertEqual(["theirs.txt"], [path for path, _, _, _ in changes])
+        _, base_hash, head_hash, other_hash = changes[0]
+        self.assertEqual(base_hash, head_hash)
+        self.assertNotEqual(base_hash, other_hash)
+
+    def test_staged_diff_uses_cache_tree_to_skip_head(self):
+        from src.tree import Tree
+        self._write_file("a/one.txt", "1")
+        self._write_file("b/two.txt", "2")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("initial")
+        entries, cache_tree = self.repo.index.load()
+        index_entries = {path: entry.hash for path, entry in entries.items()}
+
+        tree_hash = self._tree_hash(commit_hash)
+        self.repo.db.parsed_cache.clear()
+        reads_before = self.repo.db.cache.misses
+        self.assertEqual({}, Tree.diff_index(self.repo.db, tree_hash, index_entries, cache_tree))
+        self.assertEqual(0, self.repo.db.cache.misses - reads_before)
+
+        self._write_file("a/one.txt", "changed")
+        self.repo.add(["a/one.txt"])
+        self._write_file("c.txt", "new")
+        self.repo.add(["c.txt"])
+        self.assertEqual({"a/one.txt": "modified", "c.txt": "new file"}, self.repo.status().staged)
+
+    # ----- HASH PIPELINE TESTS -----
+    def test_hash_pipeline_yields_results_in_input_order(self):
+        import random, time
+        from src.hash_pipeline import HashPipeline
+        def slow_square(n):
+            time.sleep(random.random() / 200)
+            return n * n
+        results = list(HashPipeline(4).map(slow_square, range(50)))
+        self.assertEqual([(n, n * n) for n in range(50)], results)
+
+    def test_hash_pipeline_streams_files(self):
+        import hashlib
+        from src.hash_pipeline import HashPipeline
+        content = os.urandom(HashPipeline.CHUNK_SIZE * 3 + 17)
+        with open("big.bin", "wb") as f:
+            f.write(content)
+        self.assertEqual(self.repo.db.hash_content(content), HashPipeline.hash_file("big.bin"))
+        self.assertEqual(hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest(), HashPipeline.hash_file("big.bin"))
+
+    def test_parallel_hashing_matches_serial_results(self):
+        for i in range(40):
+            self._write_file(f"dir{i % 4}/file{i}.txt", f"content {i}")
+        serial = self.repo.worktree.list_and_hash_files()
+
+        Config(self.repo).set("core", "hashWorkers", "4")
+        repo = Repository(self.test_dir)
+        self.assertEqual(4, repo.worktree.hash_pipeline.workers)
+        self.assertEqual(list(serial.items()), list(repo.worktree.list_and_hash_files().items()))
+
+        self.assertEqual(40, repo.add_all())
+        self.assertEqual(serial, repo.index.load_as_dict())
+        self.assertEqual(set(serial), set(repo.status().staged))
+
+    # ----- COMMIT GRAPH TESTS -----
+    def _diverged_history(self):
+        """Commits base, then one commit on master and one on side, and merges side. Returns the four hashes."""
+        self._write_file("common.txt", "base")
+        self.repo.add_all()
+        base = self.repo.commit("base")
+        self.repo.branch("side")
+        self._write_file("master.txt", "master")
+        self.repo.add_all()
+        master = self.repo.commit("master change")
+        self.repo.checkout("side")
+        self._write_file("side.txt", "side")
+        self.repo.add_all()
+        side = self.repo.commit("side change")
+        self.repo.checkout("master")
+        self.repo.merge("side")
+        return base, master, side, self._get_branch_hash("master")
+
+    def _count_commit_parses(self, func):
+        from unittest import mock
+        self.repo.db.parsed_cache.clear()
+        with mock.patch.object(Commit, "parse", wraps=Commit.parse) as parse:
+            result = func()
+        return result, parse.call_count
+
+    def test_commit_writes_commit_graph_with_generations(self):
+        base, master, side, merge = self._diverged_history()
+        graph = Repository(self.test_dir).db.commit_graph
+        self.assertEqual(4, graph.count)
+        generations = {h: graph.generation_at(graph.position(h)) for h in (base, master, side, merge)}
+        self.assertEqual({base: 1, master: 2, side: 2, merge: 3}, generations)
+        self.assertEqual([master, side], graph.parents(merge))
+        self.assertEqual([], graph.parents(base))
+        merge_commit = Commit.load(self.repo.db, merge)
+        self.assertEqual(merge_commit.tree_hash, graph.tree_hash_at(graph.position(merge)))
+        self.assertEqual(merge_commit.timestamp, graph.commit_time_at(graph.position(merge)))
+
+    def test_log_and_merge_base_read_parents_from_commit_graph(self):
+        from src.merge import Merge
+        from src.ref import Ref
+        base, master, side, _ = self._diverged_history()
+        logs, parses = self._count_commit_parses(lambda: list(self.repo.log()))
+        self.assertEqual(4, len(logs))
+        self.assertEqual(0, parses)
+
+        self.repo.reset(master, "--hard")
+        merge = Merge(self.repo, Ref.from_symbol(self.repo, "HEAD"), Ref.from_branch(self.repo, "side"))
+        ancestor, parses = self._count_commit_parses(merge.find_common_ancestor)
+        self.assertEqual(base, ancestor)
+        self.assertEqual(0, parses)
+
+    def test_gc_rebuilds_commit_graph_with_octopus_merges(self):
+        base, master, side, merge = self._diverged_history()
+        self._write_file("third.txt", "third")
+        self.repo.add_all()
+        third = self.repo.commit("third")
+        octopus = self.repo.db.store(Commit(Commit.load(self.repo.db, third).tree_hash, [third, master, side], "octopus").serialize(), 'commit')
+        with open(os.path.join(self.repo.bit_dir, "refs", "heads", "master"), "w") as f:
+            f.write(octopus)
+        os.remove(self.repo.db.commit_graph_path)
+
+        self.repo.gc()
+        graph = Repository(self.test_dir).db.commit_graph
+        self.assertEqual(6, graph.count)
+        self.assertEqual([third, master, side], graph.parents(octopus))
+        self.assertEqual(5, graph.generation_at(graph.position(octopus)))
+        self.assertEqual([merge], graph.parents(third))
+
+    def test_commit_adds_commit_graph_layers_instead_of_rewriting_it(self):
+        from src.commit_graph import CommitGraph
+        layers_dir = os.path.join(os.path.dirname(self.repo.db.commit_graph_path), CommitGraph.LAYERS_DIR)
+        hashes = []
+        for i in range(8):
+            self._write_file(f"file{i}.txt", "content")
+            self.repo.add_all()
+            hashes.append(self.repo.commit(f"commit {i}"))
+        self.repo.gc()
+        self.assertEqual([], CommitGraph.read_chain(layers_dir))
+        base_stat = os.stat(self.repo.db.commit_graph_path)
+
+        for i in range(8, 11):
+            self._write_file(f"file{i}.txt", "content")
+            self.repo.add_all()
+            hashes.append(self.repo.commit(f"commit {i}"))
+        stat = os.stat(self.repo.db.commit_graph_path)
+        self.assertEqual((base_stat.st_ino, base_stat.st_mtime_ns), (stat.st_ino, stat.st_mtime_ns))
+        self.assertEqual([2, 1], [layer.layer_count for layer in self.repo.db.commit_graph.layers()[1:]])
+
+        graph = Repository(self.test_dir).db.commit_graph
+        self.assertEqual(11, graph.count)
+        for generation, commit_hash in enumerate(hashes, start=1):
+            position = graph.position(commit_hash)
+            self.assertEqual(generation, graph.generation_at(position))
+            self.assertEqual(hashes[generation - 2:generation - 1], graph.parents(commit_hash))
+            self.assertEqual(Commit.load(self.repo.db, commit_hash).tree_hash, graph.tree_hash_at(position))
+            self.assertTrue(graph.bloom_filter_at(position).might_contain(f"file{generation - 1}.txt"))
+
+        self.repo.gc()
+        self.assertEqual([], CommitGraph.read_chain(layers_dir))
+        self.assertEqual([], [name for name in os.listdir(layers_dir) if name.endswith(".graph")])
+        self.assertEqual(11, self.repo.db.commit_graph.count)
+
+    def test_commit_graph_chain_is_dropped_when_its_base_was_rewritten(self):
+        import shutil
+        import tempfile
+        from src.commit_graph import CommitGraph
+        layers_dir = os.path.join(os.path.dirname(self.repo.db.commit_graph_path), CommitGraph.LAYERS_DIR)
+        for i in range(4):
+            self._write_file(f"file{i}.txt", "content")
+            self.repo.add_all()
+            self.repo.commit(f"commit {i}")
+        self.repo.gc()
+        self._write_file("layered.txt", "content")
+        self.repo.add_all()
+        layered = self.repo.commit("layered")
+        self.assertEqual(2, len(self.repo.db.commit_graph.layers()))
+        saved_layers = os.path.join(tempfile.mkdtemp(), "layers")
+        self.addCleanup(shutil.rmtree, os.path.dirname(saved_layers))
+        shutil.copytree(layers_dir, saved_layers)
+
+        # A gc rewrites the base while a commit still writes its layer for the old one
+        self.repo.branch("side")
+        self.repo.checkout("side")
+        self._write_file("side.txt", "content")
+        self.repo.add_all()
+        self.repo.commit("side")
+        self.repo.gc()
+        self.repo.db.close_commit_graph()
+        shutil.rmtree(layers_dir)
+        shutil.copytree(saved_layers, layers_dir)
+
+        graph = Repository(self.test_dir).db.commit_graph
+        self.assertEqual(1, len(graph.layers()))
+        self.assertEqual(6, graph.count)
+        self.assertEqual([Commit.load(self.repo.db, layered).parent_hashes[0]], graph.parents(layered))
+
+        # A layer whose trailer doesn't match its name is dropped too
+        self.repo.checkout("master")
+        self._write_file("next.txt", "content")
+        self.repo.add_all()
+        self.repo.commit("next")
+        self.repo.db.close_commit_graph()
+        (name, _), = CommitGraph.read_chain(layers_dir)
+        with open(os.path.join(layers_dir, name), "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 1]))
+        self.assertEqual(1, len(Repository(self.test_dir).db.commit_graph.layers()))
+
+    def test_commit_leaves_bloom_filters_of_version_1_graph_to_gc(self):
+        import hashlib
+        from unittest import mock
+        from src.commit_graph import CommitGraph
+        from src.tree import Tree
+        hashes = []
+        for i in range(4):
+            self._write_file(f"file{i}.txt", "content")
+            self.repo.add_all()
+            hashes.append(self.repo.commit(f"commit {i}"))
+        self.repo.gc()
+        graph = self.repo.db.commit_graph
+        v1 = bytearray(graph.data[:graph.blooms_start])
+        v1[4:8] = (1).to_bytes(4, "big")
+        self.repo.db.close_commit_graph()
+        with open(self.repo.db.commit_graph_path, "wb") as f:
+            f.write(bytes(v1) + hashlib.sha1(v1).digest())
+
+        self._write_file("new.txt", "content")
+        self.repo.add_all()
+        with mock.patch.object(Tree, "diff_trees", wraps=Tree.diff_trees) as diff_trees:
+            new = self.repo.commit("new")
+        self.assertEqual(1, diff_trees.call_count)
+        graph = self.repo.db.commit_graph
+        self.assertEqual([1, 2], [layer.version for layer in graph.layers()])
+        self.assertIsNone(graph.bloom_filter_at(graph.position(hashes[2])))
+        self.assertTrue(graph.bloom_filter_at(graph.position(new)).might_contain("new.txt"))
+
+        self.repo.gc()
+        graph = self.repo.db.commit_graph
+        self.assertEqual([CommitGraph.VERSION], [layer.version for layer in graph.layers()])
+        self.assertFalse(graph.bloom_filter_at(graph.position(hashes[2])).might_contain("file3.txt"))
+        self.assertTrue(graph.bloom_filter_at(graph.position(hashes[2])).might_contain("file2.txt"))
+
+    # ----- MERGE BASE TESTS -----
+    def _store_commits(self, parents_by_name):
+        """Stores commits sharing one tree from {name: [parent names]}, in order. Returns {name: hash}."""
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        tree_hash = Commit.load(self.repo.db, self.repo.commit("root")).tree_hash
+        hashes = {}
+        for timestamp, (name, parents) in enumerate(parents_by_name.items(), start=1000):
+            commit = Commit(tree_hash, [hashes[p] for p in parents], name, timestamp=timestamp)
+            hashes[name] = self.repo.db.store(commit.serialize(), 'commit')
+        return hashes
+
+    def test_merge_base_picks_best_ancestor_of_criss_cross_merges(self):
+        from src.merge_base import MergeBase
+        commits = self._store_commits({
+            "base": [], "x1": ["base"], "y1": ["base"],
+            "x2": ["x1", "y1"], "y2": ["y1", "x1"],
+        })
+        for with_graph in (False, True):
+            with self.subTest(with_graph=with_graph):
+                if with_graph:
+                    self.repo.db.write_commit_graph(list(commits.values()))
+                merge_base = MergeBase(self.repo.db)
+                self.assertEqual(commits["y1"], merge_base.find(commits["x2"], commits["y2"]))
+                self.assertEqual(commits["base"], merge_base.find(commits["x1"], commits["y1"]))
+                self.assertEqual(commits["x1"], merge_base.find(commits["x1"], commits["x2"]))
+
+    def test_merge_base_stops_walking_at_shared_history(self):
+        from unittest import mock
+        from src.merge_base import MergeBase
+        history = {"c0": []}
+        for i in range(1, 50):
+            history[f"c{i}"] = [f"c{i - 1}"]
+        history.update({"left": ["c49"], "right": ["c49"]})
+        commits = self._store_commits(history)
+        self.repo.db.write_commit_graph([commits["left"], commits["right"]])
+
+        with mock.patch.object(Commit, "parents_of", wraps=Commit.parents_of) as parents_of:
+            self.assertEqual(commits["c49"], MergeBase(self.repo.db).find(commits["left"], commits["right"]))
+        self.assertLess(parents_of.call_count, 5)
+
+    def test_merge_base_results_are_cached_on_disk(self):
+        from unittest import mock
+        from src.merge_base import MergeBase
+        commits = self._store_commits({"base": [], "a": ["base"], "b": ["base"]})
+        cache_path = os.path.join(self.repo.bit_dir, MergeBase.CACHE_NAME)
+        self.assertEqual(commits["base"], MergeBase(self.repo.db, cache_path).find(commits["a"], commits["b"]))
+
+        with mock.patch.object(Commit, "parents_of", side_effect=AssertionError("walked history")):
+            self.assertEqual(commits["base"], MergeBase(self.repo.db, cache_path).find(commits["b"], commits["a"]))
+
     # ----- LOG TESTS -----
     def test_log_empty_repo(self):
         shutil.rmtree(self.repo.bit_dir) 
         self.repo.init() 
-        logs = self.repo.log()
+        logs = list(self.repo.log())
         self.assertEqual([], logs)
 
     def test_log_initial_commit(self):
         self._write_file("file.txt", "content")
         self.repo.add(["file.txt"])
         commit_hash = self.repo.commit("Initial commit")
-        logs = self.repo.log()
+        logs = list(self.repo.log())
         self.assertEqual(1, len(logs))
         log_entry = logs[0]
         self.assertEqual(commit_hash, log_entry.hash)
@@ -257,6 +1314,170 @@ class TestRepository(unittest.TestCase):
         self.assertEqual("master", current_branch) 
         self.assertIn("master", log_entry.refs)
 
+    def _commit_chain(self, count):
+        hashes = []
+        for i in range(count):
+            self._write_file("file.txt", f"version {i}")
+            self.repo.add(["file.txt"])
+            hashes.append(self.repo.commit(f"commit {i}"))
+        return hashes[::-1]
+
+    def test_log_max_count_and_skip(self):
+        hashes = self._commit_chain(5)
+        self.assertEqual(hashes[:2], [log.hash for log in self.repo.log(max_count=2)])
+        self.assertEqual(hashes[3:], [log.hash for log in self.repo.log(skip=3)])
+        self.assertEqual([hashes[1]], [log.hash for log in self.repo.log(max_count=1, skip=1)])
+        self.assertEqual([], list(self.repo.log(max_count=0)))
+
+    def test_log_walks_history_only_as_far_as_it_is_read(self):
+        from unittest import mock
+        self._commit_chain(10)
+        with mock.patch.object(Commit, "parents_of", wraps=Commit.parents_of) as parents_of:
+            logs = self.repo.log()
+            next(logs)
+            self.assertEqual(0, parents_of.call_count)
+            next(logs)
+            self.assertEqual(1, parents_of.call_count)
+
+    def test_log_follows_every_parent_and_all_branches(self):
+        base, master, side, merge = self._diverged_history()
+        self.repo.branch("other")
+        self.repo.checkout("other")
+        self.repo.reset(base, "--hard")
+        self._write_file("other.txt", "other")
+        self.repo.add_all()
+        other = self.repo.commit("other change")
+        self.repo.checkout("master")
+
+        hashes = [log.hash for log in self.repo.log()]
+        self.assertEqual([merge, base], [hashes[0], hashes[-1]])
+        self.assertEqual({base, master, side, merge}, set(hashes))
+        all_hashes = [log.hash for log in self.repo.log(all=True)]
+        self.assertEqual({base, master, side, merge, other}, set(all_hashes))
+        self.assertEqual(len(all_hashes), len(set(all_hashes)))
+        # side is both a tip and a parent of merge
+        topo_hashes = [log.hash for log in self.repo.log(all=True, topo_order=True)]
+        self.assertEqual(sorted(all_hashes), sorted(topo_hashes))
+        self.assertLess(topo_hashes.index(merge), topo_hashes.index(side))
+
+    def test_log_date_order_shows_same_second_children_before_parents(self):
+        from src.rev_walk import RevWalk
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        tree_hash = Commit.load(self.repo.db, self.repo.commit("root")).tree_hash
+        def store(parents, message):
+            return self.repo.db.store(Commit(tree_hash, parents, message, timestamp=1000).serialize(), 'commit')
+        for i in range(20):
+            base = store([], f"base {i}")
+            left = store([base], f"left {i}")
+            right = store([base], f"right {i}")
+            merge = store([left, right], f"merge {i}")
+            hashes = list(RevWalk(self.repo.db, [merge]))
+            self.assertEqual([merge, base], [hashes[0], hashes[-1]])
+
+    def test_log_topo_order_never_shows_a_commit_before_its_children(self):
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        root = self.repo.commit("root")
+        tree_hash = Commit.load(self.repo.db, root).tree_hash
+        def store(parents, timestamp):
+            return self.repo.db.store(Commit(tree_hash, parents, "commit", timestamp=timestamp).serialize(), 'commit')
+        # p's clock ran ahead of its children's
+        p = store([root], 4000)
+        c1 = store([p], 3000)
+        d = store([p], 3500)
+        m = store([c1, d], 6000)
+        with open(os.path.join(self.repo.bit_dir, "refs", "heads", "master"), "w") as f:
+            f.write(m)
+
+        self.assertEqual([m, d, p, root, c1], [log.hash for log in self.repo.log()])
+        for with_graph in (False, True):
+            with self.subTest(with_graph=with_graph):
+                if with_graph:
+                    self.repo.db.write_commit_graph([m])
+                self.assertEqual([m, d, c1, p, root], [log.hash for log in self.repo.log(topo_order=True)])
+
+    def test_log_graph_draws_branches_and_merges(self):
+        from src.rev_walk import RevWalk
+        from src.log_graph import LogGraph
+        commits = self._store_commits({
+            "base": [], "master": ["base"], "side": ["base"], "merge": ["master", "side"],
+        })
+        names = {h: name for name, h in commits.items()}
+        graph = LogGraph()
+        lines = []
+        for commit_hash in RevWalk(self.repo.db, [commits["merge"]], topo_order=True):
+            parents = Commit.parents_of(self.repo.db, commit_hash)
+            lines.extend(graph.format(commit_hash, parents, names[commit_hash] + "\n").split("\n"))
+        self.assertEqual(["* merge", "|\\", "| * side", "| |", "* | master", "|/", "* base", ""], lines)
+
+    def test_log_paths_lists_only_commits_that_changed_them(self):
+        base, master, side, merge = self._diverged_history()
+        self.assertEqual([side], [log.hash for log in self.repo.log(paths=["side.txt"])])
+        self.assertEqual([master], [log.hash for log in self.repo.log(paths=["master.txt"])])
+        self.assertEqual([base], [log.hash for log in self.repo.log(paths=["common.txt"])])
+        self.assertEqual(4, len(list(self.repo.log(paths=["."]))))
+
+        os.remove(self.repo.db.commit_graph_path)
+        self.repo.db.close_commit_graph()
+        self.assertEqual([side], [log.hash for log in self.repo.log(paths=["side.txt"])])
+
+    def test_log_paths_only_reads_trees_of_commits_passing_bloom_filter(self):
+        from unittest import mock
+        from src.tree import Tree
+        hashes = []
+        for i in range(10):
+            self._write_file(f"dir/file{i}.txt", "content")
+            self.repo.add_all()
+            hashes.append(self.repo.commit(f"commit {i}"))
+
+        graph = self.repo.db.commit_graph
+        bloom = graph.bloom_filter_at(graph.position(hashes[3]))
+        self.assertTrue(bloom.might_contain("dir/file3.txt"))
+        self.assertTrue(bloom.might_contain("dir"))
+        self.assertFalse(bloom.might_contain("dir/file4.txt"))
+
+        with mock.patch.object(Tree, "entry_at", wraps=Tree.entry_at) as entry_at:
+            logs = [log.hash for log in self.repo.log(paths=["dir/file3.txt"])]
+        self.assertEqual([hashes[3]], logs)
+        self.assertEqual(2, entry_at.call_count)
+        self.assertEqual(10, len(list(self.repo.log(paths=["dir"]))))
+
+    def test_log_command_only_reports_no_commits_on_unborn_head(self):
+        import io
+        from unittest import mock
+        from commands.log import LogCommand
+        from pager import Pager
+        def run_log(*args):
+            command = LogCommand(self.repo, list(args))
+            command.pager = Pager(use_pager=False)
+            with mock.patch("sys.stdout", io.StringIO()) as output:
+                command.run()
+            return output.getvalue()
+
+        self.assertEqual("No commits yet.\n", run_log())
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        self.repo.commit("first")
+        self.assertEqual("", run_log("-n", "0"))
+        self.assertEqual("", run_log("--skip=5"))
+        self.assertIn("first", run_log())
+
+    def test_pager_streams_lines_as_they_are_produced(self):
+        import io
+        from unittest import mock
+        from pager import Pager
+        output = io.StringIO()
+        written_before = []
+        def lines():
+            for i in range(3):
+                written_before.append(output.getvalue())
+                yield f"line {i}"
+        with mock.patch("sys.stdout", output):
+            Pager(use_pager=False).stream(lines())
+        self.assertEqual(["", "line 0\n", "line 0\nline 1\n"], written_before)
+        self.assertEqual("line 0\nline 1\nline 2\n", output.getvalue())
+
     # ----- BRANCH TESTS -----
     def test_branch_list_initial(self):
         self._write_file("init.txt", "go")
@@ -275,6 +1496,51 @@ class TestRepository(unittest.TestCase):
         develop_hash = self._get_branch_hash("develop")
         self.assertEqual(commit_hash, develop_hash)
 
+    # ----- PACKED REFS TESTS -----
+    def _branch_hash(self, branch):
+        from src.ref import Ref
+        return Ref.from_branch(self.repo, branch).read_hash()
+
+    def test_pack_refs_moves_branches_into_sorted_packed_refs(self):
+        self._write_file("file.txt", "content")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("Initial commit")
+        self.repo.branch("zeta")
+        self.repo.branch("alpha")
+
+        self.assertEqual(3, self.repo.pack_refs())
+        self.assertEqual([], os.listdir(os.path.join(self.repo.bit_dir, "refs", "heads")))
+        with open(os.path.join(self.repo.bit_dir, "packed-refs")) as f:
+            lines = f.read().splitlines()[1:]
+        self.assertEqual([f"{commit_hash} refs/heads/{b}" for b in ("alpha", "master", "zeta")], lines)
+
+        self.assertEqual(["alpha", "master", "zeta"], self.repo.list_branches())
+        self.assertEqual(commit_hash, self._branch_hash("zeta"))
+        with self.assertRaises(FileExistsError):
+            self.repo.branch("alpha")
+        self.repo.checkout("alpha")
+        self.assertEqual(["alpha", "master", "zeta"], list(self.repo.log())[0].refs)
+
+    def test_loose_ref_overrides_packed_ref(self):
+        self._write_file("file.txt", "one")
+        self.repo.add_all()
+        first = self.repo.commit("one")
+        self.repo.branch("side")
+        self.repo.pack_refs()
+
+        self._write_file("file.txt", "two")
+        self.repo.add_all()
+        second = self.repo.commit("two")
+        self.assertEqual(second, self._branch_hash("master"))
+        self.assertEqual(first, self.repo.packed_refs.get("refs/heads/master"))
+        self.assertEqual([first, second][::-1], [log.hash for log in self.repo.log()])
+        self.assertEqual([["master"], ["side"]], [log.refs for log in self.repo.log()])
+
+        # Packing again folds the newer loose ref back in
+        self.assertEqual(2, self.repo.pack_refs())
+        self.assertEqual(second, self.repo.packed_refs.get("refs/heads/master"))
+        self.assertEqual([], os.listdir(os.path.join(self.repo.bit_dir, "refs", "heads")))
+
     # ----- CHECKOUT TESTS -----
     def test_checkout_updates_head(self):
         self._write_file("file.txt", "content")
@@ -284,6 +1550,90 @@ class TestRepository(unittest.TestCase):
         self.repo.checkout("develop")
         self.assertEqual("develop", self._read_head_branch())
 
+    def _set_mtime(self, path, mtime=1000000000):
+        os.utime(path, (mtime, mtime))
+        return os.stat(path).st_mtime_ns
+
+    def test_checkout_only_rewrites_changed_files(self):
+        self._write_file("same.txt", "same")
+        self._write_file("changes.txt", "v1")
+        self._write_file("gone.txt", "gone")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self.repo.branch("develop")
+        self.repo.checkout("develop")
+        self._write_file("changes.txt", "v2")
+        self._write_file("dir/added.txt", "added")
+        self.repo.rm("gone.txt")
+        self.repo.add_all()
+        self.repo.commit("develop change")
+
+        untouched_mtime = self._set_mtime("same.txt")
+        self.repo.checkout("master")
+        self.assertEqual(untouched_mtime, os.stat("same.txt").st_mtime_ns)
+        self.assertEqual("v1", self._read_worktree_file_str("changes.txt"))
+        self.assertEqual("gone", self._read_worktree_file_str("gone.txt"))
+        self.assertFalse(os.path.exists("dir"))
+        self.assertTrue(self.repo.status().is_clean())
+
+    def test_reset_hard_only_rewrites_dirty_files(self):
+        self._write_file("same.txt", "same")
+        self._write_file("edited.txt", "v1")
+        self.repo.add_all()
+        commit_hash = self.repo.commit("initial")
+        self._write_file("edited.txt", "local edit")
+        self._write_file("staged.txt", "staged")
+        self.repo.add(["staged.txt"])
+
+        untouched_mtime = self._set_mtime("same.txt")
+        self.repo.reset(commit_hash, mode="--hard")
+        self.assertEqual(untouched_mtime, os.stat("same.txt").st_mtime_ns)
+        self.assertEqual("v1", self._read_worktree_file_str("edited.txt"))
+        self.assertFalse(os.path.exists("staged.txt"))
+        self.assertEqual({"same.txt", "edited.txt"}, set(self.repo.index.load_as_dict()))
+        self.assertTrue(self.repo.status().is_clean())
+
+    def _branch_with_many_files(self, count):
+        self._write_file("base.txt", "base")
+        self.repo.add_all()
+        self.repo.commit("initial")
+        self.repo.branch("develop")
+        self.repo.checkout("develop")
+        for i in range(count):
+            self._write_file(f"dir{i % 3}/file{i}.txt", f"content {i}")
+        self.repo.add_all()
+        self.repo.commit("many files")
+        self.repo.checkout("master")
+
+    def test_parallel_checkout_writes_every_file(self):
+        self._branch_with_many_files(30)
+        config = Config(self.repo)
+        config.set("checkout", "workers", "4")
+        config.set("checkout", "thresholdForParallelism", "10")
+
+        self.repo.checkout("develop")
+        for i in range(30):
+            self.assertEqual(f"content {i}", self._read_worktree_file_str(f"dir{i % 3}/file{i}.txt"))
+        self.assertTrue(self.repo.status().is_clean())
+
+    def test_parallel_checkout_reports_first_error_in_path_order(self):
+        import random, time
+        self._branch_with_many_files(30)
+        config = Config(self.repo)
+        config.set("checkout", "workers", "8")
+        config.set("checkout", "thresholdForParallelism", "10")
+
+        original_write = self.repo.worktree.write_file
+        def failing_write(path, content, create_dirs=True):
+            time.sleep(random.random() / 100)
+            if path in ("dir2/file29.txt", "dir0/file3.txt"):
+                raise OSError(f"cannot write {path}")
+            original_write(path, content, create_dirs)
+        self.repo.worktree.write_file = failing_write
+
+        with self.assertRaisesRegex(OSError, "dir0/file3.txt"):
+            self.repo.checkout("develop")
+
     # ----- MERGE TESTS -----
     def test_merge_fast_forward(self):
         """Tests that a merge is handled as a fast-forward when possible."""
@@ -389,7 +1739,7 @@ class TestRepository(unittest.TestCase):
         self.repo.checkout("master")
         self.repo.merge("side")
         
-        logs = self.repo.log()
+        logs = list(self.repo.log())
         # The first log entry should be the merge commit
         merge_log_text = logs[0].format()
         self.assertIn("Merge:", merge_log_text)
@@ -651,6 +2001,38 @@ class TestRepository(unittest.TestCase):
         for path in status.untracked:
             self.assertFalse(path.startswith(".bit"), f"Found internal file in status: {path}")
             
+    def test_ignore_matcher_rule_kinds(self):
+        from src.ignore_matcher import IgnoreMatcher
+        matcher = IgnoreMatcher(["*.log", "/build", "docs/*.tmp", "cache/", "**/generated"])
+        self.assertTrue(matcher.matches("deep/dir/app.log"))
+        self.assertTrue(matcher.matches("build", is_dir=True))
+        self.assertFalse(matcher.matches("src/build", is_dir=True))
+        self.assertTrue(matcher.matches("docs/a.tmp"))
+        self.assertTrue(matcher.matches("nested/docs/a.tmp"))
+        self.assertFalse(matcher.matches("docs/sub/a.tmp"))
+        self.assertTrue(matcher.matches("cache", is_dir=True))
+        self.assertFalse(matcher.matches("cache"))
+        self.assertTrue(matcher.matches("a/b/generated"))
+        self.assertTrue(matcher.is_ignored("cache/inner/file.txt"))
+        self.assertFalse(matcher.is_ignored("src/main.py"))
+
+    def test_walker_does_not_enter_ignored_directories(self):
+        from unittest import mock
+        self._write_file(".bitignore", "node_modules/")
+        for i in range(5):
+            self._write_file(f"node_modules/pkg{i}/index.js", "x")
+        self._write_file("src/app.js", "app")
+
+        real_scandir = os.scandir
+        scanned = []
+        def recording_scandir(path):
+            scanned.append(os.path.relpath(path, self.test_dir))
+            return real_scandir(path)
+        with mock.patch("os.scandir", recording_scandir):
+            files = self.repo.worktree.list_files()
+        self.assertEqual([".bitignore", "src/app.js"], files)
+        self.assertEqual([".", "src"], scanned)
+
     # ----- RESTORE TESTS -----
     def test_restore_worktree_reverts_to_index(self):
         """Tests bit restore <file> reverts worktree to match the index."""
@@ -866,7 +2248,7 @@ class TestRepository(unittest.TestCase):
             
         # Verify the history is present
         cloned_repo = Repository(dest_path)
-        logs = cloned_repo.log()
+        logs = list(cloned_repo.log())
         self.assertEqual(len(logs), 1)
         self.assertEqual(logs[0].commit.message, "initial commit")
 
@@ -943,6 +2325,42 @@ class TestRepository(unittest.TestCase):
         config.set("user", "email", "local@example.com", global_flag=False)
         
         self.assertEqual(config.get("user", "email"), "local@example.com")
+
+    def test_invalid_config_values_fall_back_to_defaults(self):
+        import io
+        from contextlib import redirect_stderr
+        from src.database import Database
+        config = Config(self.repo)
+        config.set("core", "objectCacheSize", "lots")
+        config.set("core", "fsyncObjectFiles", "maybe")
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            repo = Repository(self.test_dir)
+        self.assertEqual(Database.DEFAULT_CACHE_SIZE, repo.db.cache.max_bytes)
+        self.assertIn("core.objectCacheSize", stderr.getvalue())
+        self.assertIn("core.fsyncObjectFiles", stderr.getvalue())
+
+        # The config can still be fixed with bit config
+        config.set("core", "objectCacheSize", "1m")
+        self.assertEqual(1024 * 1024, Config(repo).get_int("core", "objectCacheSize"))
+
+    def test_broken_config_is_parsed_and_reported_once(self):
+        import io
+        import configparser
+        from contextlib import redirect_stderr
+        from unittest import mock
+        from src.database import Database
+        with open(os.path.join(self.repo.bit_dir, "config"), "w") as f:
+            f.write("[core\nbigFileThreshold = 1k\n")
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr), mock.patch.object(configparser.ConfigParser, "read",
+                                                        autospec=True, side_effect=configparser.ConfigParser.read) as read:
+            repo = Repository(self.test_dir)
+        self.assertEqual(1, read.call_count)
+        self.assertEqual(1, stderr.getvalue().count("Could not parse config"))
+        self.assertEqual(Database.DEFAULT_BIG_FILE_THRESHOLD, repo.big_file_threshold)
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file